@@ -1,8 +1,18 @@
+import json
 import os
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
+# Context windows in tokens; "provider:model" entries take precedence over "provider" ones
+DEFAULT_MODEL_CONTEXT_TOKENS = {
+    "groq": 131072,
+    "gemini": 1048576,
+    "openrouter": 131072,
+    "huggingface": 8192,  # The serverless endpoint truncates long inputs below the model's window
+}
+
 
 class Config:
     """Application configuration"""
@@ -26,12 +36,164 @@ class Config:
     OPENROUTER_MODEL = "meta-llama/llama-3.2-3b-instruct:free"
     OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
     
+    # Model tiering: inputs up to the per-task token limit try a small fast model first and
+    # escalate to the task's regular (large) model when the output fails validation
+    MODEL_TIERING_ENABLED = os.getenv("MODEL_TIERING_ENABLED", "false").lower() == "true"
+    GROQ_SMALL_CHAT_MODEL = os.getenv("GROQ_SMALL_CHAT_MODEL", "llama-3.1-8b-instant")
+    SMALL_TIER_PROVIDERS = os.getenv("SMALL_TIER_PROVIDERS", "groq,huggingface")  # Tried in order
+    SMALL_TIER_MAX_INPUT_TOKENS = {  # 0 always uses the large model
+        "profile_extraction": int(os.getenv("SMALL_TIER_MAX_TOKENS_PROFILE", 1500)),
+        "cv_generation": int(os.getenv("SMALL_TIER_MAX_TOKENS_CV", 0)),
+        "technical_test": int(os.getenv("SMALL_TIER_MAX_TOKENS_TECHNICAL_TEST", 0)),
+    }
+    
+    # Prompt token budgets: longer transcriptions are deduplicated and extractively condensed
+    # to the task's budget before prompting, and max_tokens is sized from the input
+    PROMPT_BUDGET_ENABLED = os.getenv("PROMPT_BUDGET_ENABLED", "true").lower() == "true"
+    TOKENIZER = os.getenv("TOKENIZER", "tiktoken")  # "tiktoken" (when installed) or "heuristic"
+    PROMPT_TRANSCRIPTION_BUDGETS = {  # Max transcription tokens pasted into each prompt
+        "profile_extraction": int(os.getenv("PROMPT_BUDGET_PROFILE_TOKENS", 3000)),
+        "cv_generation": int(os.getenv("PROMPT_BUDGET_CV_TOKENS", 2000)),
+    }
+    # MODEL_CONTEXT_TOKENS (JSON) overrides or adds context windows; unlisted models get the default
+    MODEL_CONTEXT_TOKENS = {**DEFAULT_MODEL_CONTEXT_TOKENS, **json.loads(os.getenv("MODEL_CONTEXT_TOKENS") or "{}")}
+    MODEL_CONTEXT_TOKENS_DEFAULT = int(os.getenv("MODEL_CONTEXT_TOKENS_DEFAULT", 8192))
+    OUTPUT_TOKEN_SCALING = {  # (minimum, output tokens per transcription token), capped by each call's default
+        "profile_extraction": (600, 0.5),
+        "cv_generation": (700, 1.0),
+    }
+    
+    # Provider quota tracking: usage per provider and model, checked before each call so work
+    # moves to providers with headroom. PROVIDER_QUOTAS (JSON) holds the limits of your plans:
+    # {"provider" or "provider:model": {"<requests|tokens|audio_seconds>_per_<minute|hour|day>": limit}}
+    QUOTA_TRACKING_ENABLED = os.getenv("QUOTA_TRACKING_ENABLED", "false").lower() == "true"
+    PROVIDER_QUOTAS = json.loads(os.getenv("PROVIDER_QUOTAS") or "{}")
+    QUOTA_LOW_PRIORITY_RESERVE = float(os.getenv("QUOTA_LOW_PRIORITY_RESERVE", 0.2))  # Share kept for normal work
+    QUOTA_DEFER_MAX_SECONDS = float(os.getenv("QUOTA_DEFER_MAX_SECONDS", 300))  # Max wait of a low priority call
+    QUOTA_RATE_LIMIT_COOLDOWN = float(os.getenv("QUOTA_RATE_LIMIT_COOLDOWN", 30))  # After a 429
+    QUOTA_FLUSH_INTERVAL = float(os.getenv("QUOTA_FLUSH_INTERVAL", 10))  # Daily counters to MongoDB
+    QUOTA_RETENTION_DAYS = int(os.getenv("QUOTA_RETENTION_DAYS", 30))
+    
+    # Cross-replica coordination: per-minute and per-hour PROVIDER_QUOTAS as global token buckets,
+    # and provider backoff after failures, per process ("local"), shared through "mongodb" or "off".
+    # "mongodb" adds a MongoDB round trip to every provider call, so it is opt-in for multi-replica deployments
+    COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "local")
+    COORDINATION_MAX_WAIT = float(os.getenv("COORDINATION_MAX_WAIT", 5))  # Normal priority wait for a token
+    COORDINATION_HEALTH_REFRESH = float(os.getenv("COORDINATION_HEALTH_REFRESH", 2))  # Seconds between reads
+    PROVIDER_BACKOFF_MIN = float(os.getenv("PROVIDER_BACKOFF_MIN", 5))  # After a timeout or outage; doubles
+    PROVIDER_BACKOFF_MAX = float(os.getenv("PROVIDER_BACKOFF_MAX", 300))
+    
+    # Gemini audio: inline below this size (request limit is 20 MB, base64 adds a third),
+    # otherwise uploaded once per content hash and deleted when unused for the reuse TTL
+    GEMINI_INLINE_AUDIO_MAX_BYTES = int(os.getenv("GEMINI_INLINE_AUDIO_MAX_BYTES", 14 * 1024 * 1024))
+    GEMINI_FILE_REUSE_TTL = float(os.getenv("GEMINI_FILE_REUSE_TTL", 600))
+    GEMINI_FILE_READY_TIMEOUT = float(os.getenv("GEMINI_FILE_READY_TIMEOUT", 60))
+    GEMINI_FILE_ORPHAN_AGE = float(os.getenv("GEMINI_FILE_ORPHAN_AGE", 3600))
+    
+    # Primary transcription provider: groq, gemini or local
+    TRANSCRIPTION_PROVIDER = os.getenv("TRANSCRIPTION_PROVIDER", "groq")
+    
+    # Local CPU transcription (faster-whisper, optional dependency)
+    LOCAL_TRANSCRIPTION_ENABLED = os.getenv("LOCAL_TRANSCRIPTION_ENABLED", "false").lower() == "true"
+    LOCAL_WHISPER_MODEL = os.getenv("LOCAL_WHISPER_MODEL", "small")  # tiny, base, small, medium, large-v3, ...
+    LOCAL_WHISPER_COMPUTE_TYPE = os.getenv("LOCAL_WHISPER_COMPUTE_TYPE", "int8")
+    LOCAL_WHISPER_CPU_THREADS = int(os.getenv("LOCAL_WHISPER_CPU_THREADS", 4))  # Per process
+    LOCAL_WHISPER_PROCESSES = int(os.getenv("LOCAL_WHISPER_PROCESSES", max(1, (os.cpu_count() or 1) // 4)))
+    LOCAL_WHISPER_BEAM_SIZE = int(os.getenv("LOCAL_WHISPER_BEAM_SIZE", 1))
+    LOCAL_WHISPER_LANGUAGE = os.getenv("LOCAL_WHISPER_LANGUAGE", "es")
+    LOCAL_WHISPER_MODEL_DIR = os.getenv("LOCAL_WHISPER_MODEL_DIR", "")
+    LOCAL_WHISPER_TIMEOUT = float(os.getenv("LOCAL_WHISPER_TIMEOUT", 600))
+    
     # Performance settings
     REQUEST_TIMEOUT = 60  # seconds
     MAX_RETRIES = 2
     ENABLE_CACHE = True
     ENABLE_FALLBACK = True  # Auto fallback to other services on error
     
+    # Logging settings
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Records beyond this are dropped, never blocking
+    LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", 0.05))  # Fraction of raw model outputs logged
+    LOG_PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 300))
+    
+    # Tracing settings
+    TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")  # "none", "jsonl" or "otlp"
+    TRACE_JSONL_PATH = os.getenv("TRACE_JSONL_PATH", "traces/traces.jsonl")
+    TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "video-profile-api")
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.1))
+    TRACE_SLOW_THRESHOLD_MS = float(os.getenv("TRACE_SLOW_THRESHOLD_MS", 30000))  # Slower traces are always kept
+    
+    # Admin and profiling settings (profiling endpoints are not registered unless enabled)
+    ADMIN_API_KEY = os.getenv("ADMIN_API_KEY", "")
+    PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() == "true"
+    PROFILING_INTERVAL_MS = float(os.getenv("PROFILING_INTERVAL_MS", 10))
+    PROFILING_MAX_SECONDS = int(os.getenv("PROFILING_MAX_SECONDS", 300))
+    
+    # Prompt cache settings
+    PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", 300))  # Safety net if a change is missed
+    PROMPT_POLL_INTERVAL = float(os.getenv("PROMPT_POLL_INTERVAL", 15))  # Version poll when change streams are unavailable
+    PROMPT_CHANGE_STREAMS = os.getenv("PROMPT_CHANGE_STREAMS", "true").lower() == "true"
+    
+    # HTTP caching (Cache-Control max-age); clients and CDNs revalidate with If-None-Match afterwards
+    STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))  # The HTML page at /
+    PROMPT_MAX_AGE = int(os.getenv("PROMPT_MAX_AGE", 60))  # GET /prompts and /prompts/{name}
+    
+    # Candidate storage and search
+    CANDIDATES_ENABLED = os.getenv("CANDIDATES_ENABLED", "false").lower() == "true"  # Store /upload-video results (opt-in)
+    CANDIDATE_INDEX_REFRESH_INTERVAL = float(os.getenv("CANDIDATE_INDEX_REFRESH_INTERVAL", 5))  # Catch up with other workers
+    
+    # Speculative technical tests: generated at low priority after profile extraction and
+    # served by /generate-technical-test when the company sends the same profile
+    SPECULATIVE_TESTS_ENABLED = os.getenv("SPECULATIVE_TESTS_ENABLED", "false").lower() == "true"
+    SPECULATIVE_TESTS_DAILY_LIMIT = int(os.getenv("SPECULATIVE_TESTS_DAILY_LIMIT", 200))  # Tests per UTC day
+    SPECULATIVE_TESTS_DAILY_TOKENS = int(os.getenv("SPECULATIVE_TESTS_DAILY_TOKENS", 1000000))  # Estimated
+    SPECULATIVE_TESTS_MAX_PENDING = int(os.getenv("SPECULATIVE_TESTS_MAX_PENDING", 20))
+    SPECULATIVE_TESTS_WORKERS = int(os.getenv("SPECULATIVE_TESTS_WORKERS", 1))
+    TECHNICAL_TEST_TTL_DAYS = int(os.getenv("TECHNICAL_TEST_TTL_DAYS", 14))  # Stored tests expire after this
+    TECHNICAL_TEST_MEMORY_ENTRIES = int(os.getenv("TECHNICAL_TEST_MEMORY_ENTRIES", 256))
+
+    # POST /generate-technical-test/batch
+    TECHNICAL_TEST_BATCH_MAX_ITEMS = int(os.getenv("TECHNICAL_TEST_BATCH_MAX_ITEMS", 100))
+    TECHNICAL_TEST_BATCH_CONCURRENCY = int(os.getenv("TECHNICAL_TEST_BATCH_CONCURRENCY", 4))  # Calls in flight per batch
+    
+    # POST /upload-videos
+    VIDEO_BATCH_MAX_VIDEOS = int(os.getenv("VIDEO_BATCH_MAX_VIDEOS", 50))
+    VIDEO_BATCH_MAX_ENTRY_MB = int(os.getenv("VIDEO_BATCH_MAX_ENTRY_MB", 500))  # Per video inside an archive
+    VIDEO_BATCH_PREFETCH = int(os.getenv("VIDEO_BATCH_PREFETCH", 1))  # Videos converted ahead of the AI stages
+    
+    # Resumable uploads (/uploads): chunks written in place to the scratch area, shared by the workers of a host
+    UPLOAD_SCRATCH_DIR = os.getenv("UPLOAD_SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "video-uploads"))
+    UPLOAD_MAX_SIZE_MB = int(os.getenv("UPLOAD_MAX_SIZE_MB", 2048))
+    UPLOAD_MAX_CHUNK_MB = int(os.getenv("UPLOAD_MAX_CHUNK_MB", 16))
+    UPLOAD_REQUIRE_CHECKSUM = os.getenv("UPLOAD_REQUIRE_CHECKSUM", "true").lower() == "true"  # Upload-Checksum per chunk
+    UPLOAD_EXPIRY_HOURS = float(os.getenv("UPLOAD_EXPIRY_HOURS", 24))  # Unfinished uploads and results are deleted after
+    UPLOAD_EARLY_EXTRACTION = os.getenv("UPLOAD_EARLY_EXTRACTION", "true").lower() == "true"  # Pipe chunks to FFmpeg
+    UPLOAD_EXTRACTION_TIMEOUT = float(os.getenv("UPLOAD_EXTRACTION_TIMEOUT", 300))
+    UPLOAD_EXTRACTION_IDLE_SECONDS = float(os.getenv("UPLOAD_EXTRACTION_IDLE_SECONDS", 600))  # Then FFmpeg is stopped
+    UPLOAD_SWEEP_INTERVAL = float(os.getenv("UPLOAD_SWEEP_INTERVAL", 300))  # Seconds between expiry sweeps
+
+    # Memory governor: video jobs run while their estimated peaks fit the budget (per worker process, 0 = off)
+    MEMORY_BUDGET_MB = int(os.getenv("MEMORY_BUDGET_MB", 512))
+    MEMORY_JOB_BASE_MB = int(os.getenv("MEMORY_JOB_BASE_MB", 32))  # FFmpeg, request and pipeline overhead
+    MEMORY_PER_AUDIO_SECOND_KB = int(os.getenv("MEMORY_PER_AUDIO_SECOND_KB", 160))  # PCM copies of local transcription
+    MEMORY_ADMISSION_TIMEOUT = float(os.getenv("MEMORY_ADMISSION_TIMEOUT", 120))
+
+    # Tenants: JSON {"name": {"api_key": "...", "weight": 2, "requests_per_minute": 60, "audio_minutes_per_hour": 600}}
+    # sent as X-API-Key; without TENANTS every caller shares one unlimited tenant. Limits of 0 are unlimited
+    TENANTS = json.loads(os.getenv("TENANTS") or "{}")
+    TENANT_DEFAULT_REQUESTS_PER_MINUTE = float(os.getenv("TENANT_DEFAULT_REQUESTS_PER_MINUTE", 60))
+    TENANT_DEFAULT_AUDIO_MINUTES_PER_HOUR = float(os.getenv("TENANT_DEFAULT_AUDIO_MINUTES_PER_HOUR", 600))
+    TENANT_AUDIO_MAX_WAIT = float(os.getenv("TENANT_AUDIO_MAX_WAIT", 30))  # Wait for audio budget before a 429
+    AI_STAGE_SLOTS = int(os.getenv("AI_STAGE_SLOTS", 4))  # Provider calls in flight, shared fairly by tenants
+    FFMPEG_STAGE_SLOTS = int(os.getenv("FFMPEG_STAGE_SLOTS", os.cpu_count() or 1))  # Concurrent FFmpeg conversions
+
+    # Startup
+    FFMPEG_PATH = os.getenv("FFMPEG_PATH")  # Skips the lookup on the PATH
+    WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", "false").lower() == "true"  # Pre-connect providers after startup
+    WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", 10))  # Per provider call
+
     # MongoDB settings
     MONGODB_HOST = os.getenv("MONGODB_HOST", "localhost")
     MONGODB_PORT = os.getenv("MONGODB_PORT", "27017")
@@ -41,6 +203,16 @@ class Config:
     MONGODB_URI = os.getenv("MONGODB_URI", "")
     MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "video_profile_extractor")
     MONGODB_AUTH_DATABASE = os.getenv("MONGODB_AUTH_DATABASE", "admin")
+    MONGODB_MAX_POOL_SIZE = int(os.getenv("MONGODB_MAX_POOL_SIZE", 50))
+    MONGODB_MIN_POOL_SIZE = int(os.getenv("MONGODB_MIN_POOL_SIZE", 0))
+    MONGODB_MAX_IDLE_TIME_MS = int(os.getenv("MONGODB_MAX_IDLE_TIME_MS", 60000))
+    MONGODB_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGODB_SERVER_SELECTION_TIMEOUT_MS", 5000))
+    # Background connection monitor: backoff between reconnect attempts, ping interval while healthy
+    MONGODB_RECONNECT_MIN_DELAY = float(os.getenv("MONGODB_RECONNECT_MIN_DELAY", 1))
+    MONGODB_RECONNECT_MAX_DELAY = float(os.getenv("MONGODB_RECONNECT_MAX_DELAY", 60))
+    MONGODB_HEALTH_CHECK_INTERVAL = float(os.getenv("MONGODB_HEALTH_CHECK_INTERVAL", 30))
+    # Set to "false" to skip MongoDB entirely and serve prompts from code (offline runs)
+    MONGODB_ENABLED = os.getenv("MONGODB_ENABLED", "true").lower() == "true"
     
     @classmethod
     def validate(cls):
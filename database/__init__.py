@@ -1,4 +1,11 @@
-from .mongodb import MongoDBClient
+from .mongodb import MongoDBClient, AsyncMongoDBClient
 from .prompt_repository import PromptRepository
+from .async_prompt_repository import AsyncPromptRepository
+from .candidate_index import CandidateIndex
+from .candidate_repository import CandidateRepository
+from .technical_test_repository import TechnicalTestRepository
+from .prompt_template import CompiledPrompt, PromptTemplateError
 
-__all__ = ['MongoDBClient', 'PromptRepository']
+__all__ = ['MongoDBClient', 'AsyncMongoDBClient', 'PromptRepository', 'AsyncPromptRepository',
+           'CandidateIndex', 'CandidateRepository', 'TechnicalTestRepository', 'CompiledPrompt',
+           'PromptTemplateError']
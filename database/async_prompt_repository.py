@@ -0,0 +1,168 @@
+from typing import Optional
+from pymongo.errors import PyMongoError
+from utils.logger import setup_logger
+from utils.tracing import start_span
+from .mongodb import AsyncMongoDBClient
+from .prompt_repository import PromptRepository
+from .prompt_sets import (
+    ACTIVE_SET_NAME, check_prompt_name, compile_update, new_set_version, pointer_update, prompt_filter,
+    stale_sets_filter, staged_documents
+)
+from .prompt_template import CompiledPrompt
+
+logger = setup_logger("async_prompt_repository")
+
+
+class AsyncPromptRepository:
+    """
+    Non-blocking prompt access for request handlers
+
+    Uses the shared AsyncMongoDBClient pool and the same compiled prompt table
+    as PromptRepository, so an update through either one is seen by both.
+    Create one instance per process and inject it (see get_prompt_repository
+    in main.py) rather than constructing it per request.
+    """
+
+    DEFAULT_PROMPTS = PromptRepository.DEFAULT_PROMPTS
+
+    def __init__(self):
+        self.db_client = AsyncMongoDBClient()
+        self.collection_name = "prompts"
+
+    def _collection(self):
+        if not self.db_client.is_connected():
+            return None
+        return self.db_client.database[self.collection_name]
+
+    async def _active_set_version(self, collection) -> Optional[str]:
+        if PromptRepository._active_set is not None:
+            return PromptRepository._active_set
+        return PromptRepository._set_active(await collection.find_one({"name": ACTIVE_SET_NAME}))
+
+    async def get_compiled_prompt(self, prompt_name: str) -> Optional[CompiledPrompt]:
+        """
+        Get the compiled prompt by name
+
+        Args:
+            prompt_name: Name of the prompt
+
+        Returns:
+            CompiledPrompt or None if not found
+        """
+        found, prompt = PromptRepository._cached(prompt_name)
+        if found:
+            return prompt
+
+        prompt_doc = None
+        loaded = False
+        collection = self._collection()
+        if collection is not None:
+            try:
+                active = await self._active_set_version(collection)
+                with start_span("mongodb.find_one", collection=self.collection_name, prompt=prompt_name):
+                    prompt_doc = await collection.find_one(prompt_filter(active, prompt_name))
+                loaded = True
+            except PyMongoError as e:
+                self.db_client.report_failure(e)
+
+        return PromptRepository._resolve(prompt_name, prompt_doc, loaded)
+
+    async def get_prompt_version(self, prompt_name: str) -> Optional[str]:
+        """Content version of a prompt, for use in result-cache keys"""
+        prompt = await self.get_compiled_prompt(prompt_name)
+        return prompt.version if prompt else None
+
+    async def update_prompt(self, prompt_name: str, new_template: str) -> bool:
+        """
+        Validate, compile and store a prompt template
+
+        Args:
+            prompt_name: Name of the prompt to update
+            new_template: New template string
+
+        Returns:
+            True if successful, False otherwise
+
+        Raises:
+            PromptTemplateError: If the prompt name is reserved, or the template is malformed or uses
+                unknown variables
+        """
+        check_prompt_name(prompt_name)
+        collection = self._collection()
+        if collection is None:
+            return False
+
+        try:
+            # Validate against the declared variables before anything is written
+            active = await self._active_set_version(collection)
+            existing = await collection.find_one(prompt_filter(active, prompt_name), {"variables": 1})
+            prompt, update = compile_update(prompt_name, new_template, existing, self.DEFAULT_PROMPTS)
+
+            with start_span("mongodb.update_one", collection=self.collection_name, prompt=prompt_name):
+                result = await collection.update_one(prompt_filter(active, prompt_name), update, upsert=True)
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return False
+
+        PromptRepository._remember(prompt_name, prompt)
+
+        return result.matched_count > 0 or result.upserted_id is not None
+
+    async def list_prompts(self) -> list:
+        """
+        List all available prompts
+
+        Returns:
+            List of prompt names
+        """
+        collection = self._collection()
+        if collection is None:
+            return PromptRepository._fallback_names()
+
+        names = PromptRepository._cached_names()
+        if names is not None:
+            return names
+
+        try:
+            active = await self._active_set_version(collection)
+            with start_span("mongodb.find", collection=self.collection_name):
+                return PromptRepository._store_names(
+                    [doc["name"] async for doc in collection.find(prompt_filter(active), {"name": 1})]
+                )
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return PromptRepository._fallback_names()
+
+    async def reset_prompts(self) -> Optional[dict]:
+        """
+        Atomically replace all prompts with DEFAULT_PROMPTS (see PromptRepository.reset_prompts)
+
+        Returns:
+            Dict with deleted and inserted counts and the new set version,
+            or None if MongoDB is not connected
+        """
+        collection = self._collection()
+        if collection is None:
+            return None
+
+        try:
+            with start_span("mongodb.reset", collection=self.collection_name):
+                previous = await collection.find_one({"name": ACTIVE_SET_NAME})
+                set_version = new_set_version()
+                documents = staged_documents(self.DEFAULT_PROMPTS, set_version)
+                await collection.insert_many(documents)
+                await collection.update_one(
+                    {"name": ACTIVE_SET_NAME},
+                    {"$set": pointer_update(set_version, previous)},
+                    upsert=True
+                )
+                result = await collection.delete_many(stale_sets_filter(set_version, previous))
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return None
+
+        PromptRepository.invalidate_cache()
+        PromptRepository._set_active({"version": set_version})
+        logger.info("Prompts reset to defaults", extra={"set_version": set_version, "deleted": result.deleted_count})
+
+        return {"deleted": result.deleted_count, "inserted": len(documents), "set_version": set_version}
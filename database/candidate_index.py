@@ -0,0 +1,243 @@
+"""
+In-process inverted index over candidate profiles
+"""
+import heapq
+import math
+import re
+import unicodedata
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+# Separators between technologies in LLM output ("Python, Docker y AWS")
+_TERM_SPLIT = re.compile(r"[,;/|\n]+|\s+(?:y|and|e)\s+")
+_WORD_SPLIT = re.compile(r"[^a-z0-9+#.]+")
+_PARENTHESES = re.compile(r"\([^)]*\)")
+
+_NOT_SPECIFIED = {"not specified", "no especificado", "n/a", "none", ""}
+
+_STOPWORDS = {
+    "a", "al", "and", "as", "at", "con", "de", "del", "el", "en", "for", "in", "la", "las",
+    "los", "of", "on", "or", "para", "por", "the", "to", "un", "una", "with", "y",
+}
+
+# Profile fields feeding each searchable field
+INDEXED_FIELDS = {
+    "profession": ("profession",),
+    "technologies": ("technologies",),
+    "languages": ("languages",),
+    "keywords": ("experience", "technologies", "soft_skills", "achievements", "education"),
+}
+
+
+def normalize(text: str) -> str:
+    """Lowercase, strip accents and collapse whitespace"""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return " ".join(text.lower().split())
+
+
+def _as_text(value) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple)):
+        return ", ".join(_as_text(v) for v in value)
+    if isinstance(value, dict):
+        return ", ".join(_as_text(v) for v in value.values())
+    return str(value)
+
+
+def term_tokens(value) -> List[str]:
+    """Whole terms such as "node.js" or "spring boot" from a list or comma separated string"""
+    tokens = []
+    for term in _TERM_SPLIT.split(_PARENTHESES.sub(" ", normalize(_as_text(value)))):
+        term = term.strip(" .-()")
+        if term and term not in _NOT_SPECIFIED and term not in tokens:
+            tokens.append(term)
+    return tokens
+
+
+def word_tokens(value) -> List[str]:
+    """Individual words, without stopwords and very short tokens"""
+    tokens = []
+    for word in _WORD_SPLIT.split(normalize(_as_text(value))):
+        word = word.strip(".")
+        if len(word) >= 2 and word not in _STOPWORDS and word not in tokens:
+            tokens.append(word)
+    return tokens
+
+
+def profile_tokens(profile_data: dict) -> Dict[str, List[str]]:
+    """Normalized tokens per searchable field, as stored with each candidate"""
+    profile_data = profile_data or {}
+    tokens = {}
+    for field, sources in INDEXED_FIELDS.items():
+        values = [profile_data.get(source) for source in sources]
+        if field == "technologies":
+            tokens[field] = term_tokens(values)
+        else:
+            tokens[field] = word_tokens(values)
+    # Technologies are also searchable word by word ("spring" matches "spring boot")
+    tokens["keywords"] = list(dict.fromkeys(tokens["keywords"] + word_tokens(tokens["technologies"])))
+    return tokens
+
+
+class CandidateIndex:
+    """
+    Postings lists per field and token, updated one candidate at a time
+
+    Filters (tenant, profession and language words) intersect postings; technologies
+    and keywords rank matches by inverse document frequency, so rare skills
+    weigh more than common ones. Nothing here touches MongoDB.
+    """
+
+    # Relative weight of a matched token per field when ranking
+    FIELD_WEIGHTS = {"technologies": 2.0, "keywords": 1.0}
+
+    def __init__(self):
+        self._postings: Dict[str, Dict[str, set]] = {field: defaultdict(set) for field in INDEXED_FIELDS}
+        self._tokens: Dict[str, Dict[str, List[str]]] = {}
+        self._tenant_postings: Dict[Optional[str], set] = defaultdict(set)
+        self._tenants: Dict[str, Optional[str]] = {}
+        self._summaries: Dict[str, dict] = {}
+        self._order: Dict[str, int] = {}
+        self._sequence = 0
+
+    def __len__(self) -> int:
+        return len(self._tokens)
+
+    def __contains__(self, candidate_id: str) -> bool:
+        return candidate_id in self._tokens
+
+    def count(self, tenant: Optional[str] = None) -> int:
+        """Indexed candidates, of one tenant when given"""
+        return len(self._tenant_postings.get(tenant, ())) if tenant is not None else len(self._tokens)
+
+    def add(self, candidate_id: str, tokens: Dict[str, List[str]], summary: dict, tenant: Optional[str] = None):
+        """Index (or re-index) one candidate of a tenant"""
+        if candidate_id in self._tokens:
+            self.remove(candidate_id)
+
+        for field, values in tokens.items():
+            postings = self._postings.get(field)
+            if postings is None:
+                continue
+            for token in values:
+                postings[token].add(candidate_id)
+
+        self._tokens[candidate_id] = tokens
+        self._tenants[candidate_id] = tenant
+        self._tenant_postings[tenant].add(candidate_id)
+        self._summaries[candidate_id] = summary
+        self._sequence += 1
+        self._order[candidate_id] = self._sequence
+
+    def remove(self, candidate_id: str):
+        tokens = self._tokens.pop(candidate_id, None)
+        if tokens is None:
+            return
+        for field, values in tokens.items():
+            postings = self._postings.get(field)
+            if postings is None:
+                continue
+            for token in values:
+                ids = postings.get(token)
+                if ids is not None:
+                    ids.discard(candidate_id)
+                    if not ids:
+                        del postings[token]
+        tenant = self._tenants.pop(candidate_id, None)
+        ids = self._tenant_postings.get(tenant)
+        if ids is not None:
+            ids.discard(candidate_id)
+            if not ids:
+                del self._tenant_postings[tenant]
+        self._summaries.pop(candidate_id, None)
+        self._order.pop(candidate_id, None)
+
+    def _matching(self, field: str, tokens: Iterable[str]) -> Optional[set]:
+        """Candidates having every token in the field (None when there is nothing to filter on)"""
+        result = None
+        for token in tokens:
+            ids = self._postings[field].get(token, set())
+            result = set(ids) if result is None else result & ids
+            if not result:
+                return set()
+        return result
+
+    def _idf(self, field: str, token: str) -> float:
+        df = len(self._postings[field].get(token, ()))
+        return math.log((len(self._tokens) + 1) / (df + 1)) + 1.0
+
+    def search(
+        self,
+        profession: Optional[str] = None,
+        technologies: Optional[str] = None,
+        languages: Optional[str] = None,
+        keywords: Optional[str] = None,
+        match_all: bool = False,
+        limit: int = 20,
+        offset: int = 0,
+        tenant: Optional[str] = None
+    ) -> dict:
+        """
+        Find and rank candidates
+
+        Args:
+            profession: Words that must all appear in the profession
+            technologies: Comma separated technologies to rank by
+            languages: Languages that are all required
+            keywords: Free text matched against experience, skills and achievements
+            match_all: Require every technology and keyword instead of any
+            limit: Page size
+            offset: Page start
+            tenant: Only this tenant's candidates (None searches all of them)
+
+        Returns:
+            Dict with total matches and the page of {id, score, matched, summary}
+        """
+        candidates = set(self._tenant_postings.get(tenant, ())) if tenant is not None else None
+        for field, tokens in (("profession", word_tokens(profession)), ("languages", word_tokens(languages))):
+            ids = self._matching(field, tokens)
+            if ids is not None:
+                candidates = ids if candidates is None else candidates & ids
+
+        ranked_terms = [("technologies", t) for t in term_tokens(technologies)]
+        ranked_terms += [("keywords", t) for t in word_tokens(keywords)]
+
+        if ranked_terms and match_all:
+            for field, token in ranked_terms:
+                ids = self._postings[field].get(token, set())
+                candidates = set(ids) if candidates is None else candidates & ids
+
+        # Set intersections run in C; only the scores are accumulated in Python
+        scores = defaultdict(float)
+        for field, token in ranked_terms:
+            postings = self._postings[field].get(token)
+            if not postings:
+                continue
+            weight = self.FIELD_WEIGHTS[field] * self._idf(field, token)
+            for candidate_id in (postings if candidates is None else postings & candidates):
+                scores[candidate_id] += weight
+
+        if ranked_terms:
+            result_ids = scores.keys()
+        else:
+            result_ids = candidates if candidates is not None else self._tokens.keys()
+
+        # Best score first, then most recently indexed; only the requested page is ordered
+        page = heapq.nsmallest(
+            offset + limit, result_ids, key=lambda cid: (-scores.get(cid, 0.0), -self._order[cid])
+        )[offset:]
+
+        return {
+            "total": len(result_ids),
+            "results": [
+                {
+                    "id": cid,
+                    "score": round(scores.get(cid, 0.0), 3),
+                    "matched": [t for f, t in ranked_terms if cid in self._postings[f].get(t, ())],
+                    **self._summaries[cid],
+                }
+                for cid in page
+            ],
+        }
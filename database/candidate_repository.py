@@ -0,0 +1,197 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from config import Config
+from utils.logger import setup_logger
+from utils.tracing import start_span
+from .candidate_index import CandidateIndex, profile_tokens
+from .mongodb import AsyncMongoDBClient
+
+logger = setup_logger("candidate_repository")
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    """MongoDB returns naive UTC datetimes; make them comparable with aware ones"""
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+class CandidateRepository:
+    """
+    Stores extraction results in the candidates collection and searches them
+
+    Searches are answered from an in-process CandidateIndex. The index is
+    loaded once from the stored search tokens, updated directly on save, and
+    caught up with candidates saved by other workers by reading only the
+    documents created since the last refresh.
+    """
+
+    # Fields kept in memory for search results (the full document is fetched by id)
+    SUMMARY_FIELDS = ("name", "profession", "technologies", "languages", "experience")
+    # Re-read this far behind the watermark to catch inserts that committed late or with clock skew
+    REFRESH_OVERLAP = timedelta(seconds=60)
+
+    def __init__(self):
+        self.db_client = AsyncMongoDBClient()
+        self.collection_name = "candidates"
+        self.index = CandidateIndex()
+        self._watermark: Optional[datetime] = None
+        self._last_refresh = 0.0
+        self._refresh_lock = asyncio.Lock()
+        self._indexes_created = False
+
+    def _collection(self):
+        if not self.db_client.is_connected():
+            return None
+        return self.db_client.database[self.collection_name]
+
+    async def _ensure_indexes(self, collection):
+        if self._indexes_created:
+            return
+        await collection.create_indexes([
+            IndexModel([("created_at", DESCENDING)]),
+            IndexModel([("tenant", ASCENDING)]),
+            IndexModel([("search_tokens.technologies", ASCENDING)]),
+            IndexModel([("search_tokens.languages", ASCENDING)]),
+            IndexModel([("search_tokens.profession", ASCENDING)]),
+        ])
+        self._indexes_created = True
+
+    @classmethod
+    def _summary(cls, document: dict) -> dict:
+        profile_data = document.get("profile_data") or {}
+        summary = {field: profile_data.get(field) for field in cls.SUMMARY_FIELDS}
+        created_at = _utc(document.get("created_at"))
+        summary["created_at"] = created_at.isoformat() if created_at else None
+        return summary
+
+    def _index_document(self, document: dict):
+        self.index.add(
+            str(document["_id"]), document.get("search_tokens") or {}, self._summary(document), document.get("tenant")
+        )
+
+    async def save(
+        self,
+        transcription: str,
+        profile_data: dict,
+        cv_profile: str,
+        tenant: Optional[str] = None,
+        **metadata
+    ) -> Optional[str]:
+        """
+        Store an extraction result of a tenant and index it
+
+        Returns:
+            The candidate id, or None if MongoDB is unavailable
+        """
+        collection = self._collection()
+        if collection is None:
+            return None
+
+        document = {
+            "transcription": transcription,
+            "profile_data": profile_data,
+            "cv_profile": cv_profile,
+            "search_tokens": profile_tokens(profile_data),
+            "tenant": tenant,
+            "created_at": datetime.now(timezone.utc),
+            **metadata,
+        }
+        try:
+            await self._ensure_indexes(collection)
+            with start_span("mongodb.insert_one", collection=self.collection_name):
+                result = await collection.insert_one(document)
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            logger.warning(f"Could not store candidate: {e}")
+            return None
+
+        # Only index locally once the full index is loaded; the first refresh picks it up otherwise
+        if self._watermark is not None:
+            self._index_document(document)
+        return str(result.inserted_id)
+
+    async def get(self, candidate_id: str, tenant: Optional[str] = None) -> Optional[dict]:
+        """Full stored candidate, or None if not found or (with `tenant`) another tenant's"""
+        collection = self._collection()
+        if collection is None:
+            return None
+        try:
+            object_id = ObjectId(candidate_id)
+        except InvalidId:
+            return None
+
+        query = {"_id": object_id} if tenant is None else {"_id": object_id, "tenant": tenant}
+        try:
+            with start_span("mongodb.find_one", collection=self.collection_name):
+                document = await collection.find_one(query, {"search_tokens": 0})
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            logger.warning(f"Could not read candidate: {e}")
+            return None
+        if document is None:
+            return None
+
+        document["id"] = str(document.pop("_id"))
+        if document.get("created_at"):
+            document["created_at"] = _utc(document["created_at"]).isoformat()
+        return document
+
+    async def refresh(self, force: bool = False):
+        """
+        Bring the index up to date with the collection
+
+        The first call loads every candidate; later calls (at most every
+        CANDIDATE_INDEX_REFRESH_INTERVAL seconds) read only newer documents
+        through the created_at index.
+        """
+        if not force and time.monotonic() - self._last_refresh < Config.CANDIDATE_INDEX_REFRESH_INTERVAL:
+            return
+        collection = self._collection()
+        if collection is None:
+            return
+
+        async with self._refresh_lock:
+            if not force and time.monotonic() - self._last_refresh < Config.CANDIDATE_INDEX_REFRESH_INTERVAL:
+                return
+
+            # The overlap plus the membership check skips documents that are already indexed
+            query = {} if self._watermark is None else {"created_at": {"$gte": self._watermark - self.REFRESH_OVERLAP}}
+            projection = {
+                "search_tokens": 1, "created_at": 1, "tenant": 1,
+                **{f"profile_data.{f}": 1 for f in self.SUMMARY_FIELDS}
+            }
+            added = 0
+            try:
+                await self._ensure_indexes(collection)
+                with start_span("mongodb.find", collection=self.collection_name, full_load=self._watermark is None):
+                    async for document in collection.find(query, projection).sort("created_at", ASCENDING):
+                        created_at = _utc(document.get("created_at"))
+                        if created_at is not None and (self._watermark is None or created_at > self._watermark):
+                            self._watermark = created_at
+                        if str(document["_id"]) in self.index:
+                            continue
+                        self._index_document(document)
+                        added += 1
+            except PyMongoError as e:
+                self.db_client.report_failure(e)
+                logger.warning(f"Candidate index refresh failed: {e}")
+                return
+
+            if self._watermark is None:
+                # Empty collection: later saves can be indexed directly
+                self._watermark = datetime.fromtimestamp(0, timezone.utc)
+            self._last_refresh = time.monotonic()
+            if added:
+                logger.info(f"Indexed {added} candidates", extra={"indexed_total": len(self.index)})
+
+    async def search(self, **criteria) -> dict:
+        """Search the in-process index (see CandidateIndex.search for criteria)"""
+        await self.refresh()
+        return self.index.search(**criteria)
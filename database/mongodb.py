@@ -1,11 +1,27 @@
+import random
 import re
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure
+import threading
+from typing import Callable, Optional
+from pymongo import MongoClient, AsyncMongoClient
+from pymongo.errors import PyMongoError
 from config import Config
+from utils.logger import setup_logger
+from utils.metrics import MONGODB_AVAILABLE
+
+logger = setup_logger("mongodb")
 
 
 class MongoDBClient:
-    """MongoDB client singleton"""
+    """
+    MongoDB client singleton
+    
+    The client is created without contacting the server (PyMongo connects
+    lazily), and a background monitor thread pings it: with exponential
+    backoff until the first success, then every MONGODB_HEALTH_CHECK_INTERVAL.
+    is_connected() only reads the monitor's last result, so startup and
+    requests never wait on an unreachable server, and the process recovers
+    by itself once MongoDB comes back.
+    """
     
     _instance = None
     _client = None
@@ -13,13 +29,20 @@ class MongoDBClient:
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super().__new__(cls)
+            cls._instance._available = threading.Event()
+            cls._instance._wake = threading.Event()
+            cls._instance._listeners = []
+            cls._instance._lock = threading.Lock()
+            cls._instance._monitor_thread = None
         return cls._instance
     
     def __init__(self):
-        if self._client is None:
+        # MONGODB_ENABLED=false keeps the client disconnected (prompts served from code)
+        if self._client is None and Config.MONGODB_ENABLED:
             self._connect()
     
-    def _build_connection_uri(self):
+    @staticmethod
+    def _build_connection_uri():
         """Build MongoDB connection URI from config"""
         # If a full connection string is provided (e.g. Atlas), prefer it
         if getattr(Config, "MONGODB_URI", None):
@@ -38,32 +61,139 @@ class MongoDBClient:
         return uri
     
     def _connect(self):
-        """Connect to MongoDB"""
+        """Create the client and start the connection monitor"""
+        with self._lock:
+            if self._client is not None:
+                return
+            try:
+                connection_uri = self._build_connection_uri()
+                self._safe_uri = self._mask_uri(connection_uri)
+                self._client = MongoClient(connection_uri, **self.client_options())
+            except Exception as e:
+                logger.error(f"Invalid MongoDB configuration: {e}. Using default prompts from code")
+                self._client = None
+                return
+            
+            self._monitor_thread = threading.Thread(target=self._monitor, name="mongodb-monitor", daemon=True)
+            self._monitor_thread.start()
+    
+    @staticmethod
+    def _mask_uri(uri: str) -> str:
+        """Mask password for logging (handles mongodb+srv and mongodb://)"""
         try:
-            connection_uri = self._build_connection_uri()
-            # Mask password for logging (handles mongodb+srv and mongodb://)
-            def _mask_uri(uri: str) -> str:
-                try:
-                    # replace :password@ with :****@
-                    return re.sub(r":([^:@]+)@", ":****@", uri)
-                except Exception:
-                    return uri
+            # replace :password@ with :****@
+            return re.sub(r":([^:@]+)@", ":****@", uri)
+        except Exception:
+            return uri
+    
+    def _monitor(self):
+        delay = Config.MONGODB_RECONNECT_MIN_DELAY
+        while True:
+            try:
+                self._client.admin.command('ping')
+            except PyMongoError as e:
+                if self._available.is_set():
+                    logger.warning(f"Lost connection to MongoDB: {e}. Serving last known prompts")
+                    self._set_available(False)
+                else:
+                    logger.warning(f"MongoDB unreachable ({e}), retrying in {delay:.1f}s")
+                self._sleep(delay * random.uniform(0.8, 1.2))
+                delay = min(delay * 2, Config.MONGODB_RECONNECT_MAX_DELAY)
+                continue
+            
+            delay = Config.MONGODB_RECONNECT_MIN_DELAY
+            if not self._available.is_set():
+                logger.info(f"Connected to MongoDB: {self._safe_uri}")
+                self._set_available(True)
+            self._sleep(Config.MONGODB_HEALTH_CHECK_INTERVAL)
+    
+    def _sleep(self, seconds: float):
+        """Wait between pings; report_failure() cuts the wait short"""
+        self._wake.wait(seconds)
+        self._wake.clear()
+    
+    def _set_available(self, available: bool):
+        if available:
+            self._available.set()
+        else:
+            self._available.clear()
+        MONGODB_AVAILABLE.set(1 if available else 0)
+        
+        for on_connect, on_disconnect in list(self._listeners):
+            callback = on_connect if available else on_disconnect
+            if callback is None:
+                continue
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"MongoDB {'connect' if available else 'disconnect'} listener failed: {e}")
+    
+    def add_listener(self, on_connect: Optional[Callable] = None, on_disconnect: Optional[Callable] = None):
+        """
+        Register callbacks for availability changes
+        
+        Callbacks run on the monitor thread. If the server is already reachable,
+        on_connect is called immediately.
+        """
+        self._listeners.append((on_connect, on_disconnect))
+        if on_connect is not None and self._available.is_set():
+            on_connect()
+    
+    def report_failure(self, error: Exception):
+        """Mark the server unavailable after a failed operation and re-check it now"""
+        if self._available.is_set():
+            logger.warning(f"MongoDB operation failed: {error}")
+            self._set_available(False)
+        self._wake.set()
+    
+    def wait_until_connected(self, timeout: float) -> bool:
+        """Block until the monitor reaches the server (for scripts, not request paths)"""
+        if self._client is None:
+            return False
+        return self._available.wait(timeout)
+    
+    @staticmethod
+    def client_options() -> dict:
+        """Connection pool settings shared by the sync and async clients"""
+        return {
+            "maxPoolSize": Config.MONGODB_MAX_POOL_SIZE,
+            "minPoolSize": Config.MONGODB_MIN_POOL_SIZE,
+            "maxIdleTimeMS": Config.MONGODB_MAX_IDLE_TIME_MS,
+            "serverSelectionTimeoutMS": Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS,
+        }
+    
+    @property
+    def client(self):
+        return self._client
+    
+    @property
+    def database(self):
+        if self._client:
+            return self._client[Config.MONGODB_DATABASE]
+        return None
+    
+    def is_connected(self):
+        return self._client is not None and self._available.is_set()
 
-            safe_uri = _mask_uri(connection_uri)
 
-            self._client = MongoClient(connection_uri, serverSelectionTimeoutMS=5000)
-            
-            # Test connection
-            self._client.admin.command('ping')
-            print(f"Connected to MongoDB: {safe_uri}")
-        except ConnectionFailure as e:
-            print(f"Failed to connect to MongoDB: {e}")
-            print("Using default prompts from code")
-            self._client = None
-        except Exception as e:
-            print(f"Unexpected error connecting to MongoDB: {e}")
-            print("Using default prompts from code")
-            self._client = None
+class AsyncMongoDBClient:
+    """Shared asyncio MongoDB client (PyMongo async API) for request handlers"""
+    
+    _instance = None
+    _client = None
+    
+    def __new__(cls):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+        return cls._instance
+    
+    def __init__(self):
+        if self._client is None and Config.MONGODB_ENABLED:
+            # AsyncMongoClient connects lazily, so creating it never blocks the event loop
+            self._client = AsyncMongoClient(
+                MongoDBClient._build_connection_uri(),
+                **MongoDBClient.client_options()
+            )
     
     @property
     def client(self):
@@ -76,4 +206,13 @@ class MongoDBClient:
         return None
     
     def is_connected(self):
-        return self._client is not None
+        # Reachability is tracked by the sync client's connection monitor
+        return self._client is not None and MongoDBClient().is_connected()
+    
+    def report_failure(self, error: Exception):
+        MongoDBClient().report_failure(error)
+    
+    async def close(self):
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
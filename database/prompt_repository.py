@@ -1,12 +1,39 @@
-from typing import Optional
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import CACHE_REQUESTS
+from utils.tracing import start_span
 from .mongodb import MongoDBClient
+from .prompt_sets import (
+    ACTIVE_SET_NAME, check_prompt_name, compile_update, new_set_version, pointer_update, prompt_document,
+    prompt_filter, stale_sets_filter, staged_documents
+)
+from .prompt_template import CompiledPrompt, PromptTemplateError
+from .prompt_watcher import PromptChangeWatcher
+
+logger = setup_logger("prompt_repository")
 
 
 class PromptRepository:
     """Repository for managing AI prompts in MongoDB"""
     
-    # Cache for prompts to avoid repeated DB queries
-    _prompt_cache = {}
+    # Compiled prompts shared by all instances: name -> (CompiledPrompt or None, loaded_at)
+    # Invalidated by the change watcher, with PROMPT_CACHE_TTL as a safety net
+    _prompt_table: Dict[str, tuple] = {}
+    _table_lock = threading.Lock()
+    _watcher = None
+    # Last prompts actually read from (or written to) MongoDB, served while it is unreachable
+    _last_known_good: Dict[str, CompiledPrompt] = {}
+    # Active prompt-set version, None until read from the pointer document
+    _active_set: Optional[str] = None
+    # Names of the active set's prompts and when they were read, for list_prompts (same invalidation)
+    _names: Optional[tuple] = None
+    _listening = False
     
     DEFAULT_PROMPTS = {
         "profile_extraction": {
@@ -85,64 +112,340 @@ class PromptRepository:
         """Initialize prompt repository with MongoDB connection"""
         self.db_client = MongoDBClient()
         self.collection_name = "prompts"
-        self._initialize_prompts()
+        self._listen()
+    
+    def _listen(self):
+        """Sync and warm prompts whenever the connection monitor (re)connects, once per process"""
+        cls = type(self)
+        with cls._table_lock:
+            if cls._listening:
+                return
+            cls._listening = True
+        self.db_client.add_listener(on_connect=self._on_connected)
+    
+    def _on_connected(self):
+        try:
+            self._initialize_prompts()
+            self._warm_cache()
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return
+        self._start_watcher()
+    
+    def initialize(self) -> bool:
+        """Add missing default prompts now, as the connection monitor does on connect (for scripts)"""
+        try:
+            self._initialize_prompts()
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return False
+        return self.db_client.is_connected()
+    
+    def _warm_cache(self):
+        """Replace prompts served during an outage with the stored ones"""
+        self.invalidate_cache()
+        collection = self.db_client.database[self.collection_name]
+        active = self._active_set_version(collection)
+        for doc in collection.find(prompt_filter(active)):
+            self._remember(doc["name"], self._compile(doc["name"], doc))
+        logger.info(f"Loaded {len(self._last_known_good)} prompts from MongoDB (set {active})")
+    
+    @classmethod
+    def _set_active(cls, pointer: Optional[dict]) -> Optional[str]:
+        active = pointer.get("version") if pointer else None
+        with cls._table_lock:
+            cls._active_set = active
+        return active
+    
+    def _active_set_version(self, collection) -> Optional[str]:
+        """Active prompt-set version, read from the pointer document when not cached"""
+        if self._active_set is not None:
+            return self._active_set
+        return self._set_active(collection.find_one({"name": ACTIVE_SET_NAME}))
+    
+    @classmethod
+    def _default_upserts(cls, set_version: str) -> list:
+        """One upsert per default prompt; existing (possibly customised) prompts are left untouched"""
+        return [
+            UpdateOne(
+                {"name": name, "set_version": set_version},
+                {"$setOnInsert": prompt_document(prompt_data, set_version)},
+                upsert=True
+            )
+            for name, prompt_data in cls.DEFAULT_PROMPTS.items()
+        ]
     
     def _initialize_prompts(self):
-        """Initialize default prompts in MongoDB if not present"""
+        """Add missing default prompts to the active set with a single bulk write"""
         if not self.db_client.is_connected():
             return
         
         collection = self.db_client.database[self.collection_name]
         
-        # Check if prompts exist
-        if collection.count_documents({}) == 0:
-            print("Initializing default prompts in MongoDB...")
-            collection.insert_many(list(self.DEFAULT_PROMPTS.values()))
-            print("Default prompts initialized")
-        else:
-            # Update existing prompts and add new ones
-            for prompt_name, prompt_data in self.DEFAULT_PROMPTS.items():
-                existing = collection.find_one({"name": prompt_name})
-                if not existing:
-                    print(f"Adding new prompt: {prompt_name}")
-                    collection.insert_one(prompt_data)
+        # Create the active-set pointer on first run; concurrent workers agree on the first writer
+        collection.update_one(
+            {"name": ACTIVE_SET_NAME},
+            {"$setOnInsert": {"version": new_set_version(), "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        active = self._set_active(collection.find_one({"name": ACTIVE_SET_NAME}))
+        
+        # Prompts stored before prompt sets existed join the active set
+        collection.update_many(
+            {"set_version": {"$exists": False}, "name": {"$ne": ACTIVE_SET_NAME}},
+            {"$set": {"set_version": active}}
+        )
+        
+        result = collection.bulk_write(self._default_upserts(active), ordered=False)
+        if result.upserted_count:
+            logger.info(f"Added {result.upserted_count} default prompts to set {active}")
+        
+        # Backfill versions for prompts stored before versioning
+        backfill = [
+            UpdateOne({"_id": doc["_id"]}, {"$set": {"version": CompiledPrompt.compute_version(doc["template"])}})
+            for doc in collection.find(
+                {"version": {"$exists": False}, "name": {"$ne": ACTIVE_SET_NAME}}, {"template": 1}
+            )
+            if isinstance(doc.get("template"), str)
+        ]
+        if backfill:
+            collection.bulk_write(backfill, ordered=False)
+        
+        try:
+            collection.create_index([("name", 1), ("set_version", 1)], unique=True)
+        except OperationFailure as e:
+            logger.warning(f"Could not create prompts index: {e}")
     
-    def get_prompt(self, prompt_name: str) -> Optional[str]:
+    def reset_prompts(self) -> Optional[dict]:
         """
-        Get prompt template by name
+        Atomically replace all prompts with DEFAULT_PROMPTS
+        
+        The defaults are staged as a new prompt set, then the active-set pointer
+        is flipped with a single update, so readers see either the old or the
+        new set and never a partial one. The previous set is kept for readers
+        that still hold the old pointer; older sets are deleted. The pointer
+        change reaches the change watcher of every worker, which drops its cache.
+        
+        Returns:
+            Dict with deleted and inserted counts and the new set version,
+            or None if MongoDB is not connected
+        """
+        collection = self._collection()
+        if collection is None:
+            return None
+        
+        try:
+            with start_span("mongodb.reset", collection=self.collection_name):
+                previous = collection.find_one({"name": ACTIVE_SET_NAME})
+                set_version = new_set_version()
+                documents = staged_documents(self.DEFAULT_PROMPTS, set_version)
+                collection.insert_many(documents)
+                collection.update_one(
+                    {"name": ACTIVE_SET_NAME},
+                    {"$set": pointer_update(set_version, previous)},
+                    upsert=True
+                )
+                deleted = collection.delete_many(stale_sets_filter(set_version, previous)).deleted_count
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return None
+        
+        self.invalidate_cache()
+        self._set_active({"version": set_version})
+        logger.info("Prompts reset to defaults", extra={"set_version": set_version, "deleted": deleted})
+        
+        return {"deleted": deleted, "inserted": len(documents), "set_version": set_version}
+    
+    def _start_watcher(self):
+        """Start the shared change watcher once per process"""
+        cls = type(self)
+        if cls._watcher is not None or not self.db_client.is_connected():
+            return
+        
+        with cls._table_lock:
+            if cls._watcher is not None:
+                return
+            cls._watcher = PromptChangeWatcher(
+                get_collection=self._collection,
+                on_change=cls.invalidate_cache,
+                on_versions=cls._reconcile_versions,
+                poll_interval=Config.PROMPT_POLL_INTERVAL,
+                use_change_streams=Config.PROMPT_CHANGE_STREAMS
+            )
+        cls._watcher.start()
+    
+    def _collection(self):
+        if not self.db_client.is_connected():
+            return None
+        return self.db_client.database[self.collection_name]
+    
+    @classmethod
+    def invalidate_cache(cls, prompt_name: Optional[str] = None):
+        """Drop one compiled prompt, or all of them when no name is given or the active set changed"""
+        with cls._table_lock:
+            cls._names = None  # The change may have added or removed a prompt
+            if prompt_name is None or prompt_name == ACTIVE_SET_NAME:
+                cls._prompt_table.clear()
+                cls._active_set = None
+            else:
+                cls._prompt_table.pop(prompt_name, None)
+    
+    @classmethod
+    def _reconcile_versions(cls, documents: list):
+        """Invalidate cached prompts whose stored version (or the active set) changed"""
+        active = next((d.get("version") for d in documents if d.get("name") == ACTIVE_SET_NAME), None)
+        if active != cls._active_set:
+            cls.invalidate_cache()
+            cls._set_active({"version": active})
+            return
+        
+        versions = {
+            d["name"]: d.get("version")
+            for d in documents
+            if d.get("set_version") == active and d.get("name") != ACTIVE_SET_NAME
+        }
+        with cls._table_lock:
+            if cls._names is not None and set(cls._names[0]) != set(versions):
+                cls._names = None
+            for name, (prompt, _) in list(cls._prompt_table.items()):
+                cached_version = prompt.version if prompt else None
+                if versions.get(name) != cached_version:
+                    del cls._prompt_table[name]
+    
+    @classmethod
+    def _compile(cls, prompt_name: str, prompt_doc: Optional[dict]) -> Optional[CompiledPrompt]:
+        """Compile a stored prompt, falling back to the code default if it is invalid"""
+        default = cls.DEFAULT_PROMPTS.get(prompt_name)
+        
+        if prompt_doc and prompt_doc.get("template"):
+            try:
+                return CompiledPrompt(prompt_name, prompt_doc["template"], prompt_doc.get("variables"))
+            except PromptTemplateError as e:
+                logger.error(f"Stored prompt is invalid, using default: {e}")
+        
+        if default:
+            return CompiledPrompt(prompt_name, default["template"], default.get("variables"))
+        return None
+    
+    def get_compiled_prompt(self, prompt_name: str) -> Optional[CompiledPrompt]:
+        """
+        Get the compiled prompt by name
         
         Args:
             prompt_name: Name of the prompt
             
         Returns:
-            Prompt template string or None if not found
+            CompiledPrompt or None if not found
         """
         # Check cache first
-        if prompt_name in self._prompt_cache:
-            return self._prompt_cache[prompt_name]
+        found, prompt = self._cached(prompt_name)
+        if found:
+            return prompt
         
-        if not self.db_client.is_connected():
-            # Fallback to default prompts
-            template = self.DEFAULT_PROMPTS.get(prompt_name, {}).get("template")
-            self._prompt_cache[prompt_name] = template
-            return template
+        prompt_doc = None
+        loaded = False
+        if self.db_client.is_connected():
+            collection = self.db_client.database[self.collection_name]
+            try:
+                active = self._active_set_version(collection)
+                with start_span("mongodb.find_one", collection=self.collection_name, prompt=prompt_name):
+                    prompt_doc = collection.find_one(prompt_filter(active, prompt_name))
+                loaded = True
+            except PyMongoError as e:
+                self.db_client.report_failure(e)
         
-        collection = self.db_client.database[self.collection_name]
-        prompt_doc = collection.find_one({"name": prompt_name})
+        return self._resolve(prompt_name, prompt_doc, loaded)
+    
+    @classmethod
+    def _resolve(cls, prompt_name: str, prompt_doc: Optional[dict], loaded: bool) -> Optional[CompiledPrompt]:
+        """Compile a freshly loaded prompt, or fall back to the last known good one"""
+        if loaded:
+            prompt = cls._compile(prompt_name, prompt_doc)
+            cls._remember(prompt_name, prompt)
+            return prompt
         
-        if prompt_doc:
-            template = prompt_doc.get("template")
-            self._prompt_cache[prompt_name] = template
-            return template
+        prompt = cls._last_known_good.get(prompt_name) or cls._compile(prompt_name, None)
+        cls._store(prompt_name, prompt)
+        return prompt
+    
+    @classmethod
+    def _cached(cls, prompt_name: str):
+        """
+        Look up the compiled table
+        
+        Returns:
+            Tuple (found, prompt); found is False on a miss or an expired entry
+        """
+        entry = cls._prompt_table.get(prompt_name)
+        if entry is not None and time.monotonic() - entry[1] < Config.PROMPT_CACHE_TTL:
+            CACHE_REQUESTS.labels("prompt", "hit").inc()
+            return True, entry[0]
+        
+        CACHE_REQUESTS.labels("prompt", "miss").inc()
+        return False, None
+    
+    @classmethod
+    def _store(cls, prompt_name: str, prompt: Optional[CompiledPrompt]):
+        with cls._table_lock:
+            cls._prompt_table[prompt_name] = (prompt, time.monotonic())
+    
+    @classmethod
+    def _remember(cls, prompt_name: str, prompt: Optional[CompiledPrompt]):
+        """Cache a prompt confirmed by MongoDB and keep it as the outage fallback"""
+        cls._store(prompt_name, prompt)
+        with cls._table_lock:
+            if cls._names is not None and prompt is not None and prompt_name not in cls._names[0]:
+                cls._names = None
+            if prompt is None:
+                cls._last_known_good.pop(prompt_name, None)
+            else:
+                cls._last_known_good[prompt_name] = prompt
+    
+    @classmethod
+    def _cached_names(cls) -> Optional[list]:
+        """Prompt names from the last list_prompts, None on a miss or an expired entry"""
+        entry = cls._names
+        if entry is not None and time.monotonic() - entry[1] < Config.PROMPT_CACHE_TTL:
+            CACHE_REQUESTS.labels("prompt_names", "hit").inc()
+            return list(entry[0])
+        
+        CACHE_REQUESTS.labels("prompt_names", "miss").inc()
+        return None
+    
+    @classmethod
+    def _store_names(cls, names: list) -> list:
+        with cls._table_lock:
+            cls._names = (tuple(names), time.monotonic())
+        return names
+    
+    @classmethod
+    def _fallback_names(cls) -> list:
+        """Prompt names to list while MongoDB is unreachable"""
+        names = list(cls.DEFAULT_PROMPTS.keys())
+        names.extend(name for name in cls._last_known_good if name not in cls.DEFAULT_PROMPTS)
+        return names
+    
+    def get_prompt(self, prompt_name: str) -> Optional[str]:
+        """
+        Get prompt template by name
         
-        # Fallback to default
-        template = self.DEFAULT_PROMPTS.get(prompt_name, {}).get("template")
-        self._prompt_cache[prompt_name] = template
-        return template
+        Args:
+            prompt_name: Name of the prompt
+            
+        Returns:
+            Prompt template string or None if not found
+        """
+        prompt = self.get_compiled_prompt(prompt_name)
+        return prompt.template if prompt else None
+    
+    def get_prompt_version(self, prompt_name: str) -> Optional[str]:
+        """Content version of a prompt, for use in result-cache keys"""
+        prompt = self.get_compiled_prompt(prompt_name)
+        return prompt.version if prompt else None
     
     def update_prompt(self, prompt_name: str, new_template: str) -> bool:
         """
-        Update prompt template
+        Validate, compile and store a prompt template
         
         Args:
             prompt_name: Name of the prompt to update
@@ -150,22 +453,32 @@ class PromptRepository:
             
         Returns:
             True if successful, False otherwise
+        
+        Raises:
+            PromptTemplateError: If the prompt name is reserved, or the template is malformed or uses
+                unknown variables
         """
+        check_prompt_name(prompt_name)
         if not self.db_client.is_connected():
             return False
         
         collection = self.db_client.database[self.collection_name]
-        result = collection.update_one(
-            {"name": prompt_name},
-            {"$set": {"template": new_template}},
-            upsert=True
-        )
         
-        # Clear cache
-        if prompt_name in self._prompt_cache:
-            del self._prompt_cache[prompt_name]
+        try:
+            # Validate against the declared variables before anything is written
+            active = self._active_set_version(collection)
+            existing = collection.find_one(prompt_filter(active, prompt_name), {"variables": 1})
+            prompt, update = compile_update(prompt_name, new_template, existing, self.DEFAULT_PROMPTS)
+            
+            with start_span("mongodb.update_one", collection=self.collection_name, prompt=prompt_name):
+                result = collection.update_one(prompt_filter(active, prompt_name), update, upsert=True)
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return False
         
-        return result.modified_count > 0 or result.upserted_id is not None
+        self._remember(prompt_name, prompt)
+        
+        return result.matched_count > 0 or result.upserted_id is not None
     
     def list_prompts(self) -> list:
         """
@@ -175,15 +488,26 @@ class PromptRepository:
             List of prompt names
         """
         if not self.db_client.is_connected():
-            return list(self.DEFAULT_PROMPTS.keys())
+            return self._fallback_names()
+        
+        names = self._cached_names()
+        if names is not None:
+            return names
         
         collection = self.db_client.database[self.collection_name]
-        return [doc["name"] for doc in collection.find({}, {"name": 1})]
+        try:
+            active = self._active_set_version(collection)
+            with start_span("mongodb.find", collection=self.collection_name):
+                names = [doc["name"] for doc in collection.find(prompt_filter(active), {"name": 1})]
+            return self._store_names(names)
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return self._fallback_names()
     
     def get_prompt_with_variables(self, prompt_name: str, **kwargs) -> str:
         """Get prompt with variables replaced"""
-        template = self.get_prompt(prompt_name)
-        if not template:
+        prompt = self.get_compiled_prompt(prompt_name)
+        if not prompt:
             raise ValueError(f"Prompt '{prompt_name}' not found")
         
-        return template.format(**kwargs)
+        return prompt.render(**kwargs)
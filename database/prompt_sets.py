@@ -0,0 +1,95 @@
+"""
+Prompt-set documents and queries shared by the sync and async prompt repositories
+
+Prompts are stored in sets: each document carries the "set_version" it
+belongs to, and a pointer document (ACTIVE_SET_NAME) names the active set.
+Everything here is pure; the repositories only add the MongoDB calls.
+"""
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+from .prompt_template import CompiledPrompt, PromptTemplateError
+
+# Pointer document in the prompts collection; its "version" is the active prompt-set version
+ACTIVE_SET_NAME = "__active_set__"
+
+
+def new_set_version() -> str:
+    return datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def prompt_document(prompt_data: dict, set_version: Optional[str] = None) -> dict:
+    """Default prompt as stored in MongoDB, with its content version"""
+    document = dict(prompt_data)
+    document["version"] = CompiledPrompt.compute_version(prompt_data["template"])
+    if set_version is not None:
+        document["set_version"] = set_version
+    return document
+
+
+def staged_documents(defaults: dict, set_version: str) -> list:
+    """The default prompts as documents of a new set"""
+    return [prompt_document(prompt_data, set_version) for prompt_data in defaults.values()]
+
+
+def prompt_filter(set_version: Optional[str], prompt_name: Optional[str] = None) -> dict:
+    """Query for prompts of the active set (any prompt when no set exists yet)"""
+    query = {"set_version": set_version} if set_version else {"name": {"$ne": ACTIVE_SET_NAME}}
+    if prompt_name is not None:
+        query["name"] = prompt_name
+    return query
+
+
+def pointer_update(set_version: str, previous: Optional[dict]) -> dict:
+    """$set for the pointer document when set_version becomes active"""
+    return {
+        "version": set_version,
+        "previous": previous.get("version") if previous else None,
+        "updated_at": datetime.now(timezone.utc)
+    }
+
+
+def stale_sets_filter(set_version: str, previous: Optional[dict]) -> dict:
+    """Prompts of every set except the new and the previous one"""
+    keep = [set_version]
+    if previous and previous.get("version"):
+        keep.append(previous["version"])
+    return {"name": {"$ne": ACTIVE_SET_NAME}, "set_version": {"$nin": keep}}
+
+
+def check_prompt_name(prompt_name: str):
+    """
+    Names starting with "__" are reserved for bookkeeping documents such as the set pointer
+
+    Raises:
+        PromptTemplateError: For a reserved name
+    """
+    if prompt_name == ACTIVE_SET_NAME or prompt_name.startswith("__"):
+        raise PromptTemplateError(f"Prompt name '{prompt_name}' is reserved (names must not start with '__')")
+
+
+def compile_update(prompt_name: str, new_template: str, existing: Optional[dict], defaults: dict) -> tuple:
+    """
+    Validate a new template and build its update
+
+    Args:
+        prompt_name: Name of the prompt to update
+        new_template: New template string
+        existing: Stored prompt document (only "variables" is used), or None
+        defaults: DEFAULT_PROMPTS, for the variables of prompts not stored yet
+
+    Returns:
+        Tuple (CompiledPrompt, update document for update_one)
+
+    Raises:
+        PromptTemplateError: If the template is malformed or uses unknown variables
+    """
+    variables = (existing or {}).get("variables") or defaults.get(prompt_name, {}).get("variables")
+    prompt = CompiledPrompt(prompt_name, new_template, variables)
+    update = {"$set": {
+        "template": new_template,
+        "version": prompt.version,
+        "variables": list(prompt.variables),
+        "updated_at": datetime.now(timezone.utc)
+    }}
+    return prompt, update
@@ -0,0 +1,99 @@
+"""
+Precompiled, versioned prompt templates
+"""
+import hashlib
+import string
+from typing import Iterable, Optional
+
+
+class PromptTemplateError(ValueError):
+    """Raised when a template cannot be compiled or rendered"""
+    pass
+
+
+class CompiledPrompt:
+    """
+    Prompt template parsed once into literal and field segments
+
+    The version is a content hash of the template, so it changes exactly
+    when the text changes and can be used in result-cache keys.
+    """
+
+    __slots__ = ("name", "template", "version", "variables", "fields", "_segments")
+
+    def __init__(self, name: str, template: str, variables: Optional[Iterable[str]] = None):
+        """
+        Compile and validate a template
+
+        Args:
+            name: Prompt name
+            template: Template using str.format style {variable} fields
+            variables: Declared variables; fields outside this set are rejected
+
+        Raises:
+            PromptTemplateError: If the template is malformed or uses undeclared variables
+        """
+        if not isinstance(template, str) or not template.strip():
+            raise PromptTemplateError(f"Prompt '{name}' has an empty template")
+
+        self.name = name
+        self.template = template
+        self.version = self.compute_version(template)
+        self._segments = self._parse(name, template)
+        self.fields = frozenset(field for _, field in self._segments if field is not None)
+
+        declared = list(variables) if variables is not None else None
+        if declared is not None:
+            unknown = self.fields - set(declared)
+            if unknown:
+                raise PromptTemplateError(
+                    f"Prompt '{name}' uses undeclared variables: {', '.join(sorted(unknown))}. "
+                    f"Allowed: {', '.join(declared)}"
+                )
+        self.variables = tuple(declared) if declared is not None else tuple(sorted(self.fields))
+
+    @staticmethod
+    def compute_version(template: str) -> str:
+        return hashlib.sha256(template.encode("utf-8")).hexdigest()[:16]
+
+    @staticmethod
+    def _parse(name: str, template: str) -> tuple:
+        segments = []
+        try:
+            for literal, field, format_spec, conversion in string.Formatter().parse(template):
+                if field is not None:
+                    if not field.isidentifier():
+                        raise PromptTemplateError(
+                            f"Prompt '{name}' has unsupported field '{{{field}}}' "
+                            "(only plain {variable} names are allowed; escape braces as {{ }})"
+                        )
+                    if format_spec or conversion:
+                        raise PromptTemplateError(
+                            f"Prompt '{name}' field '{field}' must not use format specs or conversions"
+                        )
+                segments.append((literal, field))
+        except ValueError as e:
+            if isinstance(e, PromptTemplateError):
+                raise
+            raise PromptTemplateError(f"Prompt '{name}' is malformed: {e}")
+        return tuple(segments)
+
+    def render(self, **kwargs) -> str:
+        """
+        Substitute variables
+
+        Raises:
+            PromptTemplateError: If a field used by the template is missing
+        """
+        missing = self.fields.difference(kwargs)
+        if missing:
+            raise PromptTemplateError(
+                f"Prompt '{self.name}' is missing variables: {', '.join(sorted(missing))}"
+            )
+
+        parts = []
+        for literal, field in self._segments:
+            parts.append(literal)
+            if field is not None:
+                parts.append(str(kwargs[field]))
+        return "".join(parts)
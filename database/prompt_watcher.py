@@ -0,0 +1,99 @@
+"""
+Background invalidation of cached prompts when MongoDB changes
+"""
+import threading
+from typing import Callable
+from pymongo.errors import OperationFailure, PyMongoError
+from utils.logger import setup_logger
+
+logger = setup_logger("prompt_watcher")
+
+
+class PromptChangeWatcher:
+    """
+    Keeps the in-memory prompt table in sync with the prompts collection
+
+    Uses a MongoDB change stream when the server supports it (replica sets
+    and Atlas); otherwise polls the cheap {name, version, set_version} projection.
+    """
+
+    # Change streams are not available on standalone servers
+    _CHANGE_STREAM_UNSUPPORTED = {40573, 40324}
+
+    def __init__(
+        self,
+        get_collection: Callable,
+        on_change: Callable[[str], None],
+        on_versions: Callable[[list], None],
+        poll_interval: float,
+        use_change_streams: bool = True
+    ):
+        """
+        Args:
+            get_collection: Returns the prompts collection (or None when disconnected)
+            on_change: Called with a prompt name, or None to invalidate everything
+            on_versions: Called with the {name, version, set_version} documents after each poll
+            poll_interval: Seconds between polls (and between change stream retries)
+            use_change_streams: Try change streams before falling back to polling
+        """
+        self.get_collection = get_collection
+        self.on_change = on_change
+        self.on_versions = on_versions
+        self.poll_interval = poll_interval
+        self.use_change_streams = use_change_streams
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="prompt-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            collection = self.get_collection()
+            if collection is None:
+                self._stop_event.wait(self.poll_interval)
+                continue
+
+            if self.use_change_streams:
+                try:
+                    self._watch(collection)
+                except OperationFailure as e:
+                    if e.code in self._CHANGE_STREAM_UNSUPPORTED:
+                        logger.info("Change streams not supported by this MongoDB deployment, polling prompt versions")
+                        self.use_change_streams = False
+                    else:
+                        logger.warning(f"Prompt change stream failed: {e}")
+                        self._stop_event.wait(self.poll_interval)
+                except PyMongoError as e:
+                    logger.warning(f"Prompt change stream interrupted: {e}")
+                    # Changes may have been missed while the stream was down
+                    self.on_change(None)
+                    self._stop_event.wait(self.poll_interval)
+                continue
+
+            try:
+                self._poll(collection)
+            except PyMongoError as e:
+                logger.warning(f"Prompt version poll failed: {e}")
+            self._stop_event.wait(self.poll_interval)
+
+    def _watch(self, collection):
+        with collection.watch(full_document="updateLookup", max_await_time_ms=1000) as stream:
+            logger.info("Watching prompts collection for changes")
+            while not self._stop_event.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    continue
+                document = change.get("fullDocument") or {}
+                # Deletes and replacements without a document invalidate everything
+                self.on_change(document.get("name"))
+
+    def _poll(self, collection):
+        documents = list(collection.find({}, {"name": 1, "version": 1, "set_version": 1, "_id": 0}))
+        self.on_versions(documents)
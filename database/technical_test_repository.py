@@ -0,0 +1,169 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Optional
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import PyMongoError
+from config import Config
+from utils.logger import setup_logger
+from utils.tracing import start_span
+from .candidate_index import normalize, term_tokens
+from .mongodb import AsyncMongoDBClient
+
+logger = setup_logger("technical_test_repository")
+
+# Profile fields the technical test prompt uses
+TEST_PROFILE_FIELDS = ("profession", "technologies", "experience", "education")
+
+_NOT_SPECIFIED = {"not specified", "no especificado", "n/a", "none"}
+
+
+def canonical_profile(profile_data: dict) -> dict:
+    """
+    The technical test inputs in a form that ignores formatting differences
+
+    Case, accents, whitespace and technology order do not change the key, and
+    a missing field is the same as "Not specified".
+    """
+    canonical = {}
+    for field in TEST_PROFILE_FIELDS:
+        value = profile_data.get(field)
+        if field == "technologies":
+            canonical[field] = ", ".join(sorted(term_tokens(value)))
+            continue
+        if isinstance(value, (list, tuple)):
+            value = ", ".join(str(v) for v in value)
+        text = normalize(str(value)) if value is not None else ""
+        canonical[field] = "" if text in _NOT_SPECIFIED else text
+    return canonical
+
+
+def technical_test_key(profile_data: dict, prompt_version: Optional[str], tenant: Optional[str] = None) -> str:
+    """Cache key of a technical test: canonical profile plus prompt version, within a tenant's tests"""
+    payload = json.dumps([canonical_profile(profile_data), prompt_version or "", tenant or ""], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TechnicalTestRepository:
+    """
+    Stored technical tests, looked up by technical_test_key
+
+    MongoDB holds the tests of every worker (expiring after
+    TECHNICAL_TEST_TTL_DAYS); a small in-process LRU answers repeated lookups
+    and keeps working while MongoDB is unavailable.
+    """
+
+    def __init__(self):
+        self.db_client = AsyncMongoDBClient()
+        self.collection_name = "technical_tests"
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._indexes_created = False
+
+    def _collection(self):
+        if not self.db_client.is_connected():
+            return None
+        return self.db_client.database[self.collection_name]
+
+    async def _ensure_indexes(self, collection):
+        if self._indexes_created:
+            return
+        await collection.create_indexes([
+            IndexModel([("created_at", ASCENDING)], expireAfterSeconds=Config.TECHNICAL_TEST_TTL_DAYS * 86400),
+            IndexModel([("source", ASCENDING), ("used_at", ASCENDING)]),
+        ])
+        self._indexes_created = True
+
+    def _remember(self, document: dict):
+        self._memory[document["_id"]] = document
+        self._memory.move_to_end(document["_id"])
+        while len(self._memory) > Config.TECHNICAL_TEST_MEMORY_ENTRIES:
+            self._memory.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[dict]:
+        """Stored test document, or None"""
+        document = self._memory.get(key)
+        if document is not None:
+            self._memory.move_to_end(key)
+            return document
+
+        collection = self._collection()
+        if collection is None:
+            return None
+        try:
+            with start_span("mongodb.find_one", collection=self.collection_name):
+                document = await collection.find_one({"_id": key})
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return None
+        if document is not None:
+            self._remember(document)
+        return document
+
+    async def save(
+        self,
+        key: str,
+        technical_test: str,
+        profile_data: dict,
+        prompt_version: Optional[str],
+        source: str,
+        tenant: Optional[str] = None
+    ):
+        """Store a test unless one already exists for the key"""
+        document = {
+            "_id": key,
+            "technical_test": technical_test,
+            "profile": canonical_profile(profile_data),
+            "prompt_version": prompt_version,
+            "tenant": tenant,
+            "source": source,
+            "created_at": datetime.now(timezone.utc),
+        }
+        self._remember(document)
+
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            await self._ensure_indexes(collection)
+            with start_span("mongodb.update_one", collection=self.collection_name):
+                await collection.update_one({"_id": key}, {"$setOnInsert": document}, upsert=True)
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            logger.warning(f"Could not store technical test: {e}")
+
+    async def mark_used(self, key: str) -> bool:
+        """
+        Record that a stored test was served
+
+        Returns:
+            True on its first use (counted once across workers when MongoDB is available)
+        """
+        now = datetime.now(timezone.utc)
+        document = self._memory.get(key)
+        first_use = document is not None and "used_at" not in document
+        if document is not None:
+            document.setdefault("used_at", now)
+
+        collection = self._collection()
+        if collection is None:
+            return first_use
+        try:
+            result = await collection.update_one({"_id": key, "used_at": {"$exists": False}}, {"$set": {"used_at": now}})
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return first_use
+        return result.modified_count > 0
+
+    async def usage(self, source: str) -> Optional[dict]:
+        """Stored and used counts of tests from one source, or None if MongoDB is unavailable"""
+        collection = self._collection()
+        if collection is None:
+            return None
+        try:
+            stored = await collection.count_documents({"source": source})
+            used = await collection.count_documents({"source": source, "used_at": {"$exists": True}})
+        except PyMongoError as e:
+            self.db_client.report_failure(e)
+            return None
+        return {"stored": stored, "used": used}
@@ -1,17 +1,60 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks, Request, APIRouter, Depends, Header, Query, Body
+from fastapi.responses import HTMLResponse, JSONResponse, Response, PlainTextResponse, StreamingResponse
+from starlette.datastructures import UploadFile as StarletteUploadFile
 from starlette.middleware.gzip import GZipMiddleware
 from config import Config
+from database import (
+    AsyncPromptRepository, CandidateRepository, MongoDBClient, PromptRepository, PromptTemplateError,
+    TechnicalTestRepository
+)
 from services import VideoProcessor
 from services.ai_factory import AIServiceFactory
+from services.speculative_tests import SpeculativeTestGenerator
+from services.resumable_uploads import ResumableUploadStore, UploadError
+from services.video_batch import VideoBatchIngestor, is_archive
+from services.technical_test_batch import TechnicalTestBatchRunner, missing_fields, profile_summary
+from services.tenancy import FairQueue, Tenant, TenantLimitExceeded, TenantRegistry, tenant_context
+from utils.http_cache import StaticBody, VersionedJSON, make_etag
+from utils.logger import setup_logger, log_context, Timer
+from utils.memory import ASSUMED_VIDEO_BYTES_PER_SECOND, MemoryBudgetExceeded, MemoryGovernor, estimate_job_bytes
+from utils.metrics import AUDIO_SECONDS, IN_FLIGHT_REQUESTS, track_stage, track_executor, render_metrics
+from utils.tracing import start_span
 import asyncio
+import contextvars
+import functools
+import hmac
+import json
+import math
+import os
+import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import Optional
 from concurrent.futures import ThreadPoolExecutor
 
-Config.validate()
+logger = setup_logger("api")
+
+_warmup_task: Optional[asyncio.Task] = None
+_sweep_task: Optional[asyncio.Task] = None
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global _warmup_task, _sweep_task
+    Config.validate()
+    if Config.WARMUP_ENABLED:
+        # Runs on worker threads while the server starts listening; requests never wait for it
+        _warmup_task = asyncio.create_task(warm_up(), context=contextvars.Context())
+    _sweep_task = asyncio.create_task(sweep_uploads(), context=contextvars.Context())
+    yield
+    _sweep_task.cancel()
+    if _warmup_task is not None:
+        _warmup_task.cancel()
+
 
 app = FastAPI(
     title="Video Profile Extractor API",
-    version="1.0.1"
+    version="1.0.1",
+    lifespan=lifespan
 )
 
 # Add GZIP compression for faster responses
@@ -24,15 +67,135 @@ video_processor = VideoProcessor(
 
 # Use load balancer for intelligent task distribution
 ai_load_balancer = AIServiceFactory.create_load_balancer()
-print(f"[Load Balancer] Initialized with {len(ai_load_balancer.services)} services")
+logger.info(f"Load balancer initialized with {len(ai_load_balancer.services)} services")
+
+
+async def warm_up():
+    """Create provider clients, open their connections and compile the prompts ahead of the first video"""
+    timer = Timer()
+    loop = asyncio.get_running_loop()
+    names = list(ai_load_balancer.services)
+    outcomes = await asyncio.gather(
+        *(loop.run_in_executor(None, ai_load_balancer.services[name].warm_up) for name in names),
+        loop.run_in_executor(None, prime_prompts),
+        return_exceptions=True
+    )
+    failed = {
+        name: str(outcome) for name, outcome in zip(names + ["prompts"], outcomes) if isinstance(outcome, Exception)
+    }
+    log = logger.warning if failed else logger.info
+    log("Warm-up finished", extra={
+        "providers": [name for name in names if name not in failed],
+        "failed": failed,
+        "duration_ms": timer.ms
+    })
+
+
+def prime_prompts():
+    """Compile every prompt into the shared table (from MongoDB when connected)"""
+    repository = PromptRepository()
+    for name in PromptRepository.DEFAULT_PROMPTS:
+        repository.get_compiled_prompt(name)
+
 
 # Thread pool for parallel AI operations
 executor = ThreadPoolExecutor(max_workers=3)
+track_executor("ai", executor)
 
+# Video jobs wait here until their estimated memory fits the budget
+memory_governor = MemoryGovernor(Config.MEMORY_BUDGET_MB * 1024 * 1024)
 
-@app.get("/", response_class=HTMLResponse)
-async def get_upload_form():
-    html = """<!DOCTYPE html>
+# Tenants (X-API-Key) and the fair queues in front of the provider and FFmpeg stages
+tenants = TenantRegistry()
+ai_queue = FairQueue("ai", Config.AI_STAGE_SLOTS, tenants.default)
+ffmpeg_queue = FairQueue("ffmpeg", Config.FFMPEG_STAGE_SLOTS, tenants.default)
+
+
+async def run_in_executor(func, *args):
+    """Run a blocking provider call on the AI executor once the tenant's turn comes, keeping the log context"""
+    async with ai_queue.slot():
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor, functools.partial(ctx.run, func, *args))
+
+
+async def run_ffmpeg(func, *args):
+    """Run an FFmpeg conversion on a worker thread once the tenant's turn comes, keeping the log context"""
+    async with ffmpeg_queue.slot():
+        ctx = contextvars.copy_context()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(ctx.run, func, *args))
+
+
+def require_tenant(request: Request) -> Tenant:
+    """The caller's tenant; 401 without a valid X-API-Key while tenants are configured"""
+    tenant = getattr(request.state, "tenant", None)
+    if tenant is None:
+        raise HTTPException(status_code=401, detail="Missing or unknown X-API-Key", headers={"WWW-Authenticate": "ApiKey"})
+    return tenant
+
+
+def admit_request(tenant: Tenant = Depends(require_tenant)) -> Tenant:
+    """require_tenant, counting the request against the tenant's requests_per_minute"""
+    with tenant_limits():
+        tenant.admit_request()
+    return tenant
+
+
+@contextmanager
+def tenant_limits():
+    """Turn TenantLimitExceeded into 429 with Retry-After"""
+    try:
+        yield
+    except TenantLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+
+
+@contextmanager
+def pipeline_stage(stage: str):
+    """Time, trace and tag logs for one pipeline stage"""
+    with track_stage(stage), log_context(stage=stage), start_span(stage):
+        yield
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    """Assign a request id, count in-flight requests and log completion (scrapes excluded)"""
+    if request.url.path == "/metrics":
+        return await call_next(request)
+    
+    request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    # Identified here for logs and fair queuing; endpoints that need a tenant reject unknown keys
+    tenant = tenants.resolve(request.headers.get("X-API-Key"))
+    request.state.tenant = tenant
+    timer = Timer()
+    IN_FLIGHT_REQUESTS.inc()
+    with log_context(request_id=request_id, tenant=tenant.name if tenant else None), tenant_context(tenant), start_span(
+        f"{request.method} {request.url.path}",
+        traceparent=request.headers.get("traceparent"),
+        request_id=request_id,
+        http_method=request.method,
+        http_path=request.url.path
+    ) as span:
+        try:
+            response = await call_next(request)
+        finally:
+            IN_FLIGHT_REQUESTS.dec()
+        
+        span.set_attributes(http_status=response.status_code)
+        if response.status_code >= 500:
+            span.mark_error(f"HTTP {response.status_code}")
+        response.headers["X-Request-ID"] = request_id
+        if span.trace_id:
+            response.headers["X-Trace-Id"] = span.trace_id
+        logger.info(
+            f"{request.method} {request.url.path}",
+            extra={"status": response.status_code, "duration_ms": timer.ms}
+        )
+        return response
+
+
+UPLOAD_FORM_HTML = """<!DOCTYPE html>
 <html>
 <head>
     <title>Video Profile Extractor API</title>
@@ -68,6 +231,7 @@ async def get_upload_form():
             <input type="file" name="file" accept="video/*" required>
             <button type="submit">📤 Upload and Process Video</button>
         </form>
+        <p><span class="method post">POST</span> <code>/upload-videos</code> - Several videos (repeat the <code>files</code> field) or one zip/tar archive; results are streamed as NDJSON.</p>
     </div>
 
     <h2>2. Generate Technical Test (For Companies)</h2>
@@ -82,6 +246,7 @@ async def get_upload_form():
 }</pre>
         <p><strong>Response:</strong> Technical test in Markdown format ready to send to candidate.</p>
         <p><em>Note: This endpoint is used by companies after reviewing candidate profiles.</em></p>
+        <p><span class="method post">POST</span> <code>/generate-technical-test/batch</code> - A JSON list of profiles; results are streamed as NDJSON as each test completes.</p>
     </div>
 
     <h2>3. Manage Prompts</h2>
@@ -94,138 +259,532 @@ async def get_upload_form():
     <p><a href="/health" target="_blank">Check API Health</a> | <a href="/prompts" target="_blank">View Prompts</a></p>
 </body>
 </html>"""
-    return HTMLResponse(content=html)
+
+# Compressed once at startup instead of by GZipMiddleware on every hit
+upload_form = StaticBody(
+    "upload_form", UPLOAD_FORM_HTML, "text/html; charset=utf-8", f"public, max-age={Config.STATIC_MAX_AGE}"
+)
+
+
+@app.get("/", response_class=HTMLResponse)
+async def get_upload_form(request: Request):
+    return upload_form.respond(request)
+
+
+_candidate_repository: Optional[CandidateRepository] = None
+
+
+def get_candidate_repository() -> CandidateRepository:
+    """Shared candidate repository (and its search index), reused by every request"""
+    global _candidate_repository
+    if _candidate_repository is None:
+        _candidate_repository = CandidateRepository()
+    return _candidate_repository
+
+
+def candidate_scope(tenant: Tenant) -> Optional[str]:
+    """Tenant whose candidates and stored tests a caller sees; None (all of them) while tenants are not configured"""
+    return tenant.name if tenants.enabled else None
+
+
+async def transcribe(audio_path: str) -> str:
+    """Step 1 of a video job: transcribe its audio (Groq - best for transcription)"""
+    with pipeline_stage("transcription"):
+        return await run_in_executor(ai_load_balancer.transcribe_audio, audio_path)
+
+
+async def process_transcription(
+    transcription: str, filename: str, candidate_repo: CandidateRepository, tenant: Tenant
+) -> dict:
+    """Profile extraction, CV generation and storage of one video's transcription for a tenant"""
+    # Step 2: Profile extraction
+    with pipeline_stage("profile_extraction"):
+        profile_data = await run_in_executor(ai_load_balancer.extract_profile, transcription)
+    
+    # Companies usually request a technical test for this exact profile: prepare it in the background
+    if Config.SPECULATIVE_TESTS_ENABLED:
+        get_speculative_tests().schedule(profile_data, tenant=candidate_scope(tenant))
+    
+    # Step 3: Generate CV profile (can start immediately after profile extraction)
+    with pipeline_stage("cv_generation"):
+        cv_profile = await run_in_executor(
+            ai_load_balancer.generate_cv_profile,
+            transcription,
+            profile_data
+        )
+    
+    response = {
+        "cv_profile": cv_profile,
+        "profile_data": profile_data
+    }
+    
+    # Step 4: Store the result for candidate search (never fails the request)
+    if Config.CANDIDATES_ENABLED:
+        with pipeline_stage("persist"):
+            candidate_id = await candidate_repo.save(
+                transcription, profile_data, cv_profile, tenant=tenant.name, source_filename=filename
+            )
+        if candidate_id:
+            response["candidate_id"] = candidate_id
+    
+    return response
+
+
+@asynccontextmanager
+async def admitted(audio_seconds: float, filename: str):
+    """
+    Hold the memory reservation of a video job's audio stages (waits while the budget is full)
+    
+    The reservation covers FFmpeg and transcription; the text stages that follow
+    hold little memory and run after it is released.
+    """
+    estimate = estimate_job_bytes(audio_seconds)
+    async with memory_governor.reserve(estimate, timeout=Config.MEMORY_ADMISSION_TIMEOUT, upload_filename=filename):
+        yield
+
+
+async def process_admitted(
+    audio_path: str, filename: str, candidate_repo: CandidateRepository, tenant: Tenant
+) -> dict:
+    """The AI stages of one video once the tenant's audio limit and the memory budget allow it (batch and resumable uploads)"""
+    audio_seconds = video_processor.audio_duration(audio_path)
+    await tenant.charge_audio(audio_seconds)
+    async with admitted(audio_seconds, filename):
+        transcription = await transcribe(audio_path)
+    return await process_transcription(transcription, filename, candidate_repo, tenant)
 
 
 @app.post("/upload-video")
-async def upload_video(file: UploadFile = File(...)):
+async def upload_video(
+    file: UploadFile = File(...),
+    candidate_repo: CandidateRepository = Depends(get_candidate_repository),
+    tenant: Tenant = Depends(admit_request)
+):
     video_path = None
     audio_path = None
     
     try:
         # Process video and extract audio
-        print(f"[DEBUG] Processing video file: {file.filename}")
-        video_path, audio_path = video_processor.process_video(file)
-        print(f"[DEBUG] Video processed successfully. Audio path: {audio_path}")
+        logger.info("Processing video file", extra={"upload_filename": file.filename})
+        video_path = await asyncio.to_thread(video_processor.save_upload, file.file)
         
-        # Step 1: Transcribe audio (Groq - best for transcription)
-        loop = asyncio.get_event_loop()
-        transcription = await loop.run_in_executor(
-            executor,
-            ai_load_balancer.transcribe_audio,
-            audio_path
-        )
-        
-        # Step 2 & 3: Run profile extraction and CV generation in parallel
-        profile_task = loop.run_in_executor(
-            executor,
-            ai_load_balancer.extract_profile,
-            transcription
-        )
-        
-        # Wait for profile extraction first
-        profile_data = await profile_task
-        
-        # Step 3: Generate CV profile (can start immediately after profile extraction)
-        cv_profile = await loop.run_in_executor(
-            executor,
-            ai_load_balancer.generate_cv_profile,
-            transcription,
-            profile_data
+        # The upload is spooled to disk; FFmpeg and transcription wait for memory budget
+        duration = await asyncio.get_running_loop().run_in_executor(None, video_processor.probe_duration, video_path)
+        if duration is None:
+            # No duration in the header: assume a low bitrate, which overestimates
+            duration = os.path.getsize(video_path) / ASSUMED_VIDEO_BYTES_PER_SECOND
+        await tenant.charge_audio(duration)
+        async with admitted(duration, file.filename):
+            audio_path = await run_ffmpeg(video_processor.convert_upload, video_path)
+            transcription = await transcribe(audio_path)
+        response = await process_transcription(transcription, file.filename, candidate_repo, tenant)
+        return JSONResponse(content=response)
+    
+    except TenantLimitExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(math.ceil(e.retry_after))})
+    
+    except MemoryBudgetExceeded as e:
+        raise HTTPException(
+            status_code=503, detail=str(e), headers={"Retry-After": str(int(Config.MEMORY_ADMISSION_TIMEOUT))}
         )
-        
-        return JSONResponse(content={
-            "cv_profile": cv_profile,
-            "profile_data": profile_data
-        })
     
     except Exception as e:
         import traceback
         error_detail = f"{str(e)}\n\nTraceback:\n{traceback.format_exc()}"
-        print(f"[ERROR] {error_detail}")
+        logger.error("Video processing failed", exc_info=True)
         raise HTTPException(status_code=500, detail=error_detail)
     
     finally:
-        if video_path and audio_path:
-            video_processor.cleanup(video_path, audio_path)
+        video_processor.cleanup(video_path, audio_path)
+
+
+_video_batch: Optional[VideoBatchIngestor] = None
+
+
+def get_video_batch() -> VideoBatchIngestor:
+    """Shared batch ingestor (its FFmpeg thread is shared by concurrent batches)"""
+    global _video_batch
+    if _video_batch is None:
+        candidate_repo = get_candidate_repository()
+        _video_batch = VideoBatchIngestor(
+            video_processor,
+            lambda audio_path, filename, tenant: process_admitted(audio_path, filename, candidate_repo, tenant),
+            ffmpeg_queue=ffmpeg_queue
+        )
+    return _video_batch
+
+
+@app.post("/upload-videos")
+async def upload_videos(request: Request, tenant: Tenant = Depends(admit_request)):
+    """
+    Process several videos, uploaded as files or as one zip/tar archive, streamed as NDJSON
+    
+    Multipart form with one or more "files" fields. Each line is one video's
+    /upload-video result (or "error") as soon as it is done, with its "index"
+    and "filename"; the last line is a throughput "summary".
+    """
+    # Parsed here rather than with File(...): FastAPI closes those uploads before the response streams
+    form = await request.form()
+    files = [f for f in form.getlist("files") if isinstance(f, StarletteUploadFile)]
+    if not files:
+        await form.close()
+        raise HTTPException(status_code=400, detail="No files uploaded (multipart field \"files\")")
+    logger.info(
+        "Processing video batch",
+        extra={"files": len(files), "archives": sum(is_archive(f.filename) for f in files)}
+    )
+    
+    async def lines():
+        try:
+            async for item in get_video_batch().run([(f.filename, f.file) for f in files], tenant=tenant):
+                yield json.dumps(item, ensure_ascii=False) + "\n"
+        finally:
+            await form.close()
+    
+    # Not compressed: GZipMiddleware would hold lines back (see /generate-technical-test/batch)
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson", headers={"Content-Encoding": "identity"}
+    )
+
+
+_upload_store: Optional[ResumableUploadStore] = None
+_upload_tasks = set()  # Processing of completed uploads, referenced until done
+
+
+def get_upload_store() -> ResumableUploadStore:
+    """Resumable upload state in the scratch area"""
+    global _upload_store
+    if _upload_store is None:
+        _upload_store = ResumableUploadStore(video_processor)
+    return _upload_store
+
+
+async def sweep_uploads():
+    """Expire abandoned uploads and stop their FFmpeg processes even when no new upload is created"""
+    while True:
+        await asyncio.sleep(Config.UPLOAD_SWEEP_INTERVAL)
+        try:
+            get_upload_store().sweep()
+        except Exception as e:
+            logger.warning(f"Upload sweep failed: {e}")
+
+
+@contextmanager
+def upload_errors():
+    """Turn UploadError into the HTTP error, with the current Upload-Offset when known"""
+    try:
+        yield
+    except UploadError as e:
+        headers = {"Upload-Offset": str(e.offset)} if e.offset is not None else None
+        raise HTTPException(status_code=e.status_code, detail=str(e), headers=headers)
+
+
+async def process_upload(upload_id: str):
+    """Run the /upload-video pipeline on a completed resumable upload"""
+    store = get_upload_store()
+    audio_path = None
+    try:
+        status = store.status(upload_id)
+    except UploadError:
+        return  # Deleted right after its last chunk
+    # Queued and rate limited as the tenant that uploaded it
+    tenant = tenants.get(status.get("tenant"))
+    with log_context(request_id=upload_id, tenant=tenant.name), tenant_context(tenant), start_span(
+        "resumable_upload", upload_id=upload_id
+    ) as span:
+        try:
+            with pipeline_stage("ffmpeg"):
+                audio_path, audio_seconds = await run_ffmpeg(store.extract_audio, upload_id)
+            span.set_attributes(audio_seconds=round(audio_seconds, 3))
+            AUDIO_SECONDS.inc(audio_seconds)
+            response = await process_admitted(audio_path, status["filename"], get_candidate_repository(), tenant)
+            store.finish(upload_id, result=response)
+        except UploadError:
+            logger.info("Upload deleted while processing")
+        except Exception as e:
+            logger.error("Resumable upload processing failed", exc_info=True)
+            span.mark_error(str(e))
+            try:
+                store.finish(upload_id, error=str(e))
+            except UploadError:
+                pass
+        finally:
+            if audio_path:
+                video_processor.cleanup(None, audio_path)
+
+
+@app.post("/uploads", status_code=201)
+async def create_upload(upload: dict, response: Response, tenant: Tenant = Depends(admit_request)):
+    """
+    Start a resumable upload: {"filename": "...", "size": <total bytes>}
+    
+    Send the video with PATCH /uploads/{id} chunks; processing starts when the last one lands.
+    """
+    size = upload.get("size")
+    if not isinstance(size, int):
+        raise HTTPException(status_code=400, detail="Field 'size' (total bytes) is required")
+    with upload_errors():
+        status = get_upload_store().create(upload.get("filename"), size, tenant=tenant.name)
+    response.headers["Location"] = f"/uploads/{status['upload_id']}"
+    return status
+
+
+@app.head("/uploads/{upload_id}")
+async def upload_offset(upload_id: str, tenant: Tenant = Depends(require_tenant)):
+    """Current offset to resume from (tus style)"""
+    with upload_errors():
+        status = get_upload_store().status(upload_id, tenant=tenant.name)
+    return Response(headers={
+        "Upload-Offset": str(status["offset"]),
+        "Upload-Length": str(status["size"]),
+        "Cache-Control": "no-store",
+    })
+
+
+@app.get("/uploads/{upload_id}")
+async def upload_status(upload_id: str, tenant: Tenant = Depends(require_tenant)):
+    """Offset and status (uploading, processing, done, failed); includes the result when done"""
+    with upload_errors():
+        return get_upload_store().status(upload_id, tenant=tenant.name)
+
+
+@app.patch("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    upload_checksum: Optional[str] = Header(None, alias="Upload-Checksum"),
+    tenant: Tenant = Depends(require_tenant)
+):
+    """
+    Write the request body at Upload-Offset, verified against Upload-Checksum ("sha256 <base64>")
+    
+    409 (offset mismatch) and 460 (checksum mismatch) carry the Upload-Offset to resume from.
+    """
+    with upload_errors():
+        get_upload_store().status(upload_id, tenant=tenant.name)
+        result = await get_upload_store().write_chunk(upload_id, upload_offset, upload_checksum, request.stream())
+    
+    if result["status"] == "processing":
+        # A fresh context: processing outlives this request, so it gets its own trace
+        task = asyncio.create_task(process_upload(upload_id), context=contextvars.Context())
+        _upload_tasks.add(task)
+        task.add_done_callback(_upload_tasks.discard)
+    return JSONResponse(content=result, headers={"Upload-Offset": str(result["offset"])})
+
+
+@app.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload(upload_id: str, tenant: Tenant = Depends(require_tenant)):
+    with upload_errors():
+        get_upload_store().status(upload_id, tenant=tenant.name)
+        get_upload_store().delete(upload_id)
+    return Response(status_code=204)
+
+
+@app.get("/candidates/search")
+async def search_candidates(
+    profession: Optional[str] = None,
+    technologies: Optional[str] = Query(None, description="Comma separated, e.g. python,docker"),
+    languages: Optional[str] = None,
+    keywords: Optional[str] = Query(None, description="Experience and skill keywords"),
+    match: str = Query("any", pattern="^(any|all)$"),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    candidate_repo: CandidateRepository = Depends(get_candidate_repository),
+    tenant: Tenant = Depends(admit_request)
+):
+    """Search the caller's stored candidates, ranked by matching technologies and keywords"""
+    with start_span("candidate_search"):
+        result = await candidate_repo.search(
+            profession=profession,
+            technologies=technologies,
+            languages=languages,
+            keywords=keywords,
+            match_all=match == "all",
+            limit=limit,
+            offset=offset,
+            tenant=candidate_scope(tenant)
+        )
+    result["indexed"] = candidate_repo.index.count(candidate_scope(tenant))
+    return result
+
+
+@app.get("/candidates/{candidate_id}")
+async def get_candidate(
+    candidate_id: str,
+    candidate_repo: CandidateRepository = Depends(get_candidate_repository),
+    tenant: Tenant = Depends(admit_request)
+):
+    """Full stored result for one of the caller's candidates (transcription, profile data and CV profile)"""
+    candidate = await candidate_repo.get(candidate_id, tenant=candidate_scope(tenant))
+    if candidate is None:
+        raise HTTPException(status_code=404, detail=f"Candidate '{candidate_id}' not found")
+    return candidate
 
 
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    # MongoDB is optional (prompts fall back to the last known set), so it never fails the check
+    if not Config.MONGODB_ENABLED:
+        mongodb = "disabled"
+    elif MongoDBClient().is_connected():
+        mongodb = "connected"
+    else:
+        mongodb = "unavailable"
+    return {"status": "healthy", "mongodb": mongodb}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics (stage and provider latencies, fallbacks, errors, cache, load)"""
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
+
+
+@app.get("/stats/model-tiers")
+async def model_tier_stats():
+    """Requests, mean latency and escalation rate of the small and large model tiers per task"""
+    return {"enabled": Config.MODEL_TIERING_ENABLED, "tasks": ai_load_balancer.tier_stats()}
+
+
+@app.get("/stats/memory")
+async def memory_stats():
+    """Memory budget, reservations of running video jobs, waiting jobs and actual resident memory"""
+    return memory_governor.snapshot()
+
+
+@app.get("/stats/tenants")
+async def tenant_stats(request: Request, x_admin_key: Optional[str] = Header(None)):
+    """Per-tenant limits, remaining budget, usage and fair queue delays (all tenants for admins, else the caller's)"""
+    if _is_admin(x_admin_key) or not tenants.enabled:
+        return tenants.snapshot()
+    return tenants.snapshot([require_tenant(request).name])
+
+
+@app.get("/quotas")
+async def provider_quotas():
+    """Provider usage per minute, hour and day against configured limits, with daily exhaustion forecasts"""
+    if ai_load_balancer.quota is None:
+        return {"enabled": False}
+    return {"enabled": True, **ai_load_balancer.quota.snapshot()}
+
+
+@app.get("/stats/providers")
+async def provider_coordination():
+    """Provider backoff and cross-replica rate limit buckets, as shared with the other replicas"""
+    if ai_load_balancer.coordinator is None:
+        return {"enabled": False}
+    return {"enabled": True, **await asyncio.get_running_loop().run_in_executor(None, ai_load_balancer.coordinator.snapshot)}
+
+
+_prompt_repository: Optional[AsyncPromptRepository] = None
+
+
+def get_prompt_repository() -> AsyncPromptRepository:
+    """Shared prompt repository, created on first use and reused by every request"""
+    global _prompt_repository
+    if _prompt_repository is None:
+        _prompt_repository = AsyncPromptRepository()
+    return _prompt_repository
+
+
+# ETags from prompt versions, so CDNs and clients revalidate with a 304 instead of a full body
+_prompt_cache_control = f"public, max-age={Config.PROMPT_MAX_AGE}"
+prompt_list_responses = VersionedJSON("prompts", _prompt_cache_control)
+prompt_responses = VersionedJSON("prompt", _prompt_cache_control)
 
 
 @app.get("/prompts")
-async def list_prompts():
+async def list_prompts(request: Request, prompt_repo: AsyncPromptRepository = Depends(get_prompt_repository)):
     """List all available prompts"""
-    from database import PromptRepository
-    prompt_repo = PromptRepository()
-    prompts = prompt_repo.list_prompts()
-    return {"prompts": prompts}
+    prompts = await prompt_repo.list_prompts()
+    return prompt_list_responses.respond(request, "", make_etag(*prompts), lambda: {"prompts": prompts})
 
 
 @app.get("/prompts/{prompt_name}")
-async def get_prompt(prompt_name: str):
+async def get_prompt(
+    prompt_name: str,
+    request: Request,
+    prompt_repo: AsyncPromptRepository = Depends(get_prompt_repository)
+):
     """Get a specific prompt template"""
-    from database import PromptRepository
-    prompt_repo = PromptRepository()
-    template = prompt_repo.get_prompt(prompt_name)
+    prompt = await prompt_repo.get_compiled_prompt(prompt_name)
     
-    if not template:
+    if not prompt:
         raise HTTPException(status_code=404, detail=f"Prompt '{prompt_name}' not found")
     
-    return {"name": prompt_name, "template": template}
+    return prompt_responses.respond(request, prompt_name, make_etag(prompt.version), lambda: {
+        "name": prompt_name,
+        "template": prompt.template,
+        "version": prompt.version,
+        "variables": list(prompt.variables)
+    })
 
 
 @app.put("/prompts/{prompt_name}")
-async def update_prompt(prompt_name: str, new_template: dict):
-    """Update a prompt template"""
-    from database import PromptRepository
-    prompt_repo = PromptRepository()
-    
+async def update_prompt(
+    prompt_name: str,
+    new_template: dict,
+    prompt_repo: AsyncPromptRepository = Depends(get_prompt_repository)
+):
+    """Update a prompt template (validated and compiled before it is stored)"""
     if "template" not in new_template:
         raise HTTPException(status_code=400, detail="Field 'template' is required")
     
-    success = prompt_repo.update_prompt(prompt_name, new_template["template"])
+    try:
+        success = await prompt_repo.update_prompt(prompt_name, new_template["template"])
+    except PromptTemplateError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
     if not success:
         raise HTTPException(status_code=500, detail="Failed to update prompt")
     
-    return {"message": f"Prompt '{prompt_name}' updated successfully"}
+    return {
+        "message": f"Prompt '{prompt_name}' updated successfully",
+        "version": await prompt_repo.get_prompt_version(prompt_name)
+    }
 
 
 @app.post("/prompts/reset")
-async def reset_prompts():
+async def reset_prompts(prompt_repo: AsyncPromptRepository = Depends(get_prompt_repository)):
     """Reset all prompts to default values (useful after code updates)"""
-    from database import PromptRepository
-    prompt_repo = PromptRepository()
+    result = await prompt_repo.reset_prompts()
     
-    if not prompt_repo.db_client.is_connected():
+    if result is None:
         raise HTTPException(status_code=500, detail="Cannot connect to MongoDB")
     
-    collection = prompt_repo.db_client.database[prompt_repo.collection_name]
-    
-    # Delete all existing prompts
-    result = collection.delete_many({})
-    deleted_count = result.deleted_count
-    
-    # Insert updated prompts from DEFAULT_PROMPTS
-    collection.insert_many(list(prompt_repo.DEFAULT_PROMPTS.values()))
-    inserted_count = len(prompt_repo.DEFAULT_PROMPTS)
-    
-    # Clear cache
-    prompt_repo._prompt_cache.clear()
-    
     return {
         "message": "All prompts reset to default values",
-        "deleted": deleted_count,
-        "inserted": inserted_count,
+        "deleted": result["deleted"],
+        "inserted": result["inserted"],
+        "set_version": result["set_version"],
         "prompts": list(prompt_repo.DEFAULT_PROMPTS.keys())
     }
 
 
+_speculative_tests: Optional[SpeculativeTestGenerator] = None
+
+
+def get_speculative_tests() -> SpeculativeTestGenerator:
+    """Shared speculative technical test generator"""
+    global _speculative_tests
+    if _speculative_tests is None:
+        _speculative_tests = SpeculativeTestGenerator(
+            ai_load_balancer, TechnicalTestRepository(), get_prompt_repository()
+        )
+    return _speculative_tests
+
+
+@app.get("/stats/speculative-tests")
+async def speculative_test_stats():
+    """Daily budget use, outcomes and the fraction of speculative tests that were requested"""
+    if not Config.SPECULATIVE_TESTS_ENABLED:
+        return {"enabled": False}
+    return {"enabled": True, **await get_speculative_tests().stats()}
+
+
 @app.post("/generate-technical-test")
-async def generate_technical_test(profile_data: dict):
+async def generate_technical_test(profile_data: dict, tenant: Tenant = Depends(admit_request)):
     """
     Generate technical test based on job requirements
     
@@ -240,36 +799,211 @@ async def generate_technical_test(profile_data: dict):
     """
     try:
         # Validate required fields
-        required_fields = ["profession", "technologies"]
-        missing_fields = [field for field in required_fields if field not in profile_data]
+        missing = missing_fields(profile_data)
         
-        if missing_fields:
+        if missing:
             raise HTTPException(
                 status_code=400, 
-                detail=f"Missing required fields: {', '.join(missing_fields)}"
+                detail=f"Missing required fields: {', '.join(missing)}"
             )
         
+        # Served instantly when it was generated speculatively after the candidate's upload
+        technical_test = None
+        if Config.SPECULATIVE_TESTS_ENABLED:
+            with pipeline_stage("technical_test_lookup"):
+                technical_test = await get_speculative_tests().lookup(profile_data, tenant=candidate_scope(tenant))
+        precomputed = technical_test is not None
+        
         # Generate technical test asynchronously
-        loop = asyncio.get_event_loop()
-        technical_test = await loop.run_in_executor(
-            executor,
-            ai_load_balancer.generate_technical_test,
-            profile_data
-        )
+        if not precomputed:
+            with pipeline_stage("technical_test"):
+                technical_test = await run_in_executor(ai_load_balancer.generate_technical_test, profile_data)
         
         return JSONResponse(content={
             "technical_test_markdown": technical_test,
-            "profile_summary": {
-                "profession": profile_data.get("profession"),
-                "technologies": profile_data.get("technologies"),
-                "experience": profile_data.get("experience", "Not specified")
-            }
+            "precomputed": precomputed,
+            "profile_summary": profile_summary(profile_data)
         })
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+_batch_runner: Optional[TechnicalTestBatchRunner] = None
+
+
+def get_batch_runner() -> TechnicalTestBatchRunner:
+    """Shared batch runner (and its executor)"""
+    global _batch_runner
+    if _batch_runner is None:
+        lookup = get_speculative_tests().lookup if Config.SPECULATIVE_TESTS_ENABLED else None
+        _batch_runner = TechnicalTestBatchRunner(ai_load_balancer, lookup=lookup, ai_queue=ai_queue)
+    return _batch_runner
+
+
+@app.post("/generate-technical-test/batch")
+async def generate_technical_test_batch(profiles: list = Body(...), tenant: Tenant = Depends(admit_request)):
+    """
+    Generate technical tests for a list of profiles, streamed as NDJSON
+    
+    Each line is one item's result as soon as it completes, with its "index"
+    in the request and either "technical_test_markdown" or "error"; the last
+    line is a "summary". Identical profiles are generated once.
+    """
+    if not profiles:
+        raise HTTPException(status_code=400, detail="No profiles given")
+    if len(profiles) > Config.TECHNICAL_TEST_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {Config.TECHNICAL_TEST_BATCH_MAX_ITEMS} profiles per batch"
+        )
+    
+    async def lines():
+        async for item in get_batch_runner().run(profiles, tenant=candidate_scope(tenant)):
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+    
+    # GZipMiddleware would hold lines back in its compressor until the buffer fills
+    return StreamingResponse(
+        lines(), media_type="application/x-ndjson", headers={"Content-Encoding": "identity"}
+    )
+
+
+# Admin-only profiling surface, registered only when PROFILING_ENABLED=true
+admin_router = APIRouter(prefix="/admin")
+
+PROFILED_PATHS = {"/upload-video", "/generate-technical-test"}
+
+
+def _is_admin(api_key: Optional[str]) -> bool:
+    return bool(Config.ADMIN_API_KEY and api_key and hmac.compare_digest(api_key, Config.ADMIN_API_KEY))
+
+
+def require_admin(x_admin_key: Optional[str] = Header(None)):
+    """Reject requests without a valid X-Admin-Key header"""
+    if not _is_admin(x_admin_key):
+        raise HTTPException(status_code=403, detail="Admin access required")
+
+
+async def profile_request(request: Request, call_next):
+    """Profile a single request when an admin sends X-Profile: 1"""
+    if (
+        request.url.path not in PROFILED_PATHS
+        or request.headers.get("X-Profile") != "1"
+        or not _is_admin(request.headers.get("X-Admin-Key"))
+    ):
+        return await call_next(request)
+    
+    from utils.profiling import SamplingProfiler, profile_store
+    profiler = SamplingProfiler(
+        interval=Config.PROFILING_INTERVAL_MS / 1000,
+        name=f"{request.method} {request.url.path}"
+    )
+    profile_store.add(profiler)
+    profiler.start(seconds=Config.PROFILING_MAX_SECONDS)
+    try:
+        response = await call_next(request)
+    finally:
+        profiler.stop()
+    
+    response.headers["X-Profile-Id"] = profiler.id
+    return response
+
+
+@admin_router.get("/profiles", dependencies=[Depends(require_admin)])
+async def list_profiles():
+    """List recent profiles (live sessions and per-request)"""
+    from utils.profiling import profile_store
+    return {"profiles": profile_store.list()}
+
+
+@admin_router.post("/profiles/start", dependencies=[Depends(require_admin)])
+async def start_profiling(seconds: float = 30, interval_ms: Optional[float] = None):
+    """Start sampling all threads of this worker for N seconds"""
+    from utils.profiling import profile_store
+    
+    if seconds <= 0 or seconds > Config.PROFILING_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be between 0 and {Config.PROFILING_MAX_SECONDS}")
+    
+    interval = (interval_ms or Config.PROFILING_INTERVAL_MS) / 1000
+    try:
+        profiler = profile_store.start_session(seconds, interval)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    return profiler.summary()
+
+
+@admin_router.post("/profiles/stop", dependencies=[Depends(require_admin)])
+async def stop_profiling():
+    """Stop the running live session early"""
+    from utils.profiling import profile_store
+    
+    loop = asyncio.get_running_loop()
+    profiler = await loop.run_in_executor(None, profile_store.stop_session)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="No profiling session is running")
+    return profiler.summary()
+
+
+@admin_router.get("/profiles/{profile_id}", dependencies=[Depends(require_admin)])
+async def download_profile(profile_id: str, format: str = "speedscope"):
+    """Download a profile as speedscope JSON or collapsed stacks"""
+    from utils.profiling import profile_store
+    
+    profiler = profile_store.get(profile_id)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found")
+    
+    if format == "collapsed":
+        return PlainTextResponse(
+            profiler.to_collapsed(),
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed.txt"'}
+        )
+    if format == "speedscope":
+        return JSONResponse(
+            profiler.to_speedscope(),
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.speedscope.json"'}
+        )
+    raise HTTPException(status_code=400, detail="format must be 'speedscope' or 'collapsed'")
+
+
+@admin_router.post("/tracemalloc/start", dependencies=[Depends(require_admin)])
+async def start_tracemalloc(frames: int = 10):
+    """Start tracing Python allocations (adds overhead until stopped)"""
+    from utils.profiling import memory_tracker
+    memory_tracker.start(frames)
+    return {"tracing": True, "frames": frames}
+
+
+@admin_router.get("/tracemalloc/snapshot", dependencies=[Depends(require_admin)])
+async def tracemalloc_snapshot(limit: int = 25, group_by: str = "lineno", compare: bool = True):
+    """Top allocation sites and growth since the previous snapshot"""
+    from utils.profiling import memory_tracker
+    
+    if group_by not in ("lineno", "filename", "traceback"):
+        raise HTTPException(status_code=400, detail="group_by must be 'lineno', 'filename' or 'traceback'")
+    
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(None, memory_tracker.snapshot, limit, group_by, compare)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@admin_router.post("/tracemalloc/stop", dependencies=[Depends(require_admin)])
+async def stop_tracemalloc():
+    """Stop tracing allocations"""
+    from utils.profiling import memory_tracker
+    memory_tracker.stop()
+    return {"tracing": False}
+
+
+if Config.PROFILING_ENABLED:
+    app.middleware("http")(profile_request)
+    app.include_router(admin_router)
+    logger.info("Profiling endpoints enabled under /admin")
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host=Config.HOST, port=Config.PORT)
@@ -0,0 +1,491 @@
+"""
+Micro-benchmarks for the hot paths that run on every request
+
+Runs fully offline: MongoDB is disabled (prompts come from code), clips are
+generated locally with FFmpeg and AI providers are replaced by in-process
+stubs so only our own routing code is measured. The startup group launches
+the API with uvicorn and times the first successful /health.
+
+Usage:
+    python scripts/benchmark.py run [--output FILE] [--quick]
+    python scripts/benchmark.py run --save-baseline
+    python scripts/benchmark.py compare [BASELINE] [CURRENT] [--threshold 0.15]
+"""
+import os
+import sys
+sys.path.append('.')
+
+# Must be set before config is imported
+os.environ["MONGODB_ENABLED"] = "false"
+# The log listener thread writes to the real stdout, past redirect_stdout, so records would be timed too
+os.environ["LOG_LEVEL"] = "CRITICAL"
+
+import argparse
+import contextlib
+import json
+import platform
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import tempfile
+import time
+import urllib.request
+from datetime import datetime, timezone
+
+BASELINE_PATH = os.path.join("benchmarks", "baseline.json")
+RESULTS_DIR = os.path.join("benchmarks", "results")
+DEFAULT_THRESHOLD = 0.15
+
+CLIP_DURATIONS = [10, 60, 300]  # seconds
+QUICK_CLIP_DURATIONS = [5, 20]
+CLIP_CODECS = {
+    "aac": "aac",
+    "mp3": "libmp3lame",
+    "opus": "libopus",
+}
+TRANSCRIPTION_WORDS = [1_000, 10_000, 50_000]
+
+
+def measure(func, repeat: int, setup=None, teardown=None) -> dict:
+    """
+    Time func() repeat times and summarize the per-call durations
+
+    Args:
+        func: Zero-argument callable to time
+        repeat: Number of timed calls
+        setup: Optional callable run before each call (not timed)
+        teardown: Optional callable run after each call (not timed)
+
+    Returns:
+        Dictionary with min/median/mean/p95/stdev in seconds
+    """
+    samples = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            if setup:
+                setup()
+            start = time.perf_counter()
+            func()
+            samples.append(time.perf_counter() - start)
+            if teardown:
+                teardown()
+
+    return summarize(samples)
+
+
+def summarize(samples: list) -> dict:
+    """min/median/mean/p95/stdev in seconds of a list of durations"""
+    samples = sorted(samples)
+    return {
+        "runs": len(samples),
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": samples[min(len(samples) - 1, int(round(0.95 * (len(samples) - 1))))],
+        "stdev": statistics.stdev(samples) if len(samples) > 1 else 0.0,
+    }
+
+
+# ---------------------------------------------------------------------------
+# VideoProcessor._extract_audio
+# ---------------------------------------------------------------------------
+
+def _generate_clip(ffmpeg_path: str, directory: str, duration: int, codec_name: str, encoder: str) -> str:
+    """Generate a small synthetic video clip with a sine-wave audio track"""
+    path = os.path.join(directory, f"clip_{duration}s_{codec_name}.mp4")
+    subprocess.run([
+        ffmpeg_path, "-y", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc=size=320x240:rate=15:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate=48000:duration={duration}",
+        "-c:v", "libx264", "-preset", "ultrafast",
+        "-c:a", encoder, "-b:a", "96k",
+        "-shortest", path
+    ], check=True, capture_output=True)
+    return path
+
+
+def bench_extract_audio(results: dict, quick: bool):
+    from services.video_processor import VideoProcessor
+
+    processor = VideoProcessor()
+    durations = QUICK_CLIP_DURATIONS if quick else CLIP_DURATIONS
+    repeat = 3 if quick else 5
+    workdir = tempfile.mkdtemp(prefix="bench_clips_")
+
+    try:
+        for codec_name, encoder in CLIP_CODECS.items():
+            for duration in durations:
+                try:
+                    clip = _generate_clip(processor.ffmpeg_path, workdir, duration, codec_name, encoder)
+                except subprocess.CalledProcessError:
+                    print(f"  skip extract_audio[{codec_name}]: encoder '{encoder}' not available")
+                    break
+
+                audio_path = clip.replace('.mp4', '.wav')
+
+                def remove_audio():
+                    if os.path.exists(audio_path):
+                        os.unlink(audio_path)
+
+                name = f"extract_audio[{codec_name},{duration}s]"
+                results[name] = measure(
+                    lambda: processor._extract_audio(clip),
+                    repeat=repeat,
+                    setup=remove_audio,
+                    teardown=remove_audio
+                )
+                _print_result(name, results[name])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+# ---------------------------------------------------------------------------
+# GroqService._parse_json_response
+# ---------------------------------------------------------------------------
+
+_PROFILE = {
+    "name": "María Fernanda López",
+    "profession": "Ingeniera de Software Backend",
+    "experience": "6 años desarrollando APIs y microservicios en el sector financiero",
+    "education": "Ingeniería de Sistemas, Universidad Nacional",
+    "technologies": "Python, FastAPI, PostgreSQL, Docker, Kubernetes, AWS",
+    "languages": "Español, Inglés",
+    "achievements": "Lideró la migración de un monolito a microservicios",
+    "soft_skills": "Liderazgo, comunicación, trabajo en equipo",
+}
+
+
+def _json_corpus() -> dict:
+    """Clean and malformed provider outputs seen in practice"""
+    clean = json.dumps(_PROFILE, ensure_ascii=False)
+    pretty = json.dumps(_PROFILE, ensure_ascii=False, indent=2)
+    return {
+        "clean": clean,
+        "pretty": pretty,
+        "fenced": f"```json\n{pretty}\n```",
+        "prose_wrapped": f"Aquí está el perfil extraído:\n{pretty}\nEspero que sea útil.",
+        "trailing_comma": pretty[:-2] + ",\n}",
+        "invalid": "Lo siento, no puedo extraer información de este texto.",
+    }
+
+
+def bench_parse_json(results: dict, quick: bool):
+    from services.ai_service import GroqService
+
+    repeat = 200 if quick else 2000
+    for label, payload in _json_corpus().items():
+        def parse(payload=payload):
+            try:
+                GroqService._parse_json_response(payload)
+            except ValueError:
+                pass
+
+        name = f"parse_json_response[{label}]"
+        results[name] = measure(parse, repeat=repeat)
+        _print_result(name, results[name])
+
+
+# ---------------------------------------------------------------------------
+# PromptRepository.get_prompt_with_variables
+# ---------------------------------------------------------------------------
+
+_SENTENCES = [
+    "Hola, mi nombre es María y soy ingeniera de software.",
+    "Trabajo desde hace seis años con Python y FastAPI en el sector financiero.",
+    "Eh, bueno, también he usado Docker y Kubernetes en producción.",
+    "Estudié ingeniería de sistemas en la Universidad Nacional.",
+    "Me gusta trabajar en equipo y liderar proyectos de migración.",
+    "Hablo español e inglés con fluidez.",
+    "O sea, lo que más disfruto es diseñar arquitecturas escalables.",
+]
+
+
+def _synthetic_transcription(words: int, seed: int = 42) -> str:
+    rng = random.Random(seed)
+    parts, count = [], 0
+    while count < words:
+        sentence = rng.choice(_SENTENCES)
+        parts.append(sentence)
+        count += len(sentence.split())
+    return " ".join(parts)
+
+
+def bench_prompt_rendering(results: dict, quick: bool):
+    from database import PromptRepository
+
+    repo = PromptRepository()
+    repeat = 50 if quick else 300
+    profile_json = json.dumps(_PROFILE, ensure_ascii=False)
+
+    for words in TRANSCRIPTION_WORDS:
+        text = _synthetic_transcription(words)
+
+        name = f"prompt_profile_extraction[{words}w]"
+        results[name] = measure(
+            lambda: repo.get_prompt_with_variables("profile_extraction", text=text),
+            repeat=repeat
+        )
+        _print_result(name, results[name])
+
+        name = f"prompt_cv_generation[{words}w]"
+        results[name] = measure(
+            lambda: repo.get_prompt_with_variables(
+                "cv_generation", transcription=text, profile_data=profile_json
+            ),
+            repeat=repeat
+        )
+        _print_result(name, results[name])
+
+
+# ---------------------------------------------------------------------------
+# AILoadBalancer routing overhead
+# ---------------------------------------------------------------------------
+
+def _stub_service_class():
+    from services.ai_service import AIService
+
+    class StubService(AIService):
+        """In-process provider that answers instantly (no network, no prompts)"""
+
+        def __init__(self, fail_with: str = None):
+            # Skip AIService.__init__: routing does not need the prompt repository
+            self.fail_with = fail_with
+
+        def _maybe_fail(self):
+            if self.fail_with:
+                raise Exception(self.fail_with)
+
+        def transcribe_audio(self, audio_path: str) -> str:
+            self._maybe_fail()
+            return "transcription"
+
+        def extract_profile(self, text: str, model: str = None) -> dict:
+            self._maybe_fail()
+            return dict(_PROFILE)
+
+        def generate_cv_profile(self, transcription: str, profile_data: dict, model: str = None) -> str:
+            self._maybe_fail()
+            return "cv"
+
+        def generate_technical_test(self, profile_data: dict, model: str = None) -> str:
+            self._maybe_fail()
+            return "# test"
+
+    return StubService
+
+
+def bench_load_balancer(results: dict, quick: bool):
+    from services.load_balancer import AILoadBalancer
+
+    StubService = _stub_service_class()
+    repeat = 500 if quick else 5000
+
+    direct = StubService()
+    healthy = AILoadBalancer({'groq': direct, 'gemini': StubService()})
+    degraded = AILoadBalancer({
+        'groq': StubService(fail_with="Error code: 429 - rate limit reached"),
+        'gemini': StubService()
+    })
+
+    cases = {
+        "routing[direct_call]": lambda: direct.extract_profile("text"),
+        "routing[extract_profile]": lambda: healthy.extract_profile("text"),
+        "routing[transcribe_audio]": lambda: healthy.transcribe_audio("audio.wav"),
+        "routing[extract_profile_fallback]": lambda: degraded.extract_profile("text"),
+    }
+    for name, func in cases.items():
+        results[name] = measure(func, repeat=repeat)
+        _print_result(name, results[name])
+
+
+# ---------------------------------------------------------------------------
+# API cold start: process start to first successful /health
+# ---------------------------------------------------------------------------
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _time_to_health(timeout: float = 60) -> float:
+    """Start the API in a fresh interpreter and poll /health until it answers 200"""
+    port = _free_port()
+    env = {
+        **os.environ,
+        # Validation needs a key; clients are created lazily, so no provider is contacted
+        "GROQ_API_KEY": os.environ.get("GROQ_API_KEY") or "benchmark",
+        "WARMUP_ENABLED": "false",
+    }
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+         "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"API exited with status {process.returncode} before answering /health")
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        raise RuntimeError(f"API did not answer /health within {timeout:.0f}s")
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def bench_startup(results: dict, quick: bool):
+    repeat = 3 if quick else 7
+    try:
+        samples = [_time_to_health() for _ in range(repeat)]
+    except RuntimeError as e:
+        print(f"  skip startup: {e}")
+        return
+    name = "startup[time_to_first_health]"
+    results[name] = summarize(samples)
+    _print_result(name, results[name])
+
+
+# ---------------------------------------------------------------------------
+# Runner and comparison
+# ---------------------------------------------------------------------------
+
+BENCHMARKS = {
+    "extract_audio": bench_extract_audio,
+    "parse_json": bench_parse_json,
+    "prompt_rendering": bench_prompt_rendering,
+    "load_balancer": bench_load_balancer,
+    "startup": bench_startup,
+}
+
+
+def _print_result(name: str, stats: dict):
+    print(f"  {name:<45} median {stats['median'] * 1000:10.4f} ms   p95 {stats['p95'] * 1000:10.4f} ms")
+
+
+def _environment() -> dict:
+    from services.video_processor import VideoProcessor
+
+    ffmpeg_version = None
+    try:
+        output = subprocess.run(
+            [VideoProcessor().ffmpeg_path, "-version"], capture_output=True, text=True
+        ).stdout
+        ffmpeg_version = output.splitlines()[0] if output else None
+    except Exception:
+        pass
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version,
+    }
+
+
+def run(args) -> int:
+    selected = args.only or list(BENCHMARKS)
+    results = {}
+
+    for group in selected:
+        print(f"[{group}]")
+        BENCHMARKS[group](results, args.quick)
+
+    report = {"meta": _environment(), "quick": args.quick, "benchmarks": results}
+
+    output = args.output
+    if args.save_baseline:
+        output = BASELINE_PATH
+    elif not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {output}")
+    return 0
+
+
+def _latest_result() -> str:
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith(".json"))
+    return os.path.join(RESULTS_DIR, files[-1]) if files else None
+
+
+def compare(args) -> int:
+    current_path = args.current or _latest_result()
+    if not current_path:
+        print("No results to compare. Run: python scripts/benchmark.py run")
+        return 2
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["benchmarks"]
+    with open(current_path, encoding="utf-8") as f:
+        current = json.load(f)["benchmarks"]
+
+    print(f"Baseline: {args.baseline}")
+    print(f"Current:  {current_path}")
+    print(f"Threshold: +{args.threshold:.0%} on median\n")
+
+    regressions = []
+    for name in sorted(set(baseline) & set(current)):
+        before = baseline[name]["median"]
+        after = current[name]["median"]
+        change = (after - before) / before if before else 0.0
+
+        status = "ok"
+        if change > args.threshold:
+            status = "REGRESSION"
+            regressions.append(name)
+        elif change < -args.threshold:
+            status = "improved"
+
+        print(f"  {name:<45} {before * 1000:10.4f} -> {after * 1000:10.4f} ms  {change:+7.1%}  {status}")
+
+    for name in sorted(set(baseline) - set(current)):
+        print(f"  {name:<45} missing from current run")
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        return 1
+
+    print("\nNo regressions")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Hot path micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks and store JSON results")
+    run_parser.add_argument("--output", help="Result file (default: benchmarks/results/<timestamp>.json)")
+    run_parser.add_argument("--save-baseline", action="store_true", help=f"Write results to {BASELINE_PATH}")
+    run_parser.add_argument("--quick", action="store_true", help="Shorter clips and fewer repetitions")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Run only these groups")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare results against a baseline")
+    compare_parser.add_argument("baseline", nargs="?", default=BASELINE_PATH)
+    compare_parser.add_argument("current", nargs="?", help="Result file (default: latest in benchmarks/results)")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                                help="Allowed median slowdown before flagging (0.15 = 15%%)")
+
+    args = parser.parse_args()
+    sys.exit(run(args) if args.command == "run" else compare(args))
+
+
+if __name__ == "__main__":
+    main()
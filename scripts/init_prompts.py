@@ -4,12 +4,21 @@ Script to initialize or reset prompts in MongoDB
 import sys
 sys.path.append('.')
 
+from config import Config
 from database import PromptRepository
 
 def main():
     print("Initializing prompts in MongoDB...")
     repo = PromptRepository()
     
+    # The connection is established in the background; give it a few attempts
+    if not repo.db_client.wait_until_connected(Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS / 1000 * 3):
+        print("ERROR: Cannot connect to MongoDB")
+        sys.exit(1)
+    if not repo.initialize():
+        print("ERROR: Initialization failed")
+        sys.exit(1)
+    
     print("\nAvailable prompts:")
     for prompt_name in repo.list_prompts():
         print(f"  - {prompt_name}")
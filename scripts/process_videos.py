@@ -0,0 +1,273 @@
+"""
+Offline bulk processing of presentation videos, without the HTTP API
+
+Converts videos with FFmpeg in a process pool, runs transcription, profile
+extraction and CV generation through the same load balancer as the API
+(several videos in flight), and writes one result per video to an NDJSON
+file or to the candidates collection. Every finished video is appended to
+a checkpoint file, so an interrupted run resumes where it stopped when the
+same command is run again.
+
+Usage:
+    python scripts/process_videos.py DIRECTORY --output results.ndjson
+    python scripts/process_videos.py --manifest videos.txt --mongodb
+    python scripts/process_videos.py DIRECTORY --output results.ndjson --retry-failed
+"""
+import os
+import sys
+sys.path.append('.')
+
+import argparse
+import asyncio
+import contextvars
+import functools
+import json
+import multiprocessing
+import signal
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from services.video_batch import VIDEO_EXTENSIONS
+from services.video_processor import VideoProcessor
+
+# One VideoProcessor per FFmpeg worker process
+_processor: Optional[VideoProcessor] = None
+
+
+def _init_worker():
+    global _processor
+    # Ctrl-C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _processor = VideoProcessor()
+
+
+def _extract(path: str):
+    """FFmpeg worker: (audio_path, audio_seconds) of a video"""
+    return _processor.extract_audio(path)
+
+
+def find_videos(directory: str) -> List[str]:
+    paths = []
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(VIDEO_EXTENSIONS) and not name.startswith("."):
+                paths.append(os.path.abspath(os.path.join(root, name)))
+    return paths
+
+
+def read_manifest(manifest: str) -> List[str]:
+    """Paths from a manifest: one per line, or NDJSON objects with a "path"; relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(manifest))
+    paths = []
+    with open(manifest, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            path = json.loads(line)["path"] if line.startswith("{") else line
+            paths.append(os.path.abspath(os.path.join(base, path)))
+    return paths
+
+
+def read_checkpoint(checkpoint: str, retry_failed: bool) -> set:
+    """Paths already finished by previous runs"""
+    done = set()
+    if not os.path.exists(checkpoint):
+        return done
+    with open(checkpoint, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue  # Last line of a run killed mid-write
+            if entry.get("status") == "ok" or not retry_failed:
+                done.add(entry["path"])
+            else:
+                done.discard(entry["path"])
+    return done
+
+
+class Progress:
+    """Counts and rates of this run, printed as one line to stderr"""
+
+    def __init__(self, total: int, skipped: int):
+        self.total = total
+        self.skipped = skipped
+        self.ok = 0
+        self.failed = 0
+        self.audio_seconds = 0.0
+        self.start = time.perf_counter()
+
+    def line(self) -> str:
+        elapsed = time.perf_counter() - self.start
+        processed = self.ok + self.failed
+        videos_per_minute = processed * 60 / elapsed if elapsed else 0.0
+        # Audio-hours per hour is the same ratio as audio seconds per second
+        audio_hours_per_hour = self.audio_seconds / elapsed if elapsed else 0.0
+        remaining = self.total - self.skipped - processed
+        eta = f"{remaining / videos_per_minute:.0f} min" if videos_per_minute else "-"
+        return (
+            f"[{processed + self.skipped}/{self.total}] ok={self.ok} failed={self.failed} skipped={self.skipped} | "
+            f"{videos_per_minute:.1f} videos/min | {audio_hours_per_hour:.2f} audio-h/h | "
+            f"elapsed {elapsed / 60:.1f} min | eta {eta}"
+        )
+
+    def summary(self) -> dict:
+        elapsed = time.perf_counter() - self.start
+        return {
+            "videos": self.total,
+            "succeeded": self.ok,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "audio_hours": round(self.audio_seconds / 3600, 3),
+            "elapsed_seconds": round(elapsed, 1),
+            "videos_per_minute": round((self.ok + self.failed) * 60 / elapsed, 2) if elapsed else None,
+            "audio_hours_per_hour": round(self.audio_seconds / elapsed, 2) if elapsed else None,
+        }
+
+
+async def run(args, paths: List[str]):
+    # Imported here so the FFmpeg worker processes do not load provider SDKs
+    from config import Config
+    from database import CandidateRepository, MongoDBClient
+    from services.ai_factory import AIServiceFactory
+    from utils.logger import log_context
+    from utils.memory import MemoryGovernor, estimate_job_bytes
+
+    checkpoint_path = args.checkpoint or f"{args.output or 'process_videos'}.checkpoint"
+    done = read_checkpoint(checkpoint_path, args.retry_failed)
+    pending = [path for path in paths if path not in done]
+    progress = Progress(len(paths), len(paths) - len(pending))
+    print(f"{len(paths)} videos, {progress.skipped} already done (checkpoint {checkpoint_path})", file=sys.stderr)
+    if not pending:
+        return progress.summary()
+
+    repository = None
+    if args.mongodb:
+        if not Config.MONGODB_ENABLED or not MongoDBClient().wait_until_connected(30):
+            raise SystemExit("MongoDB is not reachable (check MONGODB_* settings)")
+        repository = CandidateRepository()
+
+    load_balancer = AIServiceFactory.create_load_balancer()
+    loop = asyncio.get_running_loop()
+    ffmpeg_pool = ProcessPoolExecutor(
+        max_workers=args.ffmpeg_workers, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker
+    )
+    ai_pool = ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix="ai")
+    ai_slots = asyncio.Semaphore(args.concurrency)
+    # Long videos take a larger share of MEMORY_BUDGET_MB, so fewer of them run at once
+    memory_governor = MemoryGovernor(Config.MEMORY_BUDGET_MB * 1024 * 1024)
+    # Converted videos waiting for an AI slot hold scratch disk, so the number in flight is bounded
+    in_flight = asyncio.Semaphore(args.ffmpeg_workers + args.concurrency)
+    output = open(args.output, "a", encoding="utf-8") if args.output else None
+    checkpoint = open(checkpoint_path, "a", encoding="utf-8")
+
+    def call(func, *call_args):
+        """Provider call on the AI threads, keeping the video's log context"""
+        ctx = contextvars.copy_context()
+        return loop.run_in_executor(ai_pool, functools.partial(ctx.run, func, *call_args))
+    
+    async def process(path: str) -> dict:
+        record = {"path": path}
+        audio_path = None
+        try:
+            audio_path, audio_seconds = await loop.run_in_executor(ffmpeg_pool, _extract, path)
+            record["audio_seconds"] = round(audio_seconds, 1)
+            async with memory_governor.reserve(estimate_job_bytes(audio_seconds)), ai_slots:
+                with log_context(request_id=uuid.uuid4().hex, stage="offline"):
+                    transcription = await call(load_balancer.transcribe_audio, audio_path)
+                    profile_data = await call(load_balancer.extract_profile, transcription)
+                    cv_profile = await call(load_balancer.generate_cv_profile, transcription, profile_data)
+            if repository is not None:
+                candidate_id = await repository.save(
+                    transcription, profile_data, cv_profile, tenant=args.tenant,
+                    source_filename=os.path.basename(path), source_path=path
+                )
+                if candidate_id is None:
+                    raise RuntimeError("Could not store candidate")
+                record["candidate_id"] = candidate_id
+            record.update(
+                status="ok", transcription=transcription, profile_data=profile_data, cv_profile=cv_profile
+            )
+            progress.ok += 1
+            progress.audio_seconds += audio_seconds
+        except Exception as e:
+            record.update(status="error", error=str(e))
+            progress.failed += 1
+        finally:
+            if audio_path:
+                VideoProcessor.cleanup(None, audio_path)
+            in_flight.release()
+
+        # The checkpoint is written after the output, so a crash in between only repeats a video
+        if output is not None:
+            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+            output.flush()
+        checkpoint.write(json.dumps({
+            "path": path, "status": record["status"], "finished_at": datetime.now(timezone.utc).isoformat()
+        }) + "\n")
+        checkpoint.flush()
+        return record
+
+    async def report():
+        while True:
+            await asyncio.sleep(args.progress_interval)
+            print(progress.line(), file=sys.stderr)
+
+    reporter = asyncio.ensure_future(report())
+    tasks = []
+    try:
+        for path in pending:
+            await in_flight.acquire()
+            tasks.append(asyncio.ensure_future(process(path)))
+        await asyncio.gather(*tasks)
+    finally:
+        reporter.cancel()
+        for task in tasks:
+            task.cancel()
+        ffmpeg_pool.shutdown(wait=False, cancel_futures=True)
+        ai_pool.shutdown(wait=False, cancel_futures=True)
+        if load_balancer.quota is not None:
+            load_balancer.quota.close()
+        if output is not None:
+            output.close()
+        checkpoint.close()
+        print(progress.line(), file=sys.stderr)
+    return progress.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process presentation videos offline (no HTTP API)")
+    parser.add_argument("directory", nargs="?", help="Directory searched recursively for videos")
+    parser.add_argument("--manifest", help="File with one video path per line (or NDJSON with \"path\")")
+    parser.add_argument("--output", help="Append one NDJSON result per video to this file")
+    parser.add_argument("--mongodb", action="store_true", help="Store results in the candidates collection")
+    parser.add_argument("--tenant", help="Tenant (name in TENANTS) the stored candidates belong to")
+    parser.add_argument("--checkpoint", help="Checkpoint file (default: <output>.checkpoint)")
+    parser.add_argument("--retry-failed", action="store_true", help="Process videos that failed in earlier runs again")
+    parser.add_argument("--ffmpeg-workers", type=int, default=os.cpu_count() or 1, help="FFmpeg processes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Videos in the AI stages at once")
+    parser.add_argument("--progress-interval", type=float, default=10, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    if bool(args.directory) == bool(args.manifest):
+        parser.error("give either a directory or --manifest")
+    if not args.output and not args.mongodb:
+        parser.error("give --output and/or --mongodb")
+
+    paths = read_manifest(args.manifest) if args.manifest else find_videos(args.directory)
+    paths = list(dict.fromkeys(paths))
+    try:
+        summary = asyncio.run(run(args, paths))
+    except KeyboardInterrupt:
+        print("Interrupted; run the same command again to resume", file=sys.stderr)
+        sys.exit(130)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,14 +4,21 @@ Script to view all prompts stored in MongoDB
 import sys
 sys.path.append('.')
 
+from config import Config
 from database import PromptRepository
 
 def main():
+    repo = PromptRepository()
+    
+    # The connection is established in the background; without it only the code defaults would be listed
+    if not repo.db_client.wait_until_connected(Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS / 1000 * 3):
+        print("ERROR: Cannot connect to MongoDB")
+        sys.exit(1)
+    
     print("=" * 80)
     print("PROMPTS STORED IN MONGODB")
     print("=" * 80)
     
-    repo = PromptRepository()
     prompts = repo.list_prompts()
     
     print(f"\nTotal prompts: {len(prompts)}\n")
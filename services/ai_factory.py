@@ -1,7 +1,13 @@
+import importlib.util
 from typing import Optional, Dict
 from config import Config
 from .ai_service import AIService, GroqService, GeminiService, HuggingFaceService, OpenRouterService
+from .coordination import create_coordinator
 from .load_balancer import AILoadBalancer
+from .quota_tracker import QuotaTracker
+from utils.logger import setup_logger
+
+logger = setup_logger("ai_factory")
 
 
 class AIServiceFactory:
@@ -24,7 +30,12 @@ class AIServiceFactory:
         if not services:
             raise RuntimeError("No AI service available. Check your API keys and dependencies.")
         
-        return AILoadBalancer(services)
+        quota_tracker = None
+        if Config.QUOTA_TRACKING_ENABLED:
+            quota_tracker = QuotaTracker()
+            quota_tracker.start()
+        
+        return AILoadBalancer(services, quota_tracker=quota_tracker, coordinator=create_coordinator())
     
     @staticmethod
     def create_all_services() -> Dict[str, AIService]:
@@ -48,21 +59,34 @@ class AIServiceFactory:
         if hf:
             services['huggingface'] = hf
         
+        local = AIServiceFactory._try_create_local_whisper()
+        if local:
+            services['local'] = local
+        
         return services
     
+    @staticmethod
+    def _sdk_installed(service_class) -> bool:
+        """Whether a provider's SDK can be imported, checked without importing it (clients are created on first use)"""
+        try:
+            return importlib.util.find_spec(service_class.sdk_module) is not None
+        except (ImportError, ValueError):
+            return False
+    
     @staticmethod
     def _try_create_groq() -> Optional[AIService]:
         """Try to create Groq service"""
         if not Config.GROQ_API_KEY:
             return None
         
+        if not AIServiceFactory._sdk_installed(GroqService):
+            logger.warning("Groq library not installed. Install with: pip install groq")
+            return None
+        
         try:
             return GroqService()
-        except ImportError:
-            print("Warning: Groq library not installed. Install with: pip install groq")
-            return None
         except Exception as e:
-            print(f"Warning: Failed to initialize Groq service: {e}")
+            logger.warning(f"Failed to initialize Groq service: {e}")
             return None
     
     @staticmethod
@@ -71,13 +95,14 @@ class AIServiceFactory:
         if not Config.GEMINI_API_KEY:
             return None
         
+        if not AIServiceFactory._sdk_installed(GeminiService):
+            logger.warning("Google Generative AI library not installed. Install with: pip install google-generativeai")
+            return None
+        
         try:
             return GeminiService()
-        except ImportError:
-            print("Warning: Google Generative AI library not installed. Install with: pip install google-generativeai")
-            return None
         except Exception as e:
-            print(f"Warning: Failed to initialize Gemini service: {e}")
+            logger.warning(f"Failed to initialize Gemini service: {e}")
             return None
     
     @staticmethod
@@ -86,13 +111,14 @@ class AIServiceFactory:
         if not Config.OPENROUTER_API_KEY:
             return None
         
+        if not AIServiceFactory._sdk_installed(OpenRouterService):
+            logger.warning("OpenAI library not installed. Install with: pip install openai")
+            return None
+        
         try:
             return OpenRouterService()
-        except ImportError:
-            print("Warning: OpenAI library not installed. Install with: pip install openai")
-            return None
         except Exception as e:
-            print(f"Warning: Failed to initialize OpenRouter service: {e}")
+            logger.warning(f"Failed to initialize OpenRouter service: {e}")
             return None
     
     @staticmethod
@@ -101,11 +127,29 @@ class AIServiceFactory:
         if not Config.HUGGINGFACE_API_KEY:
             return None
         
+        if not AIServiceFactory._sdk_installed(HuggingFaceService):
+            logger.warning("Hugging Face Hub library not installed. Install with: pip install huggingface_hub")
+            return None
+        
         try:
             return HuggingFaceService()
-        except ImportError:
-            print("Warning: Hugging Face Hub library not installed. Install with: pip install huggingface_hub")
+        except Exception as e:
+            logger.warning(f"Failed to initialize Hugging Face service: {e}")
+            return None
+    
+    @staticmethod
+    def _try_create_local_whisper() -> Optional[AIService]:
+        """Try to create the local transcription service"""
+        if not Config.LOCAL_TRANSCRIPTION_ENABLED:
+            return None
+        
+        from .local_transcription import LocalWhisperService
+        if not AIServiceFactory._sdk_installed(LocalWhisperService):
+            logger.warning("faster-whisper not installed. Install with: pip install faster-whisper")
             return None
+        
+        try:
+            return LocalWhisperService()
         except Exception as e:
-            print(f"Warning: Failed to initialize Hugging Face service: {e}")
+            logger.warning(f"Failed to initialize local Whisper service: {e}")
             return None
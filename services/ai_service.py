@@ -1,15 +1,52 @@
 import json
+import os
 import re
+import threading
 from abc import ABC, abstractmethod
 from config import Config
 from database import PromptRepository
+from utils.logger import setup_logger
+from utils.tracing import set_span_attributes
+from .gemini_files import GeminiFileCache
+from .prompt_budget import output_budget
+from .quota_tracker import audio_duration
+
+logger = setup_logger("ai_service")
 
 
 class AIService(ABC):
     """Abstract base class for AI services"""
     
+    # Local backends have no quota, so any of their failures may fall back to a remote provider
+    is_local = False
+    # Name used for quota accounting (matches the load balancer's service names)
+    provider_name = None
+    # QuotaTracker assigned by the load balancer, if quota tracking is enabled
+    quota_tracker = None
+    # SDK the provider imports when its client is created; the factory only checks it is installed
+    sdk_module = None
+    
     def __init__(self):
         self.prompt_repo = PromptRepository()
+        self._client = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        """SDK client, created on first use so that starting the API imports no provider SDK"""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._client = self._create_client()
+        return self._client
+    
+    def _create_client(self):
+        """Import the SDK and build the client"""
+        raise NotImplementedError
+    
+    def warm_up(self):
+        """Create the client and open a connection to the provider before the first request needs it"""
+        self.client
     
     @abstractmethod
     def transcribe_audio(self, audio_path: str) -> str:
@@ -30,46 +67,99 @@ class AIService(ABC):
     def generate_technical_test(self, profile_data: dict) -> str:
         """Generate technical test based on profile"""
         pass
+    
+    @staticmethod
+    def _usage_from_response(response) -> dict:
+        """Token counts from an OpenAI-compatible or Gemini response"""
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            return {
+                "prompt_tokens": getattr(usage, "prompt_tokens", None),
+                "completion_tokens": getattr(usage, "completion_tokens", None)
+            }
+        
+        metadata = getattr(response, "usage_metadata", None)
+        if metadata is not None:
+            return {
+                "prompt_tokens": getattr(metadata, "prompt_token_count", None),
+                "completion_tokens": getattr(metadata, "candidates_token_count", None)
+            }
+        return {}
+    
+    def model_for(self, task: str) -> str:
+        """Model that handles a task by default (for quota checks)"""
+        return getattr(self, "model_name", None) or getattr(self, "model", None)
+    
+    def _record_usage(self, model: str, response=None, **attributes):
+        """Attach model and token usage to the active trace span and count it against quotas"""
+        usage = self._usage_from_response(response)
+        set_span_attributes(model=model, **usage, **attributes)
+        if self.quota_tracker is not None and self.provider_name:
+            self.quota_tracker.record(
+                self.provider_name,
+                model,
+                tokens=sum(count for count in usage.values() if count),
+                audio_seconds=attributes.get("audio_seconds", 0.0)
+            )
 
 
 class GroqService(AIService):
     """Groq AI service implementation"""
     
-    def __init__(self):
-        super().__init__()
+    provider_name = "groq"
+    sdk_module = "groq"
+    
+    def _create_client(self):
         from groq import Groq
-        self.client = Groq(api_key=Config.GROQ_API_KEY)
-        print("Groq AI service initialized")
+        client = Groq(api_key=Config.GROQ_API_KEY)
+        logger.info("Groq AI service initialized")
+        return client
+    
+    def warm_up(self):
+        # Listing models costs no tokens and leaves a TLS connection in the client's (shared) pool
+        self.client.with_options(timeout=Config.WARMUP_TIMEOUT, max_retries=0).models.list()
+    
+    def model_for(self, task: str) -> str:
+        return Config.GROQ_TRANSCRIPTION_MODEL if task == "transcription" else Config.GROQ_CHAT_MODEL
     
     def transcribe_audio(self, audio_path: str) -> str:
         """Transcribe audio using Groq Whisper"""
         try:
+            # The open file is streamed into the multipart body instead of being read into memory
             with open(audio_path, "rb") as file:
                 transcription = self.client.audio.transcriptions.create(
-                    file=(audio_path, file.read()),
+                    file=(os.path.basename(audio_path), file),
                     model=Config.GROQ_TRANSCRIPTION_MODEL,
                     prompt="Transcribe this audio in Spanish. It's a personal or professional presentation.",
                     response_format="text",
                     language="es"
                 )
+            # The text response carries no usage, so the audio itself is what gets recorded
+            self._record_usage(
+                Config.GROQ_TRANSCRIPTION_MODEL,
+                audio_bytes=os.path.getsize(audio_path),
+                audio_seconds=audio_duration(audio_path)
+            )
             return transcription.strip() if transcription else "Unable to transcribe audio."
         except Exception as e:
             raise Exception(f"Groq transcription error: {str(e)}")
     
-    def extract_profile(self, text: str) -> dict:
-        """Extract profile information using Groq"""
+    def extract_profile(self, text: str, model: str = None) -> dict:
+        """Extract profile information using Groq (GROQ_CHAT_MODEL unless another model is given)"""
+        model = model or Config.GROQ_CHAT_MODEL
         prompt = self.prompt_repo.get_prompt_with_variables("profile_extraction", text=text)
+        max_tokens = output_budget("profile_extraction", prompt, 1200, text, provider=self.provider_name, model=model)
         
         try:
             try:
                 response = self.client.chat.completions.create(
-                    model=Config.GROQ_CHAT_MODEL,
+                    model=model,
                     messages=[
                         {"role": "system", "content": "You are an assistant that extracts professional profile information from transcribed texts. You MUST respond in SPANISH. You MUST respond with ONLY valid JSON. Do NOT use markdown code blocks. Do NOT add any text before or after the JSON. Start your response with { and end with }. Your entire response must be parseable JSON. ALL field values must be in SPANISH."},
                         {"role": "user", "content": prompt}
                     ],
                     temperature=0.1,
-                    max_tokens=1200,
+                    max_tokens=max_tokens,
                     top_p=0.9,
                     stream=False,
                     response_format={"type": "json_object"}
@@ -78,54 +168,56 @@ class GroqService(AIService):
                 # Fallback without response_format if not supported
                 if "response_format" in str(e).lower() or "not supported" in str(e).lower():
                     response = self.client.chat.completions.create(
-                        model=Config.GROQ_CHAT_MODEL,
+                        model=model,
                         messages=[
                             {"role": "system", "content": "You are an assistant that extracts professional profile information from transcribed texts. You MUST respond in SPANISH. You MUST respond with ONLY valid JSON. Do NOT use markdown code blocks. Do NOT add any text before or after the JSON. Start your response with { and end with }. Your entire response must be parseable JSON. ALL field values must be in SPANISH."},
                             {"role": "user", "content": prompt}
                         ],
                         temperature=0.1,
-                        max_tokens=1200,
+                        max_tokens=max_tokens,
                         top_p=0.9,
                         stream=False
                     )
                 else:
                     raise
             
+            self._record_usage(model, response)
             response_text = response.choices[0].message.content.strip()
-            print(f"[Groq] Raw response (first 200 chars): {response_text[:200]}")
-            parsed = self._parse_json_response(response_text)
-            print(f"[Groq] Successfully parsed JSON with keys: {list(parsed.keys())}")
-            return parsed
+            logger.debug("Groq raw profile response", extra={"payload": response_text})
+            return self._parse_json_response(response_text)
         except Exception as e:
-            print(f"[Groq] Profile extraction failed: {str(e)}")
             raise Exception(f"Groq profile extraction error: {str(e)}")
     
-    def generate_cv_profile(self, transcription: str, profile_data: dict) -> str:
-        """Generate CV profile using Groq"""
+    def generate_cv_profile(self, transcription: str, profile_data: dict, model: str = None) -> str:
+        """Generate CV profile using Groq (GROQ_CHAT_MODEL unless another model is given)"""
+        model = model or Config.GROQ_CHAT_MODEL
         prompt = self.prompt_repo.get_prompt_with_variables(
             "cv_generation",
             transcription=transcription,
             profile_data=json.dumps(profile_data, ensure_ascii=False)
         )
+        max_tokens = output_budget("cv_generation", prompt, 1800, transcription, provider=self.provider_name, model=model)
         
         try:
             response = self.client.chat.completions.create(
-                model=Config.GROQ_CHAT_MODEL,
+                model=model,
                 messages=[
                     {"role": "system", "content": "You are an assistant specialized in creating professional CV profiles. Generate persuasive and professional texts in Spanish."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=1800,
+                max_tokens=max_tokens,
                 top_p=0.95,
                 stream=False
             )
+            self._record_usage(model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"Groq CV generation error: {str(e)}")
     
-    def generate_technical_test(self, profile_data: dict) -> str:
-        """Generate technical test using Groq"""
+    def generate_technical_test(self, profile_data: dict, model: str = None) -> str:
+        """Generate technical test using Groq (GROQ_CHAT_MODEL unless another model is given)"""
+        model = model or Config.GROQ_CHAT_MODEL
         prompt = self.prompt_repo.get_prompt_with_variables(
             "technical_test_generation",
             profession=profile_data.get("profession", ""),
@@ -133,19 +225,21 @@ class GroqService(AIService):
             experience=profile_data.get("experience", ""),
             education=profile_data.get("education", "")
         )
+        max_tokens = output_budget("technical_test", prompt, 4000, provider=self.provider_name, model=model)
         
         try:
             response = self.client.chat.completions.create(
-                model=Config.GROQ_CHAT_MODEL,
+                model=model,
                 messages=[
                     {"role": "system", "content": "You are an expert in creating technical assessments for job candidates. Generate comprehensive and fair technical tests in Spanish, formatted in Markdown."},
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.4,
-                max_tokens=4000,
+                max_tokens=max_tokens,
                 top_p=0.95,
                 stream=False
             )
+            self._record_usage(model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"Groq technical test generation error: {str(e)}")
@@ -162,8 +256,7 @@ class GroqService(AIService):
         try:
             return json.loads(response_text)
         except json.JSONDecodeError as e:
-            print(f"[JSON Parser] Direct parse failed: {str(e)}")
-            print(f"[JSON Parser] Response text (first 300 chars): {response_text[:300]}")
+            logger.debug(f"Direct JSON parse failed: {str(e)}", extra={"payload": response_text})
         
         # Try to find JSON object in the response (greedy match)
         json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
@@ -172,8 +265,7 @@ class GroqService(AIService):
             try:
                 return json.loads(json_str)
             except json.JSONDecodeError as e:
-                print(f"[JSON Parser] Regex match parse failed: {str(e)}")
-                print(f"[JSON Parser] Matched JSON (first 300 chars): {json_str[:300]}")
+                logger.debug(f"Extracted JSON parse failed: {str(e)}", extra={"payload": json_str})
                 
                 # Try to fix common issues
                 # Remove trailing commas before closing braces
@@ -189,28 +281,65 @@ class GroqService(AIService):
 class GeminiService(AIService):
     """Gemini AI service implementation"""
     
+    provider_name = "gemini"
+    sdk_module = "google.generativeai"
+    
     def __init__(self):
         super().__init__()
+        self.model_name = Config.GEMINI_MODEL
+        self.genai = None
+        self.files = None
+    
+    def _create_client(self):
+        """The GenerativeModel (google.generativeai has no client object)"""
         import google.generativeai as genai
         genai.configure(api_key=Config.GEMINI_API_KEY)
         
         try:
-            self.model = genai.GenerativeModel(Config.GEMINI_MODEL)
-            print(f"Gemini AI service initialized with {Config.GEMINI_MODEL}")
+            model = genai.GenerativeModel(Config.GEMINI_MODEL)
+            self.model_name = Config.GEMINI_MODEL
+            logger.info(f"Gemini AI service initialized with {Config.GEMINI_MODEL}")
         except Exception:
-            self.model = genai.GenerativeModel(Config.GEMINI_FALLBACK_MODEL)
-            print(f"Gemini AI service initialized with {Config.GEMINI_FALLBACK_MODEL}")
+            model = genai.GenerativeModel(Config.GEMINI_FALLBACK_MODEL)
+            self.model_name = Config.GEMINI_FALLBACK_MODEL
+            logger.info(f"Gemini AI service initialized with {Config.GEMINI_FALLBACK_MODEL}")
         
         self.genai = genai
+        self.files = GeminiFileCache(genai)
+        return model
+    
+    @property
+    def model(self):
+        return self.client
+    
+    def warm_up(self):
+        self.client
+        from google.api_core.retry import Retry
+        # Without a retry deadline the SDK keeps retrying while the API is unreachable
+        self.genai.get_model(
+            f"models/{self.model_name}",
+            request_options={"timeout": Config.WARMUP_TIMEOUT, "retry": Retry(timeout=Config.WARMUP_TIMEOUT)}
+        )
+    
+    def _audio_part(self, audio_path: str):
+        """Inline audio bytes when small enough, otherwise a (reused) uploaded file"""
+        self.client  # Configures the SDK and the file cache
+        size = os.path.getsize(audio_path)
+        set_span_attributes(audio_bytes=size)
+        if size <= Config.GEMINI_INLINE_AUDIO_MAX_BYTES:
+            set_span_attributes(gemini_audio="inline")
+            with open(audio_path, "rb") as f:
+                return {"mime_type": "audio/wav", "data": f.read()}
+        return self.files.get(audio_path, mime_type="audio/wav")
     
     def transcribe_audio(self, audio_path: str) -> str:
         """Transcribe audio using Gemini"""
         try:
-            audio_file = self.genai.upload_file(audio_path)
             response = self.model.generate_content([
                 "Transcribe this audio in Spanish. Provide only the speech transcription, without additional comments or special formatting.",
-                audio_file
+                self._audio_part(audio_path)
             ])
+            self._record_usage(self.model_name, response, audio_seconds=audio_duration(audio_path))
             return response.text.strip() if response.text else "Unable to transcribe audio."
         except Exception as e:
             raise Exception(f"Gemini transcription error: {str(e)}")
@@ -218,9 +347,11 @@ class GeminiService(AIService):
     def extract_profile(self, text: str) -> dict:
         """Extract profile information using Gemini"""
         prompt = self.prompt_repo.get_prompt_with_variables("profile_extraction", text=text)
+        max_tokens = output_budget("profile_extraction", prompt, 1200, text, provider=self.provider_name, model=self.model_name)
         
         try:
-            response = self.model.generate_content(prompt)
+            response = self.model.generate_content(prompt, generation_config={"max_output_tokens": max_tokens})
+            self._record_usage(self.model_name, response)
             response_text = response.text.strip()
             return GroqService._parse_json_response(response_text)
         except Exception as e:
@@ -233,9 +364,11 @@ class GeminiService(AIService):
             transcription=transcription,
             profile_data=json.dumps(profile_data, ensure_ascii=False)
         )
+        max_tokens = output_budget("cv_generation", prompt, 1800, transcription, provider=self.provider_name, model=self.model_name)
         
         try:
-            response = self.model.generate_content(prompt)
+            response = self.model.generate_content(prompt, generation_config={"max_output_tokens": max_tokens})
+            self._record_usage(self.model_name, response)
             return response.text.strip()
         except Exception as e:
             raise Exception(f"Gemini CV generation error: {str(e)}")
@@ -249,9 +382,11 @@ class GeminiService(AIService):
             experience=profile_data.get("experience", ""),
             education=profile_data.get("education", "")
         )
+        max_tokens = output_budget("technical_test", prompt, 4000, provider=self.provider_name, model=self.model_name)
         
         try:
-            response = self.model.generate_content(prompt)
+            response = self.model.generate_content(prompt, generation_config={"max_output_tokens": max_tokens})
+            self._record_usage(self.model_name, response)
             return response.text.strip()
         except Exception as e:
             raise Exception(f"Gemini technical test generation error: {str(e)}")
@@ -260,12 +395,18 @@ class GeminiService(AIService):
 class HuggingFaceService(AIService):
     """Hugging Face Inference API service implementation"""
     
+    provider_name = "huggingface"
+    sdk_module = "huggingface_hub"
+    
     def __init__(self):
         super().__init__()
-        from huggingface_hub import InferenceClient
-        self.client = InferenceClient(token=Config.HUGGINGFACE_API_KEY)
         self.model = Config.HUGGINGFACE_MODEL
-        print(f"Hugging Face service initialized with {self.model}")
+    
+    def _create_client(self):
+        from huggingface_hub import InferenceClient
+        client = InferenceClient(token=Config.HUGGINGFACE_API_KEY)
+        logger.info(f"Hugging Face service initialized with {self.model}")
+        return client
     
     def transcribe_audio(self, audio_path: str) -> str:
         """Hugging Face doesn't support audio transcription in free tier"""
@@ -274,6 +415,7 @@ class HuggingFaceService(AIService):
     def extract_profile(self, text: str) -> dict:
         """Extract profile information using Hugging Face"""
         prompt = self.prompt_repo.get_prompt_with_variables("profile_extraction", text=text)
+        max_tokens = output_budget("profile_extraction", prompt, 1000, text, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat_completion(
@@ -283,9 +425,10 @@ class HuggingFaceService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.1,
-                max_tokens=1000
+                max_tokens=max_tokens
             )
             
+            self._record_usage(self.model, response)
             response_text = response.choices[0].message.content.strip()
             return GroqService._parse_json_response(response_text)
         except Exception as e:
@@ -298,6 +441,7 @@ class HuggingFaceService(AIService):
             transcription=transcription,
             profile_data=json.dumps(profile_data, ensure_ascii=False)
         )
+        max_tokens = output_budget("cv_generation", prompt, 1500, transcription, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat_completion(
@@ -307,8 +451,9 @@ class HuggingFaceService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=1500
+                max_tokens=max_tokens
             )
+            self._record_usage(self.model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"Hugging Face CV generation error: {str(e)}")
@@ -322,6 +467,7 @@ class HuggingFaceService(AIService):
             experience=profile_data.get("experience", ""),
             education=profile_data.get("education", "")
         )
+        max_tokens = output_budget("technical_test", prompt, 2500, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat_completion(
@@ -331,8 +477,9 @@ class HuggingFaceService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.4,
-                max_tokens=2500
+                max_tokens=max_tokens
             )
+            self._record_usage(self.model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"Hugging Face technical test generation error: {str(e)}")
@@ -342,15 +489,24 @@ class HuggingFaceService(AIService):
 class OpenRouterService(AIService):
     """OpenRouter AI service implementation (OpenAI-compatible)"""
     
+    provider_name = "openrouter"
+    sdk_module = "openai"
+    
     def __init__(self):
         super().__init__()
+        self.model = Config.OPENROUTER_MODEL
+    
+    def _create_client(self):
         from openai import OpenAI
-        self.client = OpenAI(
+        client = OpenAI(
             api_key=Config.OPENROUTER_API_KEY,
             base_url=Config.OPENROUTER_BASE_URL
         )
-        self.model = Config.OPENROUTER_MODEL
-        print(f"OpenRouter service initialized with {self.model}")
+        logger.info(f"OpenRouter service initialized with {self.model}")
+        return client
+    
+    def warm_up(self):
+        self.client.with_options(timeout=Config.WARMUP_TIMEOUT, max_retries=0).models.list()
     
     def transcribe_audio(self, audio_path: str) -> str:
         """OpenRouter doesn't support audio transcription"""
@@ -359,6 +515,7 @@ class OpenRouterService(AIService):
     def extract_profile(self, text: str) -> dict:
         """Extract profile information using OpenRouter"""
         prompt = self.prompt_repo.get_prompt_with_variables("profile_extraction", text=text)
+        max_tokens = output_budget("profile_extraction", prompt, 1000, text, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat.completions.create(
@@ -368,9 +525,10 @@ class OpenRouterService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.1,
-                max_tokens=1000
+                max_tokens=max_tokens
             )
             
+            self._record_usage(self.model, response)
             response_text = response.choices[0].message.content.strip()
             return GroqService._parse_json_response(response_text)
         except Exception as e:
@@ -383,6 +541,7 @@ class OpenRouterService(AIService):
             transcription=transcription,
             profile_data=json.dumps(profile_data, ensure_ascii=False)
         )
+        max_tokens = output_budget("cv_generation", prompt, 1500, transcription, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat.completions.create(
@@ -392,8 +551,9 @@ class OpenRouterService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.3,
-                max_tokens=1500
+                max_tokens=max_tokens
             )
+            self._record_usage(self.model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"OpenRouter CV generation error: {str(e)}")
@@ -407,6 +567,7 @@ class OpenRouterService(AIService):
             experience=profile_data.get("experience", ""),
             education=profile_data.get("education", "")
         )
+        max_tokens = output_budget("technical_test", prompt, 2500, provider=self.provider_name, model=self.model)
         
         try:
             response = self.client.chat.completions.create(
@@ -416,8 +577,9 @@ class OpenRouterService(AIService):
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.4,
-                max_tokens=2500
+                max_tokens=max_tokens
             )
+            self._record_usage(self.model, response)
             return response.choices[0].message.content.strip()
         except Exception as e:
             raise Exception(f"OpenRouter technical test generation error: {str(e)}")
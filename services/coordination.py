@@ -0,0 +1,356 @@
+"""
+Provider coordination across replicas
+
+Replicas share two things per provider through a backend. Token buckets for
+the per-minute and per-hour limits of PROVIDER_QUOTAS, so that together they
+stay within the account's limits instead of each sending its own full share.
+And health: a provider that fails with a rate limit, timeout or outage is
+backed off by every replica as soon as one of them sees it, for a period that
+doubles with consecutive failures. The MongoDB backend keeps both in one
+collection, updated atomically on the server with the server's clock; the
+local backend keeps them in the process (a single replica, or a fallback
+while MongoDB is unreachable).
+"""
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+from config import Config
+from database import MongoDBClient
+from utils.logger import setup_logger
+from utils.metrics import PROVIDER_BACKOFFS, SHARED_LIMIT_REJECTIONS
+from .quota_tracker import UNITS, WINDOW_SECONDS
+from .tenancy import TokenBucket
+
+logger = setup_logger("coordination")
+
+# Failures that say something about the provider rather than the request
+BACKOFF_ERROR_CLASSES = ("rate_limit", "timeout", "unavailable")
+
+
+def backoff_seconds(error_class: str, failures: int) -> float:
+    """Backoff after the `failures`-th consecutive failure of a provider"""
+    base = Config.QUOTA_RATE_LIMIT_COOLDOWN if error_class == "rate_limit" else Config.PROVIDER_BACKOFF_MIN
+    return min(Config.PROVIDER_BACKOFF_MAX, base * 2 ** max(failures - 1, 0))
+
+
+class ProviderCoordinator:
+    """Shared provider rate limits and health; subclasses keep the state"""
+
+    backend = ""
+
+    def __init__(self, limits: Optional[dict] = None):
+        self.limits = Config.PROVIDER_QUOTAS if limits is None else limits
+
+    def buckets_for(self, provider: str, model: Optional[str] = None) -> List[Tuple[str, int, float, int]]:
+        """(bucket key, unit index, capacity, period) of every per-minute and per-hour limit of a provider and model"""
+        key = f"{provider}:{model}" if model and f"{provider}:{model}" in self.limits else provider
+        buckets = []
+        for name, limit in self.limits.get(key, {}).items():
+            unit, _, window = name.partition("_per_")
+            if unit in UNITS and window in WINDOW_SECONDS and limit:
+                buckets.append((f"{key}|{name}", UNITS.index(unit), float(limit), WINDOW_SECONDS[window]))
+        return buckets
+
+    def acquire(
+        self,
+        provider: str,
+        model: Optional[str] = None,
+        requests: int = 1,
+        tokens: int = 0,
+        audio_seconds: float = 0.0
+    ) -> float:
+        """
+        Take one call's usage from the provider's shared buckets
+
+        Returns:
+            0 when taken, otherwise the seconds until it would fit (nothing is taken)
+        """
+        amounts = (requests, tokens, audio_seconds)
+        taken = []
+        for key, unit, capacity, period in self.buckets_for(provider, model):
+            if not amounts[unit]:
+                continue
+            wait = self._take(key, capacity, period, amounts[unit])
+            if wait:
+                for taken_key, taken_capacity, taken_period, amount in taken:
+                    self._take(taken_key, taken_capacity, taken_period, -amount)  # Give back
+                SHARED_LIMIT_REJECTIONS.labels(provider).inc()
+                return wait
+            taken.append((key, capacity, period, amounts[unit]))
+        return 0.0
+
+    def report_failure(self, provider: str, error_class: str):
+        """A call failed; errors of BACKOFF_ERROR_CLASSES back the provider off on every replica"""
+        if error_class not in BACKOFF_ERROR_CLASSES:
+            return
+        PROVIDER_BACKOFFS.labels(provider, error_class).inc()
+        self._fail(provider, error_class)
+
+    def report_success(self, provider: str):
+        """A call succeeded: reset the failure count once the backoff is over"""
+
+    def backoff_remaining(self, provider: str) -> float:
+        """Seconds the provider stays backed off (0 when healthy)"""
+        raise NotImplementedError
+
+    def _take(self, key: str, capacity: float, period: int, amount: float) -> float:
+        raise NotImplementedError
+
+    def _fail(self, provider: str, error_class: str):
+        raise NotImplementedError
+
+    def snapshot(self) -> dict:
+        raise NotImplementedError
+
+
+class LocalCoordinator(ProviderCoordinator):
+    """Buckets and health kept in this process"""
+
+    backend = "local"
+
+    def __init__(self, limits: Optional[dict] = None):
+        super().__init__(limits)
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._health: Dict[str, dict] = {}  # provider -> failures, reason, until (time.monotonic())
+        self._lock = threading.Lock()
+
+    def _take(self, key: str, capacity: float, period: int, amount: float) -> float:
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(capacity, period)
+        return bucket.take(amount)
+
+    def _fail(self, provider: str, error_class: str):
+        now = time.monotonic()
+        with self._lock:
+            state = self._health.setdefault(provider, {"failures": 0, "reason": None, "until": 0.0})
+            # Calls that were already in flight when the provider failed do not lengthen the backoff
+            if state["until"] <= now:
+                state["failures"] += 1
+            state["reason"] = error_class
+            state["until"] = max(state["until"], now + backoff_seconds(error_class, state["failures"]))
+
+    def report_success(self, provider: str):
+        with self._lock:
+            state = self._health.get(provider)
+            if state is not None and state["failures"] and state["until"] <= time.monotonic():
+                state["failures"] = 0
+
+    def backoff_remaining(self, provider: str) -> float:
+        with self._lock:
+            state = self._health.get(provider)
+            return max(0.0, state["until"] - time.monotonic()) if state is not None else 0.0
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "backend": self.backend,
+                "providers": {
+                    provider: {
+                        "failures": state["failures"],
+                        "reason": state["reason"],
+                        "backoff_remaining_s": round(max(0.0, state["until"] - now), 1),
+                    }
+                    for provider, state in sorted(self._health.items())
+                },
+                "buckets": {key: round(bucket.level(), 1) for key, bucket in sorted(self._buckets.items())},
+            }
+
+
+class MongoCoordinator(ProviderCoordinator):
+    """
+    Buckets and health shared through MongoDB
+
+    Every bucket take is one atomic find-and-update, refilled with the
+    server's clock ($$NOW), so replicas never race or disagree on time.
+    Health is read for all providers at most every COORDINATION_HEALTH_REFRESH
+    seconds, and failures seen here apply here at once. While MongoDB is
+    unreachable the local state is used instead.
+    """
+
+    backend = "mongodb"
+    COLLECTION = "provider_coordination"
+
+    def __init__(self, limits: Optional[dict] = None):
+        super().__init__(limits)
+        self.local = LocalCoordinator(self.limits)
+        self._db = MongoDBClient()
+        self._health: Dict[str, dict] = {}  # Last read: provider -> failures, reason, until (time.monotonic())
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+
+    def _collection(self):
+        return self._db.database[self.COLLECTION] if self._db.is_connected() else None
+
+    def _failed(self, error: PyMongoError):
+        self._db.report_failure(error)
+        logger.warning(f"Shared provider state unavailable, using this replica's: {error}")
+
+    def _take(self, key: str, capacity: float, period: int, amount: float) -> float:
+        collection = self._collection()
+        if collection is None:
+            return self.local._take(key, capacity, period, amount)
+
+        rate = capacity / period
+        needed = min(amount, capacity)  # More than the capacity is granted from a full bucket, as locally
+        elapsed = {"$divide": [{"$subtract": ["$$NOW", {"$ifNull": ["$updated_at", "$$NOW"]}]}, 1000]}
+        pipeline = [
+            {"$set": {
+                "kind": "bucket",
+                "capacity": capacity,
+                "rate": rate,
+                "tokens": {"$min": [capacity, {"$add": [{"$ifNull": ["$tokens", capacity]}, {"$multiply": [elapsed, rate]}]}]},
+                "updated_at": "$$NOW",
+            }},
+            {"$set": {"granted": {"$gte": ["$tokens", needed]}}},
+            {"$set": {"tokens": {"$cond": ["$granted", {"$subtract": ["$tokens", amount]}, "$tokens"]}}},
+        ]
+        try:
+            document = collection.find_one_and_update(
+                {"_id": f"bucket|{key}"}, pipeline, upsert=True, return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            self._failed(e)
+            return self.local._take(key, capacity, period, amount)
+        if document["granted"]:
+            return 0.0
+        return (needed - document["tokens"]) / rate
+
+    def _fail(self, provider: str, error_class: str):
+        self.local._fail(provider, error_class)
+        collection = self._collection()
+        if collection is None:
+            return
+
+        backoff_ms = [
+            {"$multiply": [backoff_seconds(error_class, 1), 1000]},
+            {"$pow": [2, {"$subtract": ["$failures", 1]}]},
+        ]
+        pipeline = [
+            {"$set": {
+                "kind": "health",
+                "until": {"$ifNull": ["$until", "$$NOW"]},
+                "failures": {"$ifNull": ["$failures", 0]},
+            }},
+            # Calls that were already in flight when the provider failed do not lengthen the backoff
+            {"$set": {"failures": {"$cond": [{"$gt": ["$until", "$$NOW"]}, "$failures", {"$add": ["$failures", 1]}]}}},
+            {"$set": {
+                "reason": error_class,
+                "until": {"$max": ["$until", {"$add": [
+                    "$$NOW", {"$min": [Config.PROVIDER_BACKOFF_MAX * 1000, {"$multiply": backoff_ms}]}
+                ]}]},
+                "updated_at": "$$NOW",
+            }},
+        ]
+        try:
+            collection.update_one({"_id": f"health|{provider}"}, pipeline, upsert=True)
+        except PyMongoError as e:
+            self._failed(e)
+            return
+        self._refresh(force=True)
+        logger.info("Provider backed off on all replicas", extra={
+            "provider": provider, "error_class": error_class,
+            "backoff_s": round(self.backoff_remaining(provider), 1)
+        })
+
+    def report_success(self, provider: str):
+        self.local.report_success(provider)
+        with self._lock:
+            state = self._health.get(provider)
+            if state is None or not state["failures"] or state["until"] > time.monotonic():
+                return  # Nothing to reset; successes cost no round trip
+            state["failures"] = 0
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            collection.update_one(
+                {"_id": f"health|{provider}", "$expr": {"$and": [
+                    {"$gt": ["$failures", 0]}, {"$lte": ["$until", "$$NOW"]}
+                ]}},
+                {"$set": {"failures": 0}}
+            )
+        except PyMongoError as e:
+            self._failed(e)
+
+    def _refresh(self, force: bool = False):
+        """Re-read every provider's health, with the remaining backoff computed by the server"""
+        with self._lock:
+            if not force and time.monotonic() - self._refreshed < Config.COORDINATION_HEALTH_REFRESH:
+                return
+            self._refreshed = time.monotonic()
+        collection = self._collection()
+        if collection is None:
+            return
+        try:
+            documents = list(collection.aggregate([
+                {"$match": {"kind": "health"}},
+                {"$project": {"failures": 1, "reason": 1, "remaining_ms": {"$subtract": ["$until", "$$NOW"]}}},
+            ]))
+        except PyMongoError as e:
+            self._failed(e)
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._health = {
+                document["_id"].partition("|")[2]: {
+                    "failures": document.get("failures", 0),
+                    "reason": document.get("reason"),
+                    "until": now + max(0.0, (document.get("remaining_ms") or 0) / 1000),
+                }
+                for document in documents
+            }
+
+    def backoff_remaining(self, provider: str) -> float:
+        self._refresh()
+        with self._lock:
+            state = self._health.get(provider)
+            shared = max(0.0, state["until"] - time.monotonic()) if state is not None else 0.0
+        return max(shared, self.local.backoff_remaining(provider))
+
+    def snapshot(self) -> dict:
+        collection = self._collection()
+        if collection is None:
+            return {**self.local.snapshot(), "backend": "local (MongoDB unreachable)"}
+        self._refresh(force=True)
+        try:
+            buckets = list(collection.aggregate([
+                {"$match": {"kind": "bucket"}},
+                {"$project": {"tokens": {"$min": ["$capacity", {"$add": [
+                    "$tokens", {"$multiply": [{"$divide": [{"$subtract": ["$$NOW", "$updated_at"]}, 1000]}, "$rate"]}
+                ]}]}}},
+            ]))
+        except PyMongoError as e:
+            self._failed(e)
+            return {**self.local.snapshot(), "backend": "local (MongoDB unreachable)"}
+        now = time.monotonic()
+        with self._lock:
+            providers = {
+                provider: {
+                    "failures": state["failures"],
+                    "reason": state["reason"],
+                    "backoff_remaining_s": round(max(0.0, state["until"] - now), 1),
+                }
+                for provider, state in sorted(self._health.items())
+            }
+        return {
+            "backend": self.backend,
+            "providers": providers,
+            "buckets": {document["_id"].partition("|")[2]: round(document["tokens"], 1) for document in buckets},
+        }
+
+
+def create_coordinator() -> Optional[ProviderCoordinator]:
+    """The coordinator selected by COORDINATION_BACKEND (None when "off")"""
+    backend = Config.COORDINATION_BACKEND.lower()
+    if backend == "off":
+        return None
+    if backend == "mongodb" and Config.MONGODB_ENABLED:
+        return MongoCoordinator()
+    if backend == "mongodb":
+        logger.info("MongoDB disabled, provider limits and health are per replica")
+    return LocalCoordinator()
@@ -0,0 +1,158 @@
+"""
+Uploaded Gemini files, reused by content hash and deleted in the background
+"""
+import hashlib
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import CACHE_REQUESTS
+from utils.tracing import set_span_attributes
+
+logger = setup_logger("gemini_files")
+
+# Prefix of display names, so files left by a previous run can be recognised
+DISPLAY_NAME_PREFIX = "video-profile-"
+
+
+class GeminiFileCache:
+    """
+    Uploads audio to the Gemini Files API at most once per content hash
+
+    A retry, a fallback or a re-upload of the same video reuses the remote
+    file until it has gone unused for GEMINI_FILE_REUSE_TTL seconds. A reaper
+    thread then deletes it, and on its first pass also removes files
+    of ours older than GEMINI_FILE_ORPHAN_AGE (left behind by restarts).
+    """
+
+    def __init__(self, genai):
+        self.genai = genai
+        self._files: Dict[str, tuple] = {}  # sha256 -> (remote file, last used monotonic)
+        self._lock = threading.Lock()
+        self._upload_locks: Dict[str, threading.Lock] = {}
+        self._stop_event = threading.Event()
+        self._reaper = threading.Thread(target=self._reap_loop, name="gemini-file-reaper", daemon=True)
+        self._reaper.start()
+
+    @staticmethod
+    def _content_hash(path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def get(self, path: str, mime_type: str = "audio/wav"):
+        """
+        Remote file for this content, uploading it if needed
+
+        Raises:
+            TimeoutError: If the file is not ready within GEMINI_FILE_READY_TIMEOUT
+            RuntimeError: If Gemini failed to process the file
+        """
+        content_hash = self._content_hash(path)
+
+        with self._lock:
+            upload_lock = self._upload_locks.setdefault(content_hash, threading.Lock())
+
+        # Concurrent requests for the same audio wait for one upload
+        with upload_lock:
+            try:
+                return self._get_or_upload(path, mime_type, content_hash)
+            finally:
+                with self._lock:
+                    self._upload_locks.pop(content_hash, None)
+
+    def _get_or_upload(self, path: str, mime_type: str, content_hash: str):
+        with self._lock:
+            entry = self._files.get(content_hash)
+            if entry is not None:
+                self._files[content_hash] = (entry[0], time.monotonic())
+        if entry is not None:
+            CACHE_REQUESTS.labels("gemini_file", "hit").inc()
+            set_span_attributes(gemini_audio="reused")
+            return entry[0]
+
+        CACHE_REQUESTS.labels("gemini_file", "miss").inc()
+        remote = self.genai.upload_file(
+            path, mime_type=mime_type, display_name=f"{DISPLAY_NAME_PREFIX}{content_hash[:16]}"
+        )
+        try:
+            remote = self._wait_until_active(remote)
+        except Exception:
+            self._delete_in_background(remote.name)
+            raise
+
+        with self._lock:
+            self._files[content_hash] = (remote, time.monotonic())
+        set_span_attributes(gemini_audio="uploaded")
+        return remote
+
+    def _wait_until_active(self, remote):
+        """Poll the file state with backoff, bounded by GEMINI_FILE_READY_TIMEOUT"""
+        deadline = time.monotonic() + Config.GEMINI_FILE_READY_TIMEOUT
+        delay = 0.25
+        while remote.state.name == "PROCESSING":
+            if time.monotonic() + delay > deadline:
+                raise TimeoutError(
+                    f"Gemini file {remote.name} not ready after {Config.GEMINI_FILE_READY_TIMEOUT:.0f}s"
+                )
+            time.sleep(delay)
+            delay = min(delay * 2, 2.0)
+            remote = self.genai.get_file(remote.name)
+
+        if remote.state.name == "FAILED":
+            raise RuntimeError(f"Gemini failed to process file {remote.name}")
+        return remote
+
+    def _delete(self, name: str):
+        try:
+            self.genai.delete_file(name)
+        except Exception as e:
+            logger.warning(f"Could not delete Gemini file {name}: {e}")
+
+    def _delete_in_background(self, name: str):
+        threading.Thread(target=self._delete, args=(name,), name="gemini-file-delete", daemon=True).start()
+
+    def _reap_loop(self):
+        self._delete_orphans()
+        interval = max(Config.GEMINI_FILE_REUSE_TTL / 2, 5)
+        while not self._stop_event.wait(interval):
+            self.reap()
+
+    def reap(self):
+        """Delete files not used for GEMINI_FILE_REUSE_TTL seconds"""
+        cutoff = time.monotonic() - Config.GEMINI_FILE_REUSE_TTL
+        with self._lock:
+            expired = [h for h, (_, last_used) in self._files.items() if last_used < cutoff]
+            remotes = [self._files.pop(h)[0] for h in expired]
+        for remote in remotes:
+            self._delete(remote.name)
+        if remotes:
+            logger.info(f"Deleted {len(remotes)} expired Gemini files")
+
+    def _delete_orphans(self):
+        """Remove our files left over by earlier processes"""
+        try:
+            now = datetime.now(timezone.utc)
+            for remote in self.genai.list_files():
+                if not (remote.display_name or "").startswith(DISPLAY_NAME_PREFIX):
+                    continue
+                created = remote.create_time
+                if created.tzinfo is None:
+                    created = created.replace(tzinfo=timezone.utc)
+                if (now - created).total_seconds() > Config.GEMINI_FILE_ORPHAN_AGE:
+                    self._delete(remote.name)
+        except Exception as e:
+            logger.warning(f"Could not list Gemini files: {e}")
+
+    def close(self):
+        """Stop the reaper and delete every cached file"""
+        self._stop_event.set()
+        with self._lock:
+            remotes = [remote for remote, _ in self._files.values()]
+            self._files.clear()
+        for remote in remotes:
+            self._delete(remote.name)
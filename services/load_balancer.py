@@ -2,9 +2,27 @@
 Load Balancer for AI Services
 Distributes tasks to specialized services for optimal performance
 """
-from typing import Dict
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+from pydantic import ValidationError
 from config import Config
+from models.schemas import ProfileData
+from utils.logger import setup_logger, log_context
+from utils.metrics import (
+    PROVIDER_REQUEST_SECONDS, PROVIDER_ERRORS, LOAD_BALANCER_FALLBACKS, MODEL_TIER_SECONDS,
+    MODEL_TIER_ESCALATIONS, QUOTA_REROUTES, QUOTA_DEFERRALS, classify_error
+)
+from utils.tokens import estimate_input_tokens
+from utils.tracing import start_span
 from .ai_service import AIService
+from .coordination import ProviderCoordinator
+from .prompt_budget import fit_transcription
+from .quota_tracker import QuotaTracker, audio_duration
+
+logger = setup_logger("load_balancer")
 
 
 class AILoadBalancer:
@@ -12,30 +30,60 @@ class AILoadBalancer:
     Intelligent load balancer that routes requests to specialized AI services
     
     Strategy:
-    - Video Processing (transcription + profile extraction): Groq (fast transcription)
+    - Video Processing (transcription + profile extraction): Groq (fast transcription),
+      or local Whisper with TRANSCRIPTION_PROVIDER=local
     - CV Profile Generation: Gemini (high quality text)
     - Technical Test Generation: OpenRouter/Hugging Face (for companies)
     - Fallback: Any available service
+    - Model tiering: text tasks whose input fits SMALL_TIER_MAX_INPUT_TOKENS try a
+      small fast model first and escalate to the regular route when its output is invalid
+    - Transcriptions are fitted to the task's prompt token budget once, before routing,
+      so fallbacks and escalations reuse the condensed text
+    - Quotas: with a QuotaTracker, a provider without headroom for the call is skipped
+      before calling it; low priority calls wait for headroom instead (up to
+      QUOTA_DEFER_MAX_SECONDS, on the calling thread)
+    - Replicas: with a ProviderCoordinator, calls take tokens from the providers'
+      cross-replica rate limits, and a provider backed off by any replica (after a
+      rate limit, timeout or outage) is skipped like one without headroom
     
     Note: Technical tests are generated by companies for selected candidates,
     not automatically from candidate profiles.
     """
     
-    def __init__(self, services: Dict[str, AIService]):
+    # Output tokens counted against quotas before a call (the answer's size is not known yet)
+    EXPECTED_OUTPUT_TOKENS = {'profile_extraction': 600, 'cv_generation': 900, 'technical_test': 2500}
+    
+    def __init__(
+        self,
+        services: Dict[str, AIService],
+        quota_tracker: Optional[QuotaTracker] = None,
+        coordinator: Optional[ProviderCoordinator] = None
+    ):
         """
         Initialize load balancer with available services
         
         Args:
             services: Dictionary of service_name -> service_instance
+            quota_tracker: Usage accounting for quota-aware scheduling (None disables it)
+            coordinator: Rate limits and provider health shared with other replicas (None disables it)
         """
         self.services = services
+        self.quota = quota_tracker
+        self.coordinator = coordinator
+        for service in services.values():
+            service.quota_tracker = quota_tracker
         self.primary_services = {
-            'transcription': 'groq',        # Best for audio transcription
+            'transcription': Config.TRANSCRIPTION_PROVIDER,  # Groq by default
             'profile_extraction': 'groq',   # Fast and accurate
             'cv_generation': 'groq',        # Changed to Groq (better quota than Gemini)
             'technical_test': 'groq'        # Changed to Groq (more reliable)
         }
         self.fallback_order = ['groq', 'gemini', 'openrouter', 'huggingface']
+        self.transcription_services = ['groq', 'local', 'gemini']  # Only these support transcription
+        self.small_tier_order = [name.strip() for name in Config.SMALL_TIER_PROVIDERS.split(',') if name.strip()]
+        self.small_tier_models = {'groq': Config.GROQ_SMALL_CHAT_MODEL}  # Others use their (small) default model
+        self._tier_stats = {}  # (task, tier) -> [requests, total seconds, escalations]
+        self._tier_lock = threading.Lock()
     
     def get_service_for_task(self, task: str) -> AIService:
         """
@@ -47,141 +95,359 @@ class AILoadBalancer:
         Returns:
             AIService instance
         """
+        return self.services[self._get_service_name_for_task(task)]
+    
+    def _get_service_name_for_task(self, task: str) -> str:
+        """Resolve the name of the service that should handle a task"""
         # Try primary service for this task
         primary_service_name = self.primary_services.get(task)
         if primary_service_name and primary_service_name in self.services:
-            return self.services[primary_service_name]
+            return primary_service_name
         
         # Fallback to first available service
-        for service_name in self.fallback_order:
+        candidates = self.transcription_services if task == 'transcription' else self.fallback_order
+        for service_name in candidates:
             if service_name in self.services:
-                service = self.services[service_name]
-                
-                # Check if service supports the task
-                if task == 'transcription':
-                    try:
-                        # Only Groq and Gemini support transcription
-                        if service_name in ['groq', 'gemini']:
-                            return service
-                    except:
-                        continue
-                else:
-                    return service
+                return service_name
         
         raise RuntimeError(f"No service available for task: {task}")
     
-    def transcribe_audio(self, audio_path: str) -> str:
-        """Route transcription to best service with fallback"""
-        service = self.get_service_for_task('transcription')
-        print(f"[Load Balancer] Using {type(service).__name__} for transcription")
-        
-        try:
-            return service.transcribe_audio(audio_path)
-        except Exception as e:
-            error_msg = str(e)
-            print(f"[Load Balancer] Error with {type(service).__name__}: {error_msg}")
-            
-            # Try fallback for transcription (only Groq and Gemini support it)
-            if "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                print(f"[Load Balancer] Attempting fallback for transcription...")
-                
-                for service_name in ['groq', 'gemini']:  # Only these support transcription
-                    if service_name in self.services:
-                        fallback_service = self.services[service_name]
-                        if fallback_service != service:
-                            try:
-                                print(f"[Load Balancer] Trying {type(fallback_service).__name__}...")
-                                return fallback_service.transcribe_audio(audio_path)
-                            except Exception as fallback_error:
-                                print(f"[Load Balancer] Fallback failed: {str(fallback_error)}")
-                                continue
+    @staticmethod
+    def _is_quota_error(error_msg: str) -> bool:
+        """Quota and rate limit errors are the ones worth retrying elsewhere"""
+        return "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower()
+    
+    def _should_fallback(self, service_name: str, error: Exception) -> bool:
+        """Retry elsewhere on quota errors, or on any failure of a local backend"""
+        return self._is_quota_error(str(error)) or self.services[service_name].is_local
+    
+    def _is_shared(self, service_name: str) -> bool:
+        """Whether the service's limits and health are coordinated across replicas (local backends are not)"""
+        return self.coordinator is not None and not self.services[service_name].is_local
+    
+    def _call_service(self, service_name: str, task: str, method: str, *args, **kwargs):
+        """Call one provider and record latency and errors"""
+        service = self.services[service_name]
+        with log_context(provider=service_name), start_span(f"provider.{task}", provider=service_name):
+            start = time.perf_counter()
+            try:
+                result = getattr(service, method)(*args, **kwargs)
+            except Exception as e:
+                elapsed = time.perf_counter() - start
+                error_class = classify_error(e)
+                PROVIDER_REQUEST_SECONDS.labels(service_name, task, "error").observe(elapsed)
+                PROVIDER_ERRORS.labels(service_name, task, error_class).inc()
+                if error_class == "rate_limit" and self.quota is not None:
+                    self.quota.mark_rate_limited(service_name)
+                if self._is_shared(service_name):
+                    self.coordinator.report_failure(service_name, error_class)
+                logger.warning(
+                    "Provider call failed",
+                    extra={"task": task, "error_class": error_class, "error": str(e), "duration_ms": round(elapsed * 1000, 1)}
+                )
+                raise
             
-            raise e
+            elapsed = time.perf_counter() - start
+            PROVIDER_REQUEST_SECONDS.labels(service_name, task, "success").observe(elapsed)
+            if self._is_shared(service_name):
+                self.coordinator.report_success(service_name)
+            logger.info("Provider call succeeded", extra={"task": task, "duration_ms": round(elapsed * 1000, 1)})
+            return result
     
-    def extract_profile(self, text: str) -> dict:
-        """Route profile extraction to best service with fallback"""
-        service = self.get_service_for_task('profile_extraction')
-        print(f"[Load Balancer] Using {type(service).__name__} for profile extraction")
+    def _expected_usage(self, task: str, *args) -> dict:
+        """Usage a call is expected to add, for quota checks"""
+        if task == 'transcription':
+            return {'audio_seconds': audio_duration(args[0])}
+        return {'tokens': estimate_input_tokens(*args) + self.EXPECTED_OUTPUT_TOKENS.get(task, 0)}
+    
+    def _has_headroom(self, service_name: str, task: str, expected: dict, priority: str, model: str = None) -> bool:
+        return not self._seconds_until_headroom(service_name, task, expected, priority, model)
+    
+    def _seconds_until_headroom(
+        self, service_name: str, task: str, expected: dict, priority: str, model: str = None
+    ) -> float:
+        """Wait before the service has quota headroom and is not backed off (0 when it can be called now)"""
+        waits = [0.0]
+        if self._is_shared(service_name):
+            waits.append(self.coordinator.backoff_remaining(service_name))
+        if self.quota is not None:
+            model = model or self.services[service_name].model_for(task)
+            waits.append(self.quota.seconds_until_headroom(service_name, model, priority=priority, **expected))
+        return max(waits)
+    
+    def _acquire(self, service_name: str, task: str, expected: dict, model: str = None) -> float:
+        """Take the call from the service's shared rate limits; 0 when taken, else the wait for tokens"""
+        if not self._is_shared(service_name):
+            return 0.0
+        model = model or self.services[service_name].model_for(task)
+        return self.coordinator.acquire(service_name, model, **expected)
+    
+    def _candidates(self, task: str, preferred: Optional[str] = None) -> list:
+        """Preferred (or primary) service first, then the task's fallbacks"""
+        primary = preferred if preferred in self.services else self._get_service_name_for_task(task)
+        order = self.transcription_services if task == 'transcription' else self.fallback_order
+        return [primary] + [name for name in order if name in self.services and name != primary]
+    
+    def healthy_services(self, task: str) -> list:
+        """
+        Services able to take a typical call of this task now (quota headroom, not backed off)
         
-        try:
-            return service.extract_profile(text)
-        except Exception as e:
-            import traceback
-            error_msg = str(e)
-            print(f"[Load Balancer] Error with {type(service).__name__}: {error_msg}")
-            print(f"[Load Balancer] Full traceback:\n{traceback.format_exc()}")
-            
-            # Try fallback services if quota exceeded or rate limit
-            if "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                print(f"[Load Balancer] Attempting fallback for profile extraction...")
-                
-                for service_name in self.fallback_order:
-                    if service_name in self.services:
-                        fallback_service = self.services[service_name]
-                        if fallback_service != service:
-                            try:
-                                print(f"[Load Balancer] Trying {type(fallback_service).__name__}...")
-                                return fallback_service.extract_profile(text)
-                            except Exception as fallback_error:
-                                print(f"[Load Balancer] Fallback failed: {str(fallback_error)}")
-                                continue
-            
-            raise e
+        Never empty: without quota tracking or headroom anywhere, the primary is returned.
+        """
+        candidates = self._candidates(task)
+        if self.quota is None and self.coordinator is None:
+            return candidates
+        expected = {'tokens': self.EXPECTED_OUTPUT_TOKENS.get(task, 0)}
+        healthy = [name for name in candidates if self._has_headroom(name, task, expected, 'normal')]
+        return healthy or candidates[:1]
     
-    def generate_cv_profile(self, transcription: str, profile_data: dict) -> str:
-        """Route CV generation to best service with fallback"""
-        service = self.get_service_for_task('cv_generation')
-        print(f"[Load Balancer] Using {type(service).__name__} for CV generation")
+    def _schedule(self, task: str, label: str, expected: dict, priority: str, preferred: Optional[str] = None) -> str:
+        """
+        First service (primary, then fallbacks) with quota headroom for the call
+        that is not backed off and gets tokens from its shared rate limits
         
-        try:
-            return service.generate_cv_profile(transcription, profile_data)
-        except Exception as e:
-            error_msg = str(e)
-            print(f"[Load Balancer] Error with {type(service).__name__}: {error_msg}")
+        Without headroom anywhere, normal priority calls wait up to
+        COORDINATION_MAX_WAIT for shared tokens, then go to the first service
+        not backed off anyway (limits are estimates and the 429 fallback still
+        applies), while low priority calls wait for the earliest window to roll over.
+        """
+        candidates = self._candidates(task, preferred)
+        if self.quota is None and self.coordinator is None:
+            return candidates[0]
+        
+        max_wait = Config.QUOTA_DEFER_MAX_SECONDS if priority == 'low' else Config.COORDINATION_MAX_WAIT
+        deadline = time.monotonic() + max_wait
+        deferred = False
+        while True:
+            waits, token_waits = [], []
+            for service_name in candidates:
+                wait = self._seconds_until_headroom(service_name, task, expected, priority)
+                if not wait:
+                    wait = self._acquire(service_name, task, expected)
+                    token_waits.append(wait)
+                if not wait:
+                    if service_name != candidates[0]:
+                        QUOTA_REROUTES.labels(task, candidates[0], service_name).inc()
+                        logger.info(
+                            f"Scheduling {label} on {service_name}: no headroom on {candidates[0]}",
+                            extra={"task": task, "provider": service_name}
+                        )
+                    return service_name
+                waits.append(wait)
             
-            # Try fallback services if quota exceeded or rate limit
-            if "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                print(f"[Load Balancer] Attempting fallback for CV generation...")
-                
-                # Try other services in order
-                for service_name in self.fallback_order:
-                    if service_name in self.services:
-                        fallback_service = self.services[service_name]
-                        if fallback_service != service:  # Don't retry same service
-                            try:
-                                print(f"[Load Balancer] Trying {type(fallback_service).__name__}...")
-                                return fallback_service.generate_cv_profile(transcription, profile_data)
-                            except Exception as fallback_error:
-                                print(f"[Load Balancer] Fallback failed: {str(fallback_error)}")
-                                continue
+            remaining = deadline - time.monotonic()
+            if priority != 'low':
+                waits = token_waits  # Only shared tokens are worth waiting for
+            if not waits or remaining <= 0:
+                return next((name for name in candidates if self._is_available(name)), candidates[0])
             
-            # If all fallbacks fail, raise original error
-            raise e
+            wait = min(waits)
+            if not deferred:
+                deferred = True
+                if priority == 'low':
+                    QUOTA_DEFERRALS.labels(task).inc()
+                logger.info(f"Deferring {priority} priority {label} until quota frees up", extra={"task": task, "wait_s": round(wait, 1)})
+            time.sleep(max(0.1 if priority != 'low' else 0.5, min(wait, remaining)))
     
-    def generate_technical_test(self, profile_data: dict) -> str:
-        """Route technical test generation to best service with fallback"""
-        service = self.get_service_for_task('technical_test')
-        print(f"[Load Balancer] Using {type(service).__name__} for technical test generation")
-        
+    def _is_available(self, service_name: str) -> bool:
+        """Not backed off by any replica"""
+        return not self._is_shared(service_name) or not self.coordinator.backoff_remaining(service_name)
+    
+    def _choose_tier(self, task: str, expected: dict, priority: str, *args) -> str:
+        """'small' when tiering is enabled for the task, the input fits its token limit and the small model has quota"""
+        limit = Config.SMALL_TIER_MAX_INPUT_TOKENS.get(task, 0)
+        service_name = self._small_tier_service()
+        if not Config.MODEL_TIERING_ENABLED or limit <= 0 or service_name is None:
+            return 'large'
+        if estimate_input_tokens(*args) > limit:
+            return 'large'
+        model = self.small_tier_models.get(service_name)
+        if not self._has_headroom(service_name, task, expected, priority, model=model):
+            return 'large'
+        return 'large' if self._acquire(service_name, task, expected, model=model) else 'small'
+    
+    def _small_tier_service(self) -> Optional[str]:
+        for service_name in self.small_tier_order:
+            if service_name in self.services:
+                return service_name
+        return None
+    
+    @staticmethod
+    def _is_valid_result(task: str, result) -> bool:
+        """Whether a small model's output can be used as is"""
+        if task != 'profile_extraction':
+            return isinstance(result, str) and bool(result.strip())
+        if not isinstance(result, dict) or not set(result) & set(ProfileData.model_fields):
+            return False
+        # Lists of strings are accepted, as from the large model; anything else must be text
+        fields = {
+            key: ", ".join(value) if isinstance(value, list) and all(isinstance(v, str) for v in value) else value
+            for key, value in result.items() if key in ProfileData.model_fields
+        }
         try:
-            return service.generate_technical_test(profile_data)
-        except Exception as e:
-            error_msg = str(e)
-            print(f"[Load Balancer] Error with {type(service).__name__}: {error_msg}")
-            
-            # Try fallback services if quota exceeded or rate limit
-            if "429" in error_msg or "quota" in error_msg.lower() or "rate limit" in error_msg.lower():
-                print(f"[Load Balancer] Attempting fallback for technical test generation...")
+            ProfileData.model_validate(fields)
+        except ValidationError:
+            return False
+        # The fields later stages build on must have been found
+        return all(isinstance(fields.get(key), str) and fields[key].strip() for key in ('profession', 'technologies'))
+    
+    @contextmanager
+    def _track_tier(self, task: str, tier: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            MODEL_TIER_SECONDS.labels(task, tier).observe(elapsed)
+            with self._tier_lock:
+                stats = self._tier_stats.setdefault((task, tier), [0, 0.0, 0])
+                stats[0] += 1
+                stats[1] += elapsed
+    
+    def _escalate(self, task: str, reason: str):
+        MODEL_TIER_ESCALATIONS.labels(task, reason).inc()
+        with self._tier_lock:
+            self._tier_stats.setdefault((task, 'small'), [0, 0.0, 0])[2] += 1
+    
+    def _try_small_tier(self, task: str, label: str, method: str, *args):
+        """Run a task on the small tier; None means it must be escalated"""
+        service_name = self._small_tier_service()
+        model = self.small_tier_models.get(service_name)
+        kwargs = {'model': model} if model else {}
+        
+        with self._track_tier(task, 'small'):
+            try:
+                result = self._call_service(service_name, task, method, *args, **kwargs)
+            except Exception:
+                reason = 'error'
+            else:
+                if self._is_valid_result(task, result):
+                    return result
+                reason = 'invalid'
+        
+        self._escalate(task, reason)
+        logger.info(f"Escalating {label} to the large model", extra={"task": task, "reason": reason})
+        return None
+    
+    def tier_stats(self) -> dict:
+        """Requests, mean latency and escalation rate per task and model tier"""
+        with self._tier_lock:
+            snapshot = {key: list(values) for key, values in self._tier_stats.items()}
+        
+        stats = {}
+        for (task, tier), (requests, total_seconds, escalations) in sorted(snapshot.items()):
+            entry = {
+                "requests": requests,
+                "mean_latency_ms": round(total_seconds / requests * 1000, 1) if requests else None
+            }
+            if tier == 'small':
+                entry["escalations"] = escalations
+                entry["escalation_rate"] = round(escalations / requests, 3) if requests else None
+            stats.setdefault(task, {})[tier] = entry
+        return stats
+    
+    def _route(self, task: str, label: str, method: str, *args, priority: str = 'normal', preferred: str = None):
+        """
+        Run a task on the small model tier when its input is short enough, then on the
+        regular (large) route if that fails or returns an invalid result
+        
+        Args:
+            task: Routing task name
+            label: Human readable task name for logs
+            method: AIService method to call
+            *args: Arguments for the method
+            priority: 'normal', or 'low' for work that can wait for quota headroom
+            preferred: Service to try instead of the task's primary (e.g. to spread a batch)
+        """
+        expected = self._expected_usage(task, *args) if self.quota is not None or self.coordinator is not None else {}
+        route = functools.partial(self._route_primary, expected=expected, priority=priority, preferred=preferred)
+        if task not in Config.SMALL_TIER_MAX_INPUT_TOKENS:
+            return route(task, label, method, *args)
+        
+        tier = self._choose_tier(task, expected, priority, *args)
+        with start_span(f"tier.{task}", model_tier=tier):
+            if tier == 'small':
+                result = self._try_small_tier(task, label, method, *args)
+                if result is not None:
+                    return result
+            with self._track_tier(task, 'large'):
+                return route(task, label, method, *args)
+    
+    def _route_primary(
+        self,
+        task: str,
+        label: str,
+        method: str,
+        *args,
+        expected: dict = None,
+        priority: str = 'normal',
+        preferred: str = None
+    ):
+        """
+        Run a task on the first service with quota headroom (normally its primary),
+        falling back to other services on quota errors
+        
+        Args:
+            task: Routing task name
+            label: Human readable task name for logs
+            method: AIService method to call
+            *args: Arguments for the method
+            expected: Expected usage of the call, for quota checks
+            priority: 'normal' or 'low' (see _schedule)
+            preferred: Service to try first instead of the primary
+        """
+        service_name = self._schedule(task, label, expected or {}, priority, preferred)
+        service = self.services[service_name]
+        logger.debug(f"Using {type(service).__name__} for {label}")
+        
+        with start_span(f"route.{task}", primary_provider=service_name) as span:
+            try:
+                return self._call_service(service_name, task, method, *args)
+            except Exception as e:
+                # Try fallback services if quota exceeded or rate limit
+                if self._should_fallback(service_name, e):
+                    logger.info(f"Attempting fallback for {label}", extra={"task": task, "provider": service_name})
+                    
+                    candidates = self.transcription_services if task == 'transcription' else self.fallback_order
+                    for fallback_name in candidates:
+                        if fallback_name in self.services:
+                            fallback_service = self.services[fallback_name]
+                            if fallback_service != service:  # Don't retry same service
+                                # Skip services without quota headroom, backed off by another replica
+                                # or whose shared limits are used up, as _schedule does
+                                if self._seconds_until_headroom(fallback_name, task, expected or {}, priority):
+                                    continue
+                                if self._acquire(fallback_name, task, expected or {}):
+                                    continue
+                                LOAD_BALANCER_FALLBACKS.labels(task, service_name, fallback_name).inc()
+                                span.set_attributes(fallback_provider=fallback_name)
+                                try:
+                                    return self._call_service(fallback_name, task, method, *args)
+                                except Exception:
+                                    continue
                 
-                for service_name in self.fallback_order:
-                    if service_name in self.services:
-                        fallback_service = self.services[service_name]
-                        if fallback_service != service:
-                            try:
-                                print(f"[Load Balancer] Trying {type(fallback_service).__name__}...")
-                                return fallback_service.generate_technical_test(profile_data)
-                            except Exception as fallback_error:
-                                print(f"[Load Balancer] Fallback failed: {str(fallback_error)}")
-                                continue
-            
-            raise e
+                # If all fallbacks fail, raise original error
+                raise e
+    
+    def transcribe_audio(self, audio_path: str, priority: str = 'normal') -> str:
+        """Route transcription to best service with fallback"""
+        return self._route('transcription', 'transcription', 'transcribe_audio', audio_path, priority=priority)
+    
+    def extract_profile(self, text: str, priority: str = 'normal') -> dict:
+        """Route profile extraction to best service with fallback"""
+        text = fit_transcription('profile_extraction', text)
+        return self._route('profile_extraction', 'profile extraction', 'extract_profile', text, priority=priority)
+    
+    def generate_cv_profile(self, transcription: str, profile_data: dict, priority: str = 'normal') -> str:
+        """Route CV generation to best service with fallback"""
+        transcription = fit_transcription('cv_generation', transcription)
+        return self._route(
+            'cv_generation', 'CV generation', 'generate_cv_profile', transcription, profile_data, priority=priority
+        )
+    
+    def generate_technical_test(self, profile_data: dict, priority: str = 'normal', preferred: str = None) -> str:
+        """Route technical test generation to best service with fallback"""
+        return self._route(
+            'technical_test', 'technical test generation', 'generate_technical_test', profile_data,
+            priority=priority, preferred=preferred
+        )
@@ -0,0 +1,140 @@
+"""
+Local CPU transcription with faster-whisper
+
+The model runs in a process pool: every worker process loads it once (pool
+initializer) and CTranslate2 decodes with its own threads, so transcription
+uses all cores without contending for the API process's GIL, and never
+touches the network or a provider quota.
+"""
+import multiprocessing
+import os
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from config import Config
+from utils.logger import setup_logger
+from .ai_service import AIService
+
+logger = setup_logger("local_transcription")
+
+# Model owned by each pool process
+_model = None
+
+
+def _load_model(model_size: str, compute_type: str, cpu_threads: int, download_root: str):
+    """Pool initializer: load the model once per worker process"""
+    global _model
+    from faster_whisper import WhisperModel
+    _model = WhisperModel(
+        model_size,
+        device="cpu",
+        compute_type=compute_type,
+        cpu_threads=cpu_threads,
+        download_root=download_root or None
+    )
+
+
+def _ready() -> bool:
+    """No-op task that makes the pool start a worker (and load the model)"""
+    return _model is not None
+
+
+def _transcribe(audio, language: str, beam_size: int) -> tuple:
+    """
+    Run in a pool process
+
+    Args:
+        audio: 16 kHz mono 16-bit PCM bytes, or a file path for other formats
+        language: Language code, or empty to auto-detect
+        beam_size: Decoder beam size (1 is greedy and fastest)
+
+    Returns:
+        Tuple of (text, audio duration in seconds)
+    """
+    if isinstance(audio, bytes):
+        import numpy as np
+        audio = np.frombuffer(audio, dtype=np.int16).astype(np.float32) / 32768.0
+
+    segments, info = _model.transcribe(
+        audio,
+        language=language or None,
+        beam_size=beam_size,
+        vad_filter=True
+    )
+    text = " ".join(segment.text.strip() for segment in segments)
+    return text.strip(), info.duration
+
+
+class LocalWhisperService(AIService):
+    """Transcription-only service running Whisper locally (faster-whisper, int8 on CPU)"""
+
+    # Failures are not quota related, but other providers can still take over
+    is_local = True
+    provider_name = "local"
+
+    # faster-whisper consumes this format directly, without decoding or resampling
+    _PCM_RATE = 16000
+
+    sdk_module = "faster_whisper"
+
+    def __init__(self):
+        super().__init__()
+        self.model_name = f"faster-whisper-{Config.LOCAL_WHISPER_MODEL}"
+        # spawn: the API process runs logging and MongoDB threads that must not be forked
+        self.pool = ProcessPoolExecutor(
+            max_workers=Config.LOCAL_WHISPER_PROCESSES,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_model,
+            initargs=(
+                Config.LOCAL_WHISPER_MODEL,
+                Config.LOCAL_WHISPER_COMPUTE_TYPE,
+                Config.LOCAL_WHISPER_CPU_THREADS,
+                Config.LOCAL_WHISPER_MODEL_DIR
+            )
+        )
+        logger.info(
+            f"Local Whisper service initialized with {Config.LOCAL_WHISPER_MODEL} "
+            f"({Config.LOCAL_WHISPER_COMPUTE_TYPE}, {Config.LOCAL_WHISPER_PROCESSES} processes "
+            f"x {Config.LOCAL_WHISPER_CPU_THREADS} threads)"
+        )
+
+    def warm_up(self):
+        """Start every pool process so the model is loaded before the first video"""
+        futures = [self.pool.submit(_ready) for _ in range(Config.LOCAL_WHISPER_PROCESSES)]
+        for future in futures:
+            future.result(timeout=Config.LOCAL_WHISPER_TIMEOUT)
+
+    @classmethod
+    def _read_pcm(cls, audio_path: str):
+        """Raw PCM frames of the extracted WAV, or None if it is not 16 kHz mono 16-bit"""
+        try:
+            with wave.open(audio_path, "rb") as wav:
+                if (wav.getframerate(), wav.getnchannels(), wav.getsampwidth()) != (cls._PCM_RATE, 1, 2):
+                    return None
+                return wav.readframes(wav.getnframes())
+        except (wave.Error, EOFError):
+            return None
+
+    def transcribe_audio(self, audio_path: str) -> str:
+        """Transcribe audio in the local process pool"""
+        try:
+            pcm = self._read_pcm(audio_path)
+            future = self.pool.submit(
+                _transcribe,
+                pcm if pcm is not None else audio_path,
+                Config.LOCAL_WHISPER_LANGUAGE,
+                Config.LOCAL_WHISPER_BEAM_SIZE
+            )
+            text, duration = future.result(timeout=Config.LOCAL_WHISPER_TIMEOUT)
+            self._record_usage(self.model_name, audio_bytes=os.path.getsize(audio_path), audio_seconds=round(duration, 2))
+            return text if text else "Unable to transcribe audio."
+        except Exception as e:
+            raise Exception(f"Local transcription error: {str(e)}")
+
+    def extract_profile(self, text: str) -> dict:
+        raise NotImplementedError("Local Whisper service only supports audio transcription.")
+
+    def generate_cv_profile(self, transcription: str, profile_data: dict) -> str:
+        raise NotImplementedError("Local Whisper service only supports audio transcription.")
+
+    def generate_technical_test(self, profile_data: dict) -> str:
+        raise NotImplementedError("Local Whisper service only supports audio transcription.")
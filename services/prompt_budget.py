@@ -0,0 +1,245 @@
+"""
+Token budgets for prompts built from transcriptions
+
+Long presentations are fitted to a per-task budget in three steps, stopping
+as soon as the text fits: remove filler words and repeated sentences, keep
+the most informative sentences (in their original order), and finally cut
+at the budget as a safety net. Each decision is logged, counted in metrics
+and attached to the active trace span.
+"""
+import math
+import re
+import unicodedata
+from typing import List, Optional, Tuple
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import PROMPT_BUDGET_DECISIONS, PROMPT_TRANSCRIPTION_TOKENS
+from utils.tokens import count_tokens, tokenizer_name, truncate_to_tokens
+from utils.tracing import set_span_attributes
+
+logger = setup_logger("prompt_budget")
+
+# Below this, max_tokens is never reduced further to make room for the prompt
+MIN_OUTPUT_TOKENS = 256
+# Room left for tokenizer differences between tiktoken and the provider's model
+CONTEXT_MARGIN = 200
+# Marks where sentences were left out
+GAP = " [...] "
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_WORD = re.compile(r"\w+", re.UNICODE)
+# Hesitations and stock phrases of spoken Spanish (and English) that carry no information
+_FILLER = re.compile(
+    r"(?i)(?<!\w)(?:e+h+m*|e+m+|m{2,}|u+h+m*|u+m+|a+h+|o sea|digamos|¿no\?|¿verdad\?)(?!\w)[,.]?\s*"
+)
+_LEADING_FILLER = re.compile(r"(?i)^(?:bueno|pues|entonces|well|so)\s*,\s*")
+_REPEATED_WORD = re.compile(r"(?i)\b(\w+)(?:\s+\1\b)+")
+
+_STOPWORDS = {
+    "como", "cual", "desde", "donde", "esta", "este", "esto", "estos", "hace", "hasta", "mucho", "para",
+    "pero", "porque", "pues", "sobre", "también", "tambien", "tengo", "todo", "todos", "muy", "bueno",
+    "entonces", "cuando", "that", "this", "with", "have", "from", "also", "about", "really", "there",
+}
+
+# Words that point at the facts the prompts extract (experience, education, skills, results)
+_PROFILE_HINTS = {
+    "años", "anos", "experiencia", "trabajo", "trabajé", "trabaje", "empresa", "universidad", "estudié",
+    "estudie", "ingeniero", "ingeniera", "desarrollador", "desarrolladora", "proyecto", "proyectos",
+    "certificación", "certificacion", "idiomas", "inglés", "ingles", "tecnologías", "tecnologias",
+    "lideré", "lidere", "logré", "logre", "equipo", "maestría", "maestria", "carrera", "cargo",
+    "years", "experience", "university", "degree", "project", "team", "skills", "languages",
+}
+
+# Sentences without punctuation (some transcribers emit none) are split this finely
+_MAX_SENTENCE_WORDS = 40
+
+
+def _normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+
+
+def _split_sentences(text: str) -> List[str]:
+    sentences = []
+    for sentence in _SENTENCE_END.split(text):
+        words = sentence.split()
+        for i in range(0, len(words), _MAX_SENTENCE_WORDS):
+            sentences.append(" ".join(words[i:i + _MAX_SENTENCE_WORDS]))
+    return sentences
+
+
+def _clean(sentence: str) -> str:
+    sentence = _FILLER.sub(" ", sentence)
+    sentence = _LEADING_FILLER.sub("", sentence.strip())
+    sentence = _REPEATED_WORD.sub(r"\1", sentence)
+    return " ".join(sentence.split())
+
+
+def _content_words(sentence: str) -> set:
+    return {w for w in _WORD.findall(_normalize(sentence)) if len(w) >= 4 and w not in _STOPWORDS}
+
+
+def _score(sentence: str, position: int) -> float:
+    """Information density: content words, numbers, names and profile terms per sqrt(length)"""
+    words = sentence.split()
+    if not words:
+        return 0.0
+    score = 0.0
+    for i, word in enumerate(words):
+        bare = word.strip(".,;:¿?¡!()\"'")
+        if not bare:
+            continue
+        if any(c.isdigit() for c in bare):
+            score += 2.0
+        elif i > 0 and bare[0].isupper():
+            score += 1.5  # Names, companies, technologies
+    content = _content_words(sentence)
+    score += len(content) + 1.5 * len(content & _PROFILE_HINTS)
+    # Presentations open with name and profession
+    if position < 3:
+        score *= 1.5
+    return score / math.sqrt(len(words))
+
+
+def _deduplicate(sentences: List[str]) -> Tuple[List[str], int]:
+    """Clean filler and drop repeated sentences; returns kept sentences and the number removed"""
+    seen = set()
+    kept = []
+    for sentence in sentences:
+        cleaned = _clean(sentence)
+        key = _normalize(cleaned).strip(" .,!?")
+        if not key or key in seen:
+            continue
+        seen.add(key)
+        kept.append(cleaned)
+    return kept, len(sentences) - len(kept)
+
+
+def _condense(sentences: List[str], budget: int) -> List[int]:
+    """Indexes of the most informative sentences that fit the budget, in original order"""
+    # The opening (name and profession) is always considered first
+    ranked = [0] + sorted(range(1, len(sentences)), key=lambda i: -_score(sentences[i], i))
+    selected = []
+    selected_words = []
+    used = 0
+    gap_tokens = count_tokens(GAP)
+    for i in ranked:
+        cost = count_tokens(sentences[i]) + gap_tokens
+        if used + cost > budget:
+            continue
+        words = _content_words(sentences[i])
+        # Skip restatements of something already kept
+        if words and any(words <= other for other in selected_words):
+            continue
+        selected.append(i)
+        selected_words.append(words)
+        used += cost
+    return sorted(selected)
+
+
+def _join(sentences: List[str], indexes: List[int]) -> str:
+    parts = []
+    previous = -1
+    for i in indexes:
+        if parts and i != previous + 1:
+            parts.append(GAP.strip())
+        parts.append(sentences[i])
+        previous = i
+    if indexes and indexes[-1] != len(sentences) - 1:
+        parts.append(GAP.strip())
+    return " ".join(parts)
+
+
+def fit_transcription(task: str, text: str) -> str:
+    """
+    Fit a transcription to the task's token budget (PROMPT_TRANSCRIPTION_BUDGETS)
+
+    Args:
+        task: Routing task name (profile_extraction or cv_generation)
+        text: Full transcription
+
+    Returns:
+        The transcription, unchanged when it already fits
+    """
+    budget = Config.PROMPT_TRANSCRIPTION_BUDGETS.get(task)
+    if not Config.PROMPT_BUDGET_ENABLED or not budget or not text:
+        return text
+
+    original_tokens = count_tokens(text)
+    PROMPT_TRANSCRIPTION_TOKENS.labels(task).observe(original_tokens)
+    if original_tokens <= budget:
+        PROMPT_BUDGET_DECISIONS.labels(task, "unchanged").inc()
+        return text
+
+    sentences = _split_sentences(text)
+    cleaned, duplicates = _deduplicate(sentences)
+    result = " ".join(cleaned)
+    action = "deduplicated"
+    kept = len(cleaned)
+
+    if count_tokens(result) > budget:
+        # Token counts of the parts do not add up exactly to the count of the joined text,
+        # so the least informative sentences are dropped until the whole fits
+        indexes = _condense(cleaned, int(budget * 0.97))
+        result = _join(cleaned, indexes)
+        by_score = sorted(indexes[1:], key=lambda i: _score(cleaned[i], i))
+        while by_score and count_tokens(result) > budget:
+            indexes.remove(by_score.pop(0))
+            result = _join(cleaned, indexes)
+        action = "condensed"
+        kept = len(indexes)
+
+    if not result or count_tokens(result) > budget:
+        result = truncate_to_tokens(result or text, budget)
+        action = "truncated"
+
+    final_tokens = count_tokens(result)
+    decision = {
+        "task": task,
+        "action": action,
+        "tokenizer": tokenizer_name(),
+        "budget": budget,
+        "original_tokens": original_tokens,
+        "final_tokens": final_tokens,
+        "sentences": len(sentences),
+        "sentences_kept": kept,
+        "duplicates_removed": duplicates,
+    }
+    PROMPT_BUDGET_DECISIONS.labels(task, action).inc()
+    set_span_attributes(**{f"budget_{key}": value for key, value in decision.items() if key != "task"})
+    logger.info("Transcription fitted to prompt budget", extra=decision)
+    return result
+
+
+def context_tokens(provider: Optional[str] = None, model: Optional[str] = None) -> int:
+    """Context window of a model ("provider:model" entries take precedence over "provider" ones)"""
+    windows = Config.MODEL_CONTEXT_TOKENS
+    if provider and model and f"{provider}:{model}" in windows:
+        return int(windows[f"{provider}:{model}"])
+    return int(windows.get(provider, Config.MODEL_CONTEXT_TOKENS_DEFAULT))
+
+
+def output_budget(task: str, prompt: str, default: int, source_text: Optional[str] = None,
+                  provider: Optional[str] = None, model: Optional[str] = None) -> int:
+    """
+    max_tokens for a call
+
+    Scales with the transcription for tasks in OUTPUT_TOKEN_SCALING (a short
+    presentation does not need a long answer reserved), never exceeds the
+    call's default, and leaves room for the prompt within the model's context
+    window (MODEL_CONTEXT_TOKENS).
+    """
+    if not Config.PROMPT_BUDGET_ENABLED:
+        return default
+
+    max_tokens = default
+    scaling = Config.OUTPUT_TOKEN_SCALING.get(task)
+    if scaling is not None and source_text is not None:
+        minimum, ratio = scaling
+        max_tokens = min(max_tokens, max(minimum, int(count_tokens(source_text) * ratio)))
+
+    prompt_tokens = count_tokens(prompt)
+    available = context_tokens(provider, model) - prompt_tokens - CONTEXT_MARGIN
+    max_tokens = max(MIN_OUTPUT_TOKENS, min(max_tokens, available))
+    set_span_attributes(prompt_tokens_estimate=prompt_tokens, max_tokens=max_tokens)
+    return max_tokens
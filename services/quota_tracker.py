@@ -0,0 +1,300 @@
+"""
+Provider quota accounting
+
+Counts requests, tokens and audio seconds per provider and model from the
+usage each call reports, compares them with the configured per-minute,
+per-hour and per-day limits (PROVIDER_QUOTAS), and forecasts when daily
+quotas run out at the current rate. Daily counters are flushed to MongoDB
+with $inc, so they survive restarts and add up across workers.
+"""
+import os
+import threading
+import time
+import wave
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+from config import Config
+from database import MongoDBClient
+from utils.logger import setup_logger
+from utils.metrics import PROVIDER_USAGE
+
+logger = setup_logger("quota_tracker")
+
+UNITS = ("requests", "tokens", "audio_seconds")
+WINDOW_SECONDS = {"minute": 60, "hour": 3600}
+
+# Extracted audio is 16 kHz mono 16-bit PCM
+_WAV_BYTES_PER_SECOND = 32000
+
+
+def audio_duration(audio_path: str) -> float:
+    """Duration of a WAV file in seconds, estimated from its size if the header is unreadable"""
+    try:
+        with wave.open(audio_path, "rb") as wav:
+            return wav.getnframes() / float(wav.getframerate())
+    except (wave.Error, EOFError, OSError):
+        try:
+            return os.path.getsize(audio_path) / _WAV_BYTES_PER_SECOND
+        except OSError:
+            return 0.0
+
+
+def _today() -> str:
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d")
+
+
+def _seconds_until_midnight() -> float:
+    now = datetime.now(timezone.utc)
+    midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (midnight - now).total_seconds()
+
+
+class _Usage:
+    """Counters of one provider and model"""
+
+    def __init__(self):
+        self.minutes: Dict[int, list] = {}  # minute number -> [requests, tokens, audio_seconds]
+        self.day = _today()
+        self.persisted = [0, 0, 0.0]  # Day totals stored in MongoDB (all workers)
+        self.pending = [0, 0, 0.0]  # Recorded here and not flushed yet
+
+    def roll(self, now: float):
+        """Drop minute buckets older than an hour and reset the day at UTC midnight"""
+        oldest = int(now // 60) - 59
+        for minute in [m for m in self.minutes if m < oldest]:
+            del self.minutes[minute]
+        today = _today()
+        if today != self.day:
+            self.day = today
+            self.persisted = [0, 0, 0.0]
+            self.pending = [0, 0, 0.0]
+
+    def window(self, seconds: int, now: float) -> list:
+        first = int(now // 60) - seconds // 60 + 1
+        totals = [0, 0, 0.0]
+        for minute, values in self.minutes.items():
+            if minute >= first:
+                for i, value in enumerate(values):
+                    totals[i] += value
+        return totals
+
+    def day_totals(self) -> list:
+        return [p + q for p, q in zip(self.persisted, self.pending)]
+
+
+class QuotaTracker:
+    """
+    Usage against provider quotas, consulted by AILoadBalancer before each call
+
+    Limits are looked up for "provider:model" first, then "provider"; a
+    provider without limits always has headroom. Low priority work must leave
+    QUOTA_LOW_PRIORITY_RESERVE of every limit free, so it is deferred before
+    it can crowd out requests users are waiting for.
+    """
+
+    COLLECTION = "provider_usage"
+
+    def __init__(self, limits: Optional[dict] = None):
+        self.limits = Config.PROVIDER_QUOTAS if limits is None else limits
+        self._usage: Dict[tuple, _Usage] = {}
+        self._cooldowns: Dict[str, float] = {}  # provider -> time.time() until which it is rate limited
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._flush_thread = None
+        self._indexes_created = False
+
+    def start(self):
+        """Load today's counters when MongoDB is reachable and start the periodic flush"""
+        if self._flush_thread is not None:
+            return
+        db_client = MongoDBClient()
+        if db_client.client is not None:
+            db_client.add_listener(on_connect=self.flush)
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="quota-flush", daemon=True)
+        self._flush_thread.start()
+
+    def _get(self, provider: str, model: Optional[str]) -> _Usage:
+        key = (provider, model or "")
+        usage = self._usage.get(key)
+        if usage is None:
+            usage = self._usage[key] = _Usage()
+        return usage
+
+    def limits_for(self, provider: str, model: Optional[str] = None) -> dict:
+        if model and f"{provider}:{model}" in self.limits:
+            return self.limits[f"{provider}:{model}"]
+        return self.limits.get(provider, {})
+
+    def record(self, provider: str, model: Optional[str], requests: int = 1, tokens: int = 0, audio_seconds: float = 0.0):
+        """Add the usage of one call"""
+        now = time.time()
+        with self._lock:
+            usage = self._get(provider, model)
+            usage.roll(now)
+            bucket = usage.minutes.setdefault(int(now // 60), [0, 0, 0.0])
+            for i, value in enumerate((requests, tokens, audio_seconds)):
+                bucket[i] += value
+                usage.pending[i] += value
+        model_label = model or "default"
+        if tokens:
+            PROVIDER_USAGE.labels(provider, model_label, "tokens").inc(tokens)
+        if audio_seconds:
+            PROVIDER_USAGE.labels(provider, model_label, "audio_seconds").inc(audio_seconds)
+        PROVIDER_USAGE.labels(provider, model_label, "requests").inc(requests)
+
+    def mark_rate_limited(self, provider: str, seconds: Optional[float] = None):
+        """A provider answered 429: treat it as exhausted for a while"""
+        until = time.time() + (Config.QUOTA_RATE_LIMIT_COOLDOWN if seconds is None else seconds)
+        with self._lock:
+            self._cooldowns[provider] = max(self._cooldowns.get(provider, 0.0), until)
+
+    def _used(self, usage: _Usage, window: str, now: float) -> list:
+        if window == "day":
+            return usage.day_totals()
+        return usage.window(WINDOW_SECONDS[window], now)
+
+    def _blocking_windows(self, provider: str, model: Optional[str], expected: tuple, priority: str) -> list:
+        """Windows whose limit the expected usage would exceed, plus "cooldown" after a 429"""
+        now = time.time()
+        limits = self.limits_for(provider, model)
+        share = 1.0 - Config.QUOTA_LOW_PRIORITY_RESERVE if priority == "low" else 1.0
+        blocked = []
+        with self._lock:
+            if self._cooldowns.get(provider, 0.0) > now:
+                blocked.append("cooldown")
+            usage = self._get(provider, model)
+            usage.roll(now)
+            for name, limit in limits.items():
+                unit, _, window = name.partition("_per_")
+                if unit not in UNITS or (window != "day" and window not in WINDOW_SECONDS) or not limit:
+                    continue
+                used = self._used(usage, window, now)[UNITS.index(unit)]
+                if used + expected[UNITS.index(unit)] > limit * share:
+                    blocked.append(window)
+        return blocked
+
+    def has_headroom(
+        self,
+        provider: str,
+        model: Optional[str] = None,
+        tokens: int = 0,
+        audio_seconds: float = 0.0,
+        priority: str = "normal"
+    ) -> bool:
+        """Whether one more call of this size fits every limit of the provider and model"""
+        return not self._blocking_windows(provider, model, (1, tokens, audio_seconds), priority)
+
+    def seconds_until_headroom(
+        self,
+        provider: str,
+        model: Optional[str] = None,
+        tokens: int = 0,
+        audio_seconds: float = 0.0,
+        priority: str = "normal"
+    ) -> float:
+        """Upper bound on the wait before the blocking windows have rolled over"""
+        now = time.time()
+        waits = []
+        for window in self._blocking_windows(provider, model, (1, tokens, audio_seconds), priority):
+            if window == "cooldown":
+                waits.append(self._cooldowns.get(provider, now) - now)
+            elif window in WINDOW_SECONDS:
+                # Minute buckets age out one at a time, so re-check at the next minute
+                waits.append(60 - now % 60)
+            else:
+                waits.append(_seconds_until_midnight())
+        return max(waits) if waits else 0.0
+
+    def snapshot(self) -> dict:
+        """Usage, limits and daily exhaustion forecast per provider and model"""
+        now = time.time()
+        reset_in = _seconds_until_midnight()
+        result = {}
+        with self._lock:
+            for (provider, model), usage in sorted(self._usage.items()):
+                usage.roll(now)
+                limits = self.limits_for(provider, model)
+                hour = usage.window(3600, now)
+                entry = {
+                    "minute": dict(zip(UNITS, usage.window(60, now))),
+                    "hour": dict(zip(UNITS, hour)),
+                    "day": dict(zip(UNITS, usage.day_totals())),
+                    "limits": limits,
+                    "rate_limited_for": max(0.0, round(self._cooldowns.get(provider, 0.0) - now, 1)),
+                    "forecast": {},
+                }
+                for name, limit in limits.items():
+                    unit, _, window = name.partition("_per_")
+                    if window != "day" or unit not in UNITS or not limit:
+                        continue
+                    # Last hour's rate, extrapolated to the UTC day reset
+                    remaining = limit - entry["day"][unit]
+                    rate = hour[UNITS.index(unit)] / 3600
+                    exhausted_in = max(0.0, remaining / rate) if rate > 0 else None
+                    entry["forecast"][name] = {
+                        "remaining": round(remaining, 1),
+                        "exhausted_in_seconds": round(exhausted_in) if exhausted_in is not None else None,
+                        "exhausted_before_reset": exhausted_in is not None and exhausted_in < reset_in,
+                    }
+                for field in ("minute", "hour", "day"):
+                    entry[field]["audio_seconds"] = round(entry[field]["audio_seconds"], 1)
+                result.setdefault(provider, {})[model or "default"] = entry
+        return {"resets_in_seconds": round(reset_in), "providers": result}
+
+    def _flush_loop(self):
+        while not self._stop_event.wait(Config.QUOTA_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        """Add pending counters to today's documents and read back every worker's totals"""
+        db_client = MongoDBClient()
+        if not db_client.is_connected():
+            return
+        collection = db_client.database[self.COLLECTION]
+
+        with self._lock:
+            day = _today()
+            flushed = {key: list(usage.pending) for key, usage in self._usage.items()
+                       if usage.day == day and any(usage.pending)}
+
+        operations = [
+            UpdateOne(
+                {"_id": f"{day}|{provider}|{model}"},
+                {
+                    "$inc": dict(zip(UNITS, values)),
+                    "$set": {"updated_at": datetime.now(timezone.utc)},
+                    "$setOnInsert": {"date": day, "provider": provider, "model": model},
+                },
+                upsert=True
+            )
+            for (provider, model), values in flushed.items()
+        ]
+        try:
+            if not self._indexes_created:
+                collection.create_index("date")
+                collection.create_index("updated_at", expireAfterSeconds=Config.QUOTA_RETENTION_DAYS * 86400)
+                self._indexes_created = True
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            documents = list(collection.find({"date": day}))
+        except PyMongoError as e:
+            db_client.report_failure(e)
+            logger.warning(f"Could not persist provider usage: {e}")
+            return
+
+        with self._lock:
+            for key, values in flushed.items():
+                usage = self._usage.get(key)
+                if usage is not None and usage.day == day:
+                    usage.pending = [p - f for p, f in zip(usage.pending, values)]
+            for document in documents:
+                usage = self._get(document["provider"], document["model"])
+                if usage.day == day:
+                    usage.persisted = [document.get(unit, 0) for unit in UNITS]
+
+    def close(self):
+        """Stop the flush thread after a last flush"""
+        self._stop_event.set()
+        self.flush()
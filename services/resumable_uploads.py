@@ -0,0 +1,363 @@
+"""
+Resumable uploads
+
+Large videos are sent in chunks with offset based PATCH requests (header
+names follow tus: Upload-Offset, Upload-Length, Upload-Checksum). Chunks
+are written in place into one file in the scratch area, so the completed
+upload is processed where it lies, without re-copying. A chunk only counts
+once its checksum matches; a failed or interrupted chunk is cut off again
+and the client resumes from the current offset.
+
+Videos FFmpeg can read front to back (WebM, Matroska, MP4 with the index
+first) are piped to FFmpeg as verified chunks arrive, so the audio is ready
+moments after the last chunk; the rest are extracted from the complete file.
+"""
+import asyncio
+import base64
+import binascii
+import hashlib
+import json
+import os
+import re
+import subprocess
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, Optional, Tuple
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import UPLOAD_BYTES, UPLOAD_CHUNKS, UPLOAD_EXTRACTIONS
+from .video_processor import VideoProcessor
+
+try:
+    import fcntl
+except ImportError:  # Windows: chunks are only serialized within a process
+    fcntl = None
+
+logger = setup_logger("resumable_uploads")
+
+CHECKSUM_ALGORITHMS = ("sha256", "sha1", "md5")
+# HTTP status tus uses for a chunk whose checksum does not match
+CHECKSUM_MISMATCH = 460
+
+_UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+class UploadError(Exception):
+    """A request the upload cannot accept, with the HTTP status and the upload's current offset"""
+
+    def __init__(self, status_code: int, message: str, offset: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.offset = offset
+
+
+def parse_checksum(header: Optional[str]) -> Optional[Tuple[str, bytes]]:
+    """(algorithm, digest) of an Upload-Checksum header ("sha256 <base64 digest>")"""
+    if not header:
+        if Config.UPLOAD_REQUIRE_CHECKSUM:
+            raise UploadError(400, "Upload-Checksum header required, e.g. 'sha256 <base64 digest>'")
+        return None
+    algorithm, _, encoded = header.strip().partition(" ")
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS:
+        raise UploadError(400, f"Unsupported checksum algorithm, use one of: {', '.join(CHECKSUM_ALGORITHMS)}")
+    try:
+        return algorithm, base64.b64decode(encoded.strip(), validate=True)
+    except (binascii.Error, ValueError):
+        raise UploadError(400, "Upload-Checksum digest must be base64")
+
+
+class _Extraction:
+    """FFmpeg reading an upload from stdin while it arrives"""
+
+    def __init__(self, process: subprocess.Popen, audio_path: str):
+        self.process = process
+        self.audio_path = audio_path
+        self.fed = 0  # Bytes written to FFmpeg so far
+        self.fed_at = time.monotonic()
+
+    def feed(self, data: bytes) -> bool:
+        try:
+            self.process.stdin.write(data)
+            self.process.stdin.flush()
+        except (BrokenPipeError, OSError):
+            return False
+        self.fed += len(data)
+        self.fed_at = time.monotonic()
+        return True
+
+    def abort(self):
+        try:
+            self.process.kill()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            pass
+        VideoProcessor.cleanup(None, self.audio_path)
+
+
+async def _write(f, data: bytes):
+    """Write on a worker thread; a cancelled request still waits for the write, so it cannot land after the cut-off"""
+    write = asyncio.ensure_future(asyncio.to_thread(f.write, data))
+    try:
+        await asyncio.shield(write)
+    except asyncio.CancelledError:
+        await write
+        raise
+
+
+class ResumableUploadStore:
+    """
+    Upload state in the scratch area: <id>.video (the chunks so far) and <id>.json
+
+    The size of the video file is the offset, so the state survives restarts
+    and is shared by the workers of a host. A chunk holds an exclusive flock
+    on the video file while it is written, so two workers cannot write at
+    the same offset (without fcntl, on Windows, run a single worker). Early
+    extractions live in the
+    process that received the first chunk; when a later chunk lands on
+    another worker, the complete file is extracted instead.
+    """
+
+    def __init__(self, video_processor: VideoProcessor, directory: Optional[str] = None):
+        self.video_processor = video_processor
+        self.directory = directory or Config.UPLOAD_SCRATCH_DIR
+        os.makedirs(self.directory, exist_ok=True)
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._extractions: Dict[str, _Extraction] = {}
+
+    def _path(self, upload_id: str, extension: str) -> str:
+        return os.path.join(self.directory, f"{upload_id}.{extension}")
+
+    def _load(self, upload_id: str) -> dict:
+        if not _UPLOAD_ID.match(upload_id or ""):
+            raise UploadError(404, "Upload not found")
+        try:
+            with open(self._path(upload_id, "json"), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise UploadError(404, "Upload not found")
+
+    def _save(self, info: dict):
+        path = self._path(info["upload_id"], "json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _offset(self, upload_id: str) -> int:
+        try:
+            return os.path.getsize(self._path(upload_id, "video"))
+        except OSError:
+            return 0
+
+    def _claim(self, upload_id: str, offset: int):
+        """
+        Open the video to write a chunk at `offset` (blocking)
+
+        The offset is checked against the file size while the flock is held,
+        so it cannot change until the returned (unbuffered) file is closed.
+        """
+        f = open(self._path(upload_id, "video"), "r+b", buffering=0)
+        try:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    raise UploadError(409, "Another chunk of this upload is being written", self._offset(upload_id))
+            current = os.fstat(f.fileno()).st_size
+            if offset != current:
+                UPLOAD_CHUNKS.labels("offset_mismatch").inc()
+                raise UploadError(409, f"Upload-Offset {offset} does not match the current offset {current}", current)
+            f.seek(offset)
+        except BaseException:
+            f.close()
+            raise
+        return f
+
+    def create(self, filename: Optional[str], size: int, tenant: Optional[str] = None) -> dict:
+        """Register an upload of `size` bytes for a tenant"""
+        if size <= 0 or size > Config.UPLOAD_MAX_SIZE_MB * 1024 * 1024:
+            raise UploadError(413, f"Upload size must be between 1 byte and {Config.UPLOAD_MAX_SIZE_MB} MB")
+        self.sweep()
+        info = {
+            "upload_id": uuid.uuid4().hex,
+            "filename": filename,
+            "size": size,
+            "status": "uploading",
+            "tenant": tenant,
+            "created_at": time.time(),
+        }
+        open(self._path(info["upload_id"], "video"), "wb").close()
+        self._save(info)
+        return self.status(info["upload_id"])
+
+    def status(self, upload_id: str, tenant: Optional[str] = None) -> dict:
+        """Upload state for clients; includes the result once processing is done"""
+        info = self._load(upload_id)
+        if tenant is not None and info.get("tenant") not in (None, tenant):
+            raise UploadError(404, "Upload not found")  # Another tenant's upload
+        offset = info["size"] if info["status"] != "uploading" else self._offset(upload_id)
+        expires_at = datetime.fromtimestamp(info["created_at"] + Config.UPLOAD_EXPIRY_HOURS * 3600, timezone.utc)
+        return {
+            **{key: value for key, value in info.items() if key != "created_at"},
+            "offset": offset,
+            "max_chunk_bytes": Config.UPLOAD_MAX_CHUNK_MB * 1024 * 1024,
+            "expires_at": expires_at.isoformat(),
+        }
+
+    async def write_chunk(
+        self,
+        upload_id: str,
+        offset: int,
+        checksum: Optional[str],
+        body: AsyncIterator[bytes]
+    ) -> dict:
+        """
+        Append a chunk at `offset`, which must be the upload's current offset
+
+        Returns:
+            The new status; "processing" once the last chunk has landed
+        """
+        info = self._load(upload_id)
+        if info["status"] != "uploading":
+            raise UploadError(409, "Upload already complete", info["size"])
+        expected = parse_checksum(checksum)
+        lock = self._locks.setdefault(upload_id, asyncio.Lock())
+        if lock.locked():
+            raise UploadError(409, "Another chunk of this upload is being written", self._offset(upload_id))
+
+        async with lock:
+            limit = min(Config.UPLOAD_MAX_CHUNK_MB * 1024 * 1024, info["size"] - offset)
+            digest = hashlib.new(expected[0]) if expected else None
+            # Kept only when an early extraction may take the chunk once it is verified
+            pieces = [] if upload_id in self._extractions or (offset == 0 and Config.UPLOAD_EARLY_EXTRACTION) else None
+            written = 0
+            # File I/O runs on worker threads; closing the file releases the flock
+            with await asyncio.to_thread(self._claim, upload_id, offset) as f:
+                try:
+                    async for piece in body:
+                        written += len(piece)
+                        if written > limit:
+                            UPLOAD_CHUNKS.labels("too_large").inc()
+                            raise UploadError(413, f"Chunk exceeds {limit} bytes (chunk size or remaining upload)", offset)
+                        await _write(f, piece)
+                        if pieces is not None:
+                            pieces.append(piece)
+                        if digest is not None:
+                            digest.update(piece)
+                    if digest is not None and digest.digest() != expected[1]:
+                        UPLOAD_CHUNKS.labels("checksum_mismatch").inc()
+                        raise UploadError(CHECKSUM_MISMATCH, "Checksum mismatch", offset)
+                except BaseException as e:
+                    # Unverified bytes (including a connection dropped mid-chunk) never count. Cut off
+                    # under the flock, and on the loop because a cancelled request may not get to await again
+                    os.ftruncate(f.fileno(), offset)
+                    if not isinstance(e, UploadError):
+                        UPLOAD_CHUNKS.labels("interrupted").inc()
+                    raise
+
+            UPLOAD_CHUNKS.labels("ok").inc()
+            UPLOAD_BYTES.inc(written)
+            if pieces is not None:
+                await self._feed(upload_id, offset, b"".join(pieces))
+
+            new_offset = offset + written
+            if new_offset == info["size"]:
+                info["status"] = "processing"
+                await asyncio.to_thread(self._save, info)
+                self._locks.pop(upload_id, None)
+            return {"upload_id": upload_id, "offset": new_offset, "status": info["status"]}
+
+    async def _feed(self, upload_id: str, offset: int, data: bytes):
+        """Pass a verified chunk to this upload's early extraction, starting it on the first chunk"""
+        extraction = self._extractions.get(upload_id)
+        if extraction is None:
+            if offset != 0 or not Config.UPLOAD_EARLY_EXTRACTION or not VideoProcessor.is_streamable(data):
+                return
+            extraction = _Extraction(*self.video_processor.start_stream_extraction())
+            self._extractions[upload_id] = extraction
+        if extraction.fed != offset:
+            return  # A chunk was received by another worker; the complete file is extracted instead
+
+        # Writing blocks while FFmpeg catches up, so it runs off the event loop
+        if not await asyncio.get_running_loop().run_in_executor(None, extraction.feed, data):
+            logger.info("Early audio extraction stopped", extra={"upload_id": upload_id})
+            self._extractions.pop(upload_id, None)
+            extraction.abort()
+
+    def extract_audio(self, upload_id: str) -> Tuple[str, float]:
+        """
+        Audio of a completed upload (blocking)
+
+        Returns:
+            (audio_path, audio_seconds); the caller deletes audio_path
+        """
+        info = self._load(upload_id)
+        extraction = self._extractions.pop(upload_id, None)
+        if extraction is not None:
+            if extraction.fed == info["size"]:
+                try:
+                    extraction.process.stdin.close()
+                    returncode = extraction.process.wait(timeout=Config.UPLOAD_EXTRACTION_TIMEOUT)
+                except (OSError, subprocess.TimeoutExpired):
+                    returncode = None
+                seconds = VideoProcessor.audio_duration(extraction.audio_path)
+                if returncode == 0 and seconds > 0:
+                    UPLOAD_EXTRACTIONS.labels("early").inc()
+                    return extraction.audio_path, seconds
+                logger.info("Early audio extraction failed, extracting from the complete file",
+                            extra={"upload_id": upload_id, "returncode": returncode})
+            extraction.abort()
+
+        UPLOAD_EXTRACTIONS.labels("complete").inc()
+        return self.video_processor.extract_audio(self._path(upload_id, "video"))
+
+    def finish(self, upload_id: str, result: Optional[dict] = None, error: Optional[str] = None):
+        """Record the processing outcome and delete the video; the status is kept until the upload expires"""
+        info = self._load(upload_id)
+        info["status"] = "failed" if error else "done"
+        if error:
+            info["error"] = error
+        else:
+            info["result"] = result
+        self._save(info)
+        VideoProcessor.cleanup(self._path(upload_id, "video"), None)
+
+    def delete(self, upload_id: str):
+        info = self._load(upload_id)
+        extraction = self._extractions.pop(info["upload_id"], None)
+        if extraction is not None:
+            extraction.abort()
+        self._locks.pop(upload_id, None)
+        VideoProcessor.cleanup(self._path(upload_id, "video"), self._path(upload_id, "json"))
+
+    def abort_idle_extractions(self):
+        """Stop early extractions of uploads that got no chunk for UPLOAD_EXTRACTION_IDLE_SECONDS"""
+        cutoff = time.monotonic() - Config.UPLOAD_EXTRACTION_IDLE_SECONDS
+        for upload_id, extraction in list(self._extractions.items()):
+            lock = self._locks.get(upload_id)
+            if extraction.fed_at >= cutoff or (lock is not None and lock.locked()):
+                continue
+            # If the client comes back, the complete file is extracted instead
+            logger.info("Stopping idle early audio extraction", extra={"upload_id": upload_id})
+            self._extractions.pop(upload_id, None)
+            extraction.abort()
+
+    def sweep(self):
+        """Delete uploads older than UPLOAD_EXPIRY_HOURS, finished or not, and stop idle early extractions"""
+        self.abort_idle_extractions()
+        expiry = Config.UPLOAD_EXPIRY_HOURS * 3600
+        cutoff = time.time() - expiry
+        for name in os.listdir(self.directory):
+            upload_id, extension = os.path.splitext(name)
+            if extension != ".json" or not _UPLOAD_ID.match(upload_id):
+                continue
+            try:
+                info = self._load(upload_id)
+            except UploadError:
+                continue
+            # One more period for uploads still processing, in case their worker died
+            grace = expiry if info["status"] == "processing" else 0
+            if info["created_at"] < cutoff - grace:
+                logger.info("Deleting expired upload", extra={"upload_id": upload_id, "status": info["status"]})
+                self.delete(upload_id)
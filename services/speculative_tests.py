@@ -0,0 +1,164 @@
+"""
+Speculative technical test generation
+
+Companies usually request a technical test with exactly the profile that
+/upload-video extracted. Once extraction succeeds, the test is generated in
+the background at low priority (only with quota headroom to spare, see
+QuotaTracker) and stored, so the later request is answered from storage.
+Stored tests are keyed by tenant, so a tenant is only served its own.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Optional
+from config import Config
+from database import TechnicalTestRepository
+from database.technical_test_repository import TEST_PROFILE_FIELDS, technical_test_key
+from utils.logger import setup_logger, log_context, get_request_id
+from utils.metrics import SPECULATIVE_TESTS, track_executor
+from utils.tokens import count_tokens
+from utils.tracing import start_span
+
+logger = setup_logger("speculative_tests")
+
+SOURCE = "speculative"
+PROMPT_NAME = "technical_test_generation"
+# A request for a test that is still being generated waits this long for it before generating its own
+JOIN_TIMEOUT = 45
+
+
+class SpeculativeTestGenerator:
+    """
+    Pre-generates technical tests after profile extraction, within a daily budget
+
+    The budget caps both the number of speculative tests per UTC day and
+    their estimated tokens. Outcomes (generated, used, skipped, failed) are
+    counted so the used fraction shows whether the speculation pays off.
+    """
+
+    def __init__(self, load_balancer, repository: TechnicalTestRepository, prompt_repository):
+        self.load_balancer = load_balancer
+        self.repository = repository
+        self.prompt_repository = prompt_repository
+        # Separate from the request executor: low priority calls may wait for quota headroom
+        self.executor = ThreadPoolExecutor(max_workers=Config.SPECULATIVE_TESTS_WORKERS, thread_name_prefix="speculative")
+        track_executor("speculative", self.executor)
+        self._tasks = set()
+        self._in_flight = {}  # key -> future of the test being generated
+        self._day = None
+        self._spent = {"tests": 0, "tokens": 0}
+        self.counters = {outcome: 0 for outcome in ("generated", "used", "exists", "budget", "queue_full", "failed")}
+
+    def _count(self, outcome: str):
+        self.counters[outcome] += 1
+        SPECULATIVE_TESTS.labels(outcome).inc()
+
+    def _reset_budget_if_new_day(self):
+        today = datetime.now(timezone.utc).date()
+        if today != self._day:
+            self._day = today
+            self._spent = {"tests": 0, "tokens": 0}
+
+    def _within_budget(self) -> bool:
+        self._reset_budget_if_new_day()
+        return (
+            self._spent["tests"] < Config.SPECULATIVE_TESTS_DAILY_LIMIT
+            and self._spent["tokens"] < Config.SPECULATIVE_TESTS_DAILY_TOKENS
+        )
+
+    async def _key(self, profile_data: dict, tenant: Optional[str]):
+        version = await self.prompt_repository.get_prompt_version(PROMPT_NAME)
+        return technical_test_key(profile_data, version, tenant), version
+
+    def schedule(self, profile_data: dict, tenant: Optional[str] = None):
+        """Start generating the test for a tenant's extracted profile; returns immediately"""
+        if not profile_data.get("profession") or not profile_data.get("technologies"):
+            return
+        profile = {field: profile_data.get(field) for field in TEST_PROFILE_FIELDS}
+        # A fresh context: the work outlives the request, so it gets its own trace
+        context = contextvars.Context()
+        task = asyncio.create_task(self._run(profile, tenant, get_request_id()), context=context)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, profile_data: dict, tenant: Optional[str], origin_request_id: Optional[str]):
+        with log_context(request_id=origin_request_id, stage="speculative_test"), \
+                start_span("speculative_test", origin_request_id=origin_request_id) as span:
+            key, version = await self._key(profile_data, tenant)
+            # Checked after the lookup, with no await until the key is registered below
+            if await self.repository.get(key) is not None or key in self._in_flight:
+                self._count("exists")
+                span.set_attributes(outcome="exists")
+                return
+            if not self._within_budget():
+                self._count("budget")
+                span.set_attributes(outcome="budget")
+                return
+            if len(self._in_flight) >= Config.SPECULATIVE_TESTS_MAX_PENDING:
+                self._count("queue_full")
+                span.set_attributes(outcome="queue_full")
+                return
+
+            # Reserve the test before generating so concurrent uploads cannot overshoot the budget
+            self._spent["tests"] += 1
+            pending = asyncio.get_running_loop().create_future()
+            self._in_flight[key] = pending
+            technical_test = None
+            try:
+                ctx = contextvars.copy_context()
+                call = functools.partial(self.load_balancer.generate_technical_test, profile_data, priority="low")
+                technical_test = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(ctx.run, call)
+                )
+                # Estimate: profile and prompt template in, test out
+                self._spent["tokens"] += count_tokens(technical_test) + count_tokens(json.dumps(profile_data)) + 500
+                await self.repository.save(key, technical_test, profile_data, version, SOURCE, tenant=tenant)
+                self._count("generated")
+                span.set_attributes(outcome="generated")
+            except Exception as e:
+                self._count("failed")
+                span.set_attributes(outcome="failed")
+                logger.warning(f"Speculative technical test failed: {e}")
+            finally:
+                pending.set_result(technical_test)
+                del self._in_flight[key]
+
+    async def lookup(self, profile_data: dict, tenant: Optional[str] = None) -> Optional[str]:
+        """Stored test of the tenant for this profile and the current prompt version, or None"""
+        key, _ = await self._key(profile_data, tenant)
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), timeout=JOIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                return None
+        
+        document = await self.repository.get(key)
+        if document is None:
+            return None
+        if document.get("source") == SOURCE and await self.repository.mark_used(key):
+            self._count("used")
+        return document["technical_test"]
+
+    async def stats(self) -> dict:
+        """Budget use and outcome counts; used_fraction covers every worker when MongoDB is available"""
+        self._reset_budget_if_new_day()
+        stored = await self.repository.usage(SOURCE)
+        if stored is not None:
+            generated, used = stored["stored"], stored["used"]
+        else:
+            generated, used = self.counters["generated"], self.counters["used"]
+        return {
+            "budget": {
+                "tests": {"used": self._spent["tests"], "limit": Config.SPECULATIVE_TESTS_DAILY_LIMIT},
+                "tokens": {"used": self._spent["tokens"], "limit": Config.SPECULATIVE_TESTS_DAILY_TOKENS},
+            },
+            "outcomes": dict(self.counters),
+            "in_flight": len(self._in_flight),
+            "stored": generated,
+            "used": used,
+            "used_fraction": round(used / generated, 3) if generated else None,
+        }
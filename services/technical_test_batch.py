@@ -0,0 +1,152 @@
+"""
+Batch technical test generation
+
+Identical profiles (see canonical_profile) are generated once, the unique
+ones are spread round-robin over the providers with quota headroom, and
+each result is yielded as soon as it completes. A failed or invalid item
+only produces an error result for that item.
+"""
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import AsyncIterator, Awaitable, Callable, List, Optional
+from config import Config
+from database.technical_test_repository import technical_test_key
+from utils.logger import setup_logger, Timer
+from utils.metrics import BATCH_ITEMS, track_executor, track_stage
+from utils.tracing import start_span
+
+logger = setup_logger("technical_test_batch")
+
+REQUIRED_FIELDS = ("profession", "technologies")
+
+
+def missing_fields(profile_data: dict) -> List[str]:
+    """Required technical test fields absent from a profile"""
+    return [field for field in REQUIRED_FIELDS if field not in profile_data]
+
+
+def profile_summary(profile_data: dict) -> dict:
+    return {
+        "profession": profile_data.get("profession"),
+        "technologies": profile_data.get("technologies"),
+        "experience": profile_data.get("experience", "Not specified")
+    }
+
+
+class TechnicalTestBatchRunner:
+    """
+    Runs technical test batches with at most TECHNICAL_TEST_BATCH_CONCURRENCY calls in flight
+
+    The calls run on their own executor so a large batch cannot occupy the
+    threads /upload-video and single test requests use.
+    """
+
+    def __init__(
+        self,
+        load_balancer,
+        lookup: Optional[Callable[[dict, Optional[str]], Awaitable[Optional[str]]]] = None,
+        ai_queue=None
+    ):
+        """
+        Args:
+            load_balancer: AILoadBalancer
+            lookup: Optional coroutine returning a tenant's stored test for a profile (speculative tests)
+            ai_queue: Optional FairQueue each provider call waits its turn in, shared with other requests
+        """
+        self.load_balancer = load_balancer
+        self.lookup = lookup
+        self.ai_queue = ai_queue
+        self.executor = ThreadPoolExecutor(
+            max_workers=Config.TECHNICAL_TEST_BATCH_CONCURRENCY, thread_name_prefix="batch"
+        )
+        track_executor("batch", self.executor)
+
+    async def _generate(self, profile_data: dict, provider: str, tenant: Optional[str]) -> dict:
+        with track_stage("technical_test"), start_span("technical_test_batch.item", preferred_provider=provider):
+            if self.lookup is not None:
+                technical_test = await self.lookup(profile_data, tenant)
+                if technical_test is not None:
+                    return {"technical_test_markdown": technical_test, "precomputed": True}
+
+            ctx = contextvars.copy_context()
+            call = functools.partial(self.load_balancer.generate_technical_test, profile_data, preferred=provider)
+            async with self.ai_queue.slot() if self.ai_queue else nullcontext():
+                technical_test = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, functools.partial(ctx.run, call)
+                )
+            return {"technical_test_markdown": technical_test, "precomputed": False}
+
+    async def _run_group(self, indexes: List[int], profile_data: dict, provider: str, tenant: Optional[str]):
+        try:
+            result = {"status": "ok", **await self._generate(profile_data, provider, tenant)}
+        except Exception as e:
+            logger.warning(f"Batch technical test failed: {e}", extra={"batch_indexes": indexes})
+            result = {"status": "error", "error": str(e)}
+        return indexes, result
+
+    async def run(self, profiles: list, tenant: Optional[str] = None) -> AsyncIterator[dict]:
+        """
+        Yield one result per input item, in completion order, then a summary
+
+        Item results carry the item's "index" in the request; duplicates get
+        the result of the first identical profile and its index as "duplicate_of".
+        Stored tests are looked up among those of `tenant`.
+        """
+        timer = Timer()
+        counts = {"ok": 0, "error": 0}
+        groups = {}  # technical_test_key -> indexes of identical profiles
+
+        for index, profile_data in enumerate(profiles):
+            if not isinstance(profile_data, dict):
+                error = "Profile must be a JSON object"
+            elif missing_fields(profile_data):
+                error = f"Missing required fields: {', '.join(missing_fields(profile_data))}"
+            else:
+                # The prompt version is the same for the whole batch
+                groups.setdefault(technical_test_key(profile_data, None), []).append(index)
+                continue
+            BATCH_ITEMS.labels("invalid").inc()
+            counts["error"] += 1
+            yield {"index": index, "status": "error", "error": error}
+
+        providers = self.load_balancer.healthy_services("technical_test")
+        tasks = [
+            asyncio.ensure_future(self._run_group(indexes, profiles[indexes[0]], providers[i % len(providers)], tenant))
+            for i, indexes in enumerate(groups.values())
+        ]
+        logger.info(
+            "Technical test batch started",
+            extra={"items": len(profiles), "unique": len(groups), "providers": providers}
+        )
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                indexes, result = await next_done
+                if result["status"] == "ok":
+                    BATCH_ITEMS.labels("precomputed" if result["precomputed"] else "generated").inc()
+                else:
+                    BATCH_ITEMS.labels("failed").inc()
+                BATCH_ITEMS.labels("duplicate").inc(len(indexes) - 1)
+                counts[result["status"]] += len(indexes)
+                for index in indexes:
+                    item = {"index": index, **result, "profile_summary": profile_summary(profiles[index])}
+                    if index != indexes[0]:
+                        item["duplicate_of"] = indexes[0]
+                    yield item
+        finally:
+            # The client went away: queued calls are dropped (running ones finish on the executor)
+            for task in tasks:
+                task.cancel()
+
+        yield {
+            "summary": {
+                "items": len(profiles),
+                "unique": len(groups),
+                "succeeded": counts["ok"],
+                "failed": counts["error"],
+                "providers": providers,
+                "duration_ms": timer.ms,
+            }
+        }
@@ -0,0 +1,290 @@
+"""
+Tenants: API keys, rate limits and fair queuing
+
+Callers identify themselves with X-API-Key. Each tenant has token buckets
+for requests per minute and minutes of audio per hour, and a weight. The
+provider (AI) and FFmpeg stages hand out their slots with weighted fair
+queuing, so a tenant with a bulk job waits behind its own work rather than
+in front of everyone else's. Without TENANTS configured every caller is the
+"default" tenant, with no limits, and the queues behave as plain FIFOs.
+"""
+import asyncio
+import contextvars
+import hmac
+import heapq
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+from config import Config
+from utils.logger import setup_logger, Timer
+from utils.metrics import TENANT_AUDIO_SECONDS, TENANT_QUEUE_SECONDS, TENANT_REQUESTS
+
+logger = setup_logger("tenancy")
+
+STAGES = ("ai", "ffmpeg")
+
+_current_tenant = contextvars.ContextVar("tenant", default=None)
+
+
+class TenantLimitExceeded(Exception):
+    """A tenant is over one of its limits; retry_after is in seconds"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """`capacity` tokens refilled evenly over `period` seconds"""
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, amount: float) -> float:
+        """
+        Take `amount` tokens, or return the seconds until they are available (nothing taken)
+
+        More than the capacity is granted once the bucket is full, leaving it
+        in debt, so one long video is throttled rather than refused forever.
+        """
+        with self._lock:
+            self._refill()
+            needed = min(amount, self.capacity)
+            if self.tokens >= needed:
+                self.tokens -= amount
+                return 0.0
+            return (needed - self.tokens) / self.rate
+
+    def level(self) -> float:
+        with self._lock:
+            self._refill()
+            return self.tokens
+
+
+class Tenant:
+    """A caller's limits, weight and usage counters"""
+
+    def __init__(
+        self,
+        name: str,
+        weight: float = 1.0,
+        requests_per_minute: float = 0,
+        audio_minutes_per_hour: float = 0
+    ):
+        self.name = name
+        self.weight = max(float(weight), 0.01)
+        self.requests_per_minute = requests_per_minute
+        self.audio_minutes_per_hour = audio_minutes_per_hour
+        self.requests = TokenBucket(requests_per_minute, 60) if requests_per_minute else None
+        self.audio = TokenBucket(audio_minutes_per_hour * 60, 3600) if audio_minutes_per_hour else None
+        self.counts = {"allowed": 0, "limited": 0, "audio_limited": 0}
+        self.audio_seconds = 0.0
+        self.queue = {stage: {"waits": 0, "wait_seconds": 0.0, "max_wait_seconds": 0.0, "queued": 0} for stage in STAGES}
+
+    def admit_request(self):
+        """Count a request against requests_per_minute"""
+        wait = self.requests.take(1) if self.requests is not None else 0.0
+        outcome = "limited" if wait else "allowed"
+        self.counts[outcome] += 1
+        TENANT_REQUESTS.labels(self.name, outcome).inc()
+        if wait:
+            raise TenantLimitExceeded(
+                f"Rate limit of {self.requests_per_minute:g} requests per minute exceeded", wait
+            )
+
+    async def charge_audio(self, seconds: float):
+        """
+        Count a video's audio against audio_minutes_per_hour
+
+        Waits up to TENANT_AUDIO_MAX_WAIT seconds for the bucket to refill.
+
+        Raises:
+            TenantLimitExceeded: The audio would not fit within that wait
+        """
+        if self.audio is not None:
+            deadline = time.monotonic() + Config.TENANT_AUDIO_MAX_WAIT
+            while True:
+                wait = self.audio.take(seconds)
+                if not wait:
+                    break
+                if time.monotonic() + wait > deadline:
+                    self.counts["audio_limited"] += 1
+                    raise TenantLimitExceeded(
+                        f"Audio limit of {self.audio_minutes_per_hour:g} minutes per hour exceeded", wait
+                    )
+                await asyncio.sleep(wait)
+        self.audio_seconds += seconds
+        TENANT_AUDIO_SECONDS.labels(self.name).inc(seconds)
+
+    def record_wait(self, stage: str, seconds: float):
+        stats = self.queue[stage]
+        stats["waits"] += 1
+        stats["wait_seconds"] += seconds
+        stats["max_wait_seconds"] = max(stats["max_wait_seconds"], seconds)
+        TENANT_QUEUE_SECONDS.labels(self.name, stage).observe(seconds)
+
+    def snapshot(self) -> dict:
+        return {
+            "weight": self.weight,
+            "limits": {
+                "requests_per_minute": self.requests_per_minute or None,
+                "audio_minutes_per_hour": self.audio_minutes_per_hour or None,
+            },
+            "available": {
+                "requests": round(self.requests.level(), 2) if self.requests is not None else None,
+                "audio_minutes": round(self.audio.level() / 60, 2) if self.audio is not None else None,
+            },
+            "requests": dict(self.counts),
+            "audio_minutes": round(self.audio_seconds / 60, 2),
+            "queues": {
+                stage: {
+                    "waits": stats["waits"],
+                    "queued": stats["queued"],
+                    "mean_wait_ms": round(stats["wait_seconds"] * 1000 / stats["waits"], 1) if stats["waits"] else None,
+                    "max_wait_ms": round(stats["max_wait_seconds"] * 1000, 1),
+                }
+                for stage, stats in self.queue.items()
+            },
+        }
+
+
+class TenantRegistry:
+    """Tenants from Config.TENANTS, looked up by API key"""
+
+    def __init__(self, tenants: Optional[dict] = None):
+        tenants = Config.TENANTS if tenants is None else tenants
+        self.enabled = bool(tenants)
+        self._keys = []  # (api_key, tenant)
+        self.tenants: Dict[str, Tenant] = {}
+        for name, settings in tenants.items():
+            tenant = Tenant(
+                name,
+                weight=settings.get("weight", 1.0),
+                requests_per_minute=settings.get("requests_per_minute", Config.TENANT_DEFAULT_REQUESTS_PER_MINUTE),
+                audio_minutes_per_hour=settings.get(
+                    "audio_minutes_per_hour", Config.TENANT_DEFAULT_AUDIO_MINUTES_PER_HOUR
+                ),
+            )
+            self.tenants[name] = tenant
+            for api_key in settings.get("api_keys") or [settings.get("api_key")]:
+                if api_key:
+                    self._keys.append((api_key, tenant))
+        # Shared by every caller when tenants are off, and by background work without a caller
+        self.default = Tenant("default")
+        if not self.enabled:
+            self.tenants["default"] = self.default
+        logger.info("Tenants loaded", extra={"tenants": len(self.tenants), "tenancy_enabled": self.enabled})
+
+    def resolve(self, api_key: Optional[str]) -> Optional[Tenant]:
+        """The tenant of an API key; None for a missing or unknown key while tenants are configured"""
+        if not self.enabled:
+            return self.default
+        if not api_key:
+            return None
+        # Every key is compared, in constant time, so timing does not reveal a matching prefix
+        match = None
+        for key, tenant in self._keys:
+            if hmac.compare_digest(key.encode(), api_key.encode()):
+                match = tenant
+        return match
+
+    def get(self, name: Optional[str]) -> Tenant:
+        return self.tenants.get(name) or self.default
+
+    def snapshot(self, names=None) -> dict:
+        return {
+            "enabled": self.enabled,
+            "tenants": {
+                name: tenant.snapshot() for name, tenant in self.tenants.items() if names is None or name in names
+            },
+        }
+
+
+@contextmanager
+def tenant_context(tenant: Optional[Tenant]):
+    """Make `tenant` the one fair queues charge inside the block (follows tasks and copied contexts)"""
+    token = _current_tenant.set(tenant)
+    try:
+        yield
+    finally:
+        _current_tenant.reset(token)
+
+
+def current_tenant() -> Optional[Tenant]:
+    return _current_tenant.get()
+
+
+class FairQueue:
+    """
+    Weighted fair queuing of a stage's slots (start-time fair queuing)
+
+    Each request gets a virtual finish tag: its tenant's previous tag (or the
+    current virtual time, if the tenant was idle) plus cost / weight. Freed
+    slots go to the smallest tag, so backlogged tenants share the stage in
+    proportion to their weights whatever their queue lengths.
+    """
+
+    def __init__(self, stage: str, slots: int, default: Tenant):
+        self.stage = stage
+        self.slots = max(1, slots)
+        self.default = default
+        self.busy = 0
+        self._virtual_time = 0.0
+        self._finish: Dict[str, float] = {}
+        self._heap = []  # (finish tag, sequence, start tag, tenant, future)
+        self._sequence = itertools.count()
+
+    def _grant(self):
+        while self._heap and self.busy < self.slots:
+            _, _, start, tenant, future = heapq.heappop(self._heap)
+            if future.done():
+                continue  # Cancelled while waiting
+            tenant.queue[self.stage]["queued"] -= 1
+            self.busy += 1
+            self._virtual_time = start
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, cost: float = 1.0, tenant: Optional[Tenant] = None):
+        """Hold one of the stage's slots; `cost` is the work's size (1 per provider call, audio seconds for FFmpeg)"""
+        tenant = tenant or current_tenant() or self.default
+        start = max(self._virtual_time, self._finish.get(tenant.name, 0.0))
+        finish = start + max(cost, 0.001) / tenant.weight
+        self._finish[tenant.name] = finish
+
+        timer = Timer()
+        if self.busy < self.slots and not self._heap:
+            self.busy += 1
+            self._virtual_time = start
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self._heap, (finish, next(self._sequence), start, tenant, future))
+            tenant.queue[self.stage]["queued"] += 1
+            try:
+                await future
+            except BaseException:
+                if future.done() and not future.cancelled():
+                    self._release()  # Granted just as the waiter was cancelled
+                else:
+                    tenant.queue[self.stage]["queued"] -= 1
+                raise
+        tenant.record_wait(self.stage, timer.ms / 1000)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self):
+        self.busy -= 1
+        self._grant()
@@ -0,0 +1,231 @@
+"""
+Batch video ingestion
+
+Videos come as several uploaded files or inside a zip/tar archive. Entries
+are read one at a time straight from the upload (tar archives as a stream),
+so only the entry being converted and the prefetched ones are on disk. FFmpeg
+prepares the next entry on its own thread while the current one is in the
+AI stages, and each video's result is yielded as soon as it is done.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import tarfile
+import threading
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable, Iterator, List, Optional, Tuple
+from config import Config
+from utils.logger import setup_logger, Timer
+from utils.metrics import BATCH_VIDEOS, track_executor
+from utils.tracing import start_span
+from .video_processor import VideoProcessor
+
+logger = setup_logger("video_batch")
+
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".m4v", ".mkv", ".webm", ".avi", ".mpeg", ".mpg", ".3gp")
+TAR_EXTENSIONS = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def is_archive(filename: str) -> bool:
+    name = (filename or "").lower()
+    return name.endswith(".zip") or name.endswith(TAR_EXTENSIONS)
+
+
+def _is_video_entry(name: str) -> bool:
+    """Video files of an archive, without folders and macOS/hidden metadata"""
+    base = os.path.basename(name)
+    if not base or base.startswith(".") or name.startswith("__MACOSX/"):
+        return False
+    return base.lower().endswith(VIDEO_EXTENSIONS)
+
+
+def _too_large(size: int) -> Optional[str]:
+    limit = Config.VIDEO_BATCH_MAX_ENTRY_MB * 1024 * 1024
+    if size > limit:
+        return f"Entry exceeds {Config.VIDEO_BATCH_MAX_ENTRY_MB} MB"
+    return None
+
+
+def iter_entries(uploads: List[Tuple[str, BinaryIO]]) -> Iterator[Tuple[str, Optional[BinaryIO], Optional[str]]]:
+    """
+    (name, stream, error) for every video of the uploads, read lazily
+
+    A stream is only valid until the next entry is requested. Unreadable
+    archives and oversized entries yield an error instead of a stream.
+    """
+    for filename, fileobj in uploads:
+        name = (filename or "").lower()
+        try:
+            if name.endswith(".zip"):
+                with zipfile.ZipFile(fileobj) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir() or not _is_video_entry(info.filename):
+                            continue
+                        error = _too_large(info.file_size)
+                        if error:
+                            yield f"{filename}/{info.filename}", None, error
+                            continue
+                        with archive.open(info) as entry:
+                            yield f"{filename}/{info.filename}", entry, None
+            elif name.endswith(TAR_EXTENSIONS):
+                # Stream mode: members are read in order, never seeking back
+                with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+                    for member in archive:
+                        if not member.isfile() or not _is_video_entry(member.name):
+                            continue
+                        error = _too_large(member.size)
+                        if error:
+                            yield f"{filename}/{member.name}", None, error
+                            continue
+                        yield f"{filename}/{member.name}", archive.extractfile(member), None
+            else:
+                yield filename, fileobj, None
+        except (zipfile.BadZipFile, tarfile.TarError, OSError, EOFError) as e:
+            yield filename, None, f"Unreadable archive: {e}"
+
+
+class VideoBatchIngestor:
+    """
+    Two-stage pipeline: FFmpeg on a dedicated thread, then the AI stages
+
+    At most VIDEO_BATCH_PREFETCH converted videos wait for the AI stages, which
+    bounds the scratch disk used by a batch.
+    """
+
+    def __init__(
+        self,
+        video_processor: VideoProcessor,
+        process_audio: Callable[..., Awaitable[dict]],
+        ffmpeg_queue=None
+    ):
+        """
+        Args:
+            video_processor: Converts each entry to audio
+            process_audio: Coroutine (audio_path, filename, **run kwargs) -> result, the /upload-video AI stages
+            ffmpeg_queue: Optional FairQueue each conversion waits its turn in
+        """
+        self.video_processor = video_processor
+        self.process_audio = process_audio
+        self.ffmpeg_queue = ffmpeg_queue
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ffmpeg")
+        track_executor("ffmpeg", self.executor)
+
+    def _prepare_next(self, entries: Iterator, stop: threading.Event):
+        """Convert the next entry; None when there are no more"""
+        entry = next(entries, None)
+        if entry is None:
+            return None
+        name, stream, error = entry
+        if error:
+            return {"filename": name, "error": error}
+        try:
+            video_path, audio_path = self.video_processor.process_stream(stream)
+        except Exception as e:
+            return {"filename": name, "error": f"Audio extraction failed: {e}"}
+        if stop.is_set():
+            # The batch was abandoned while this entry was converting
+            self.video_processor.cleanup(video_path, audio_path)
+            return None
+        return {"filename": name, "video_path": video_path, "audio_path": audio_path}
+
+    async def _produce(self, entries: Iterator, queue: asyncio.Queue, slots: asyncio.Semaphore, stop: threading.Event):
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        try:
+            for _ in range(Config.VIDEO_BATCH_MAX_VIDEOS):
+                await slots.acquire()
+                async with self.ffmpeg_queue.slot() if self.ffmpeg_queue else nullcontext():
+                    prepared = await loop.run_in_executor(
+                        self.executor, functools.partial(ctx.run, self._prepare_next, entries, stop)
+                    )
+                if prepared is None:
+                    return
+                await queue.put(prepared)
+            # Over the limit: report it only if another entry exists
+            if await loop.run_in_executor(self.executor, next, entries, None) is not None:
+                await queue.put({"limit_reached": True})
+        except Exception:
+            logger.error("Reading the video batch failed", exc_info=True)
+        finally:
+            await queue.put(None)
+
+    def _cleanup(self, prepared: dict):
+        if "video_path" in prepared:
+            self.video_processor.cleanup(prepared["video_path"], prepared["audio_path"])
+
+    async def run(self, uploads: List[Tuple[str, BinaryIO]], **process_kwargs) -> AsyncIterator[dict]:
+        """
+        Yield one result per video in archive/upload order, then a throughput summary
+
+        Args:
+            uploads: (filename, file object) of each uploaded file
+            **process_kwargs: Passed on to process_audio (e.g. the uploader's tenant)
+        """
+        timer = Timer()
+        counts = {"ok": 0, "error": 0}
+        audio_seconds = 0.0
+        limit_reached = False
+
+        queue: asyncio.Queue = asyncio.Queue()
+        slots = asyncio.Semaphore(Config.VIDEO_BATCH_PREFETCH + 1)
+        stop = threading.Event()
+        producer = asyncio.ensure_future(self._produce(iter_entries(uploads), queue, slots, stop))
+        try:
+            index = 0
+            while True:
+                prepared = await queue.get()
+                if prepared is None:
+                    break
+                if prepared.get("limit_reached"):
+                    limit_reached = True
+                    continue
+
+                item = {"index": index, "filename": prepared["filename"]}
+                index += 1
+                try:
+                    if "error" in prepared:
+                        raise RuntimeError(prepared["error"])
+                    seconds = self.video_processor.audio_duration(prepared["audio_path"])
+                    with start_span("video_batch.item", filename=prepared["filename"], audio_seconds=round(seconds, 3)):
+                        result = await self.process_audio(
+                            prepared["audio_path"], os.path.basename(prepared["filename"]), **process_kwargs
+                        )
+                    audio_seconds += seconds
+                    item.update(status="ok", audio_seconds=round(seconds, 1), **result)
+                except Exception as e:
+                    logger.warning(f"Batch video failed: {e}", extra={"upload_filename": prepared["filename"]})
+                    item.update(status="error", error=str(e))
+                finally:
+                    self._cleanup(prepared)
+                    # The FFmpeg thread may convert the next entry now
+                    slots.release()
+
+                counts[item["status"]] += 1
+                BATCH_VIDEOS.labels(item["status"]).inc()
+                yield item
+        finally:
+            stop.set()
+            producer.cancel()
+            while not queue.empty():
+                leftover = queue.get_nowait()
+                if leftover:
+                    self._cleanup(leftover)
+
+        elapsed = timer.ms / 1000
+        summary = {
+            "videos": counts["ok"] + counts["error"],
+            "succeeded": counts["ok"],
+            "failed": counts["error"],
+            "audio_seconds": round(audio_seconds, 1),
+            "duration_ms": timer.ms,
+            "videos_per_minute": round(counts["ok"] * 60 / elapsed, 2) if elapsed else None,
+            # Seconds of audio processed per wall clock second
+            "realtime_factor": round(audio_seconds / elapsed, 2) if elapsed else None,
+        }
+        if limit_reached:
+            summary["limit_reached"] = Config.VIDEO_BATCH_MAX_VIDEOS
+        logger.info("Video batch finished", extra=summary)
+        yield {"summary": summary}
@@ -1,9 +1,38 @@
+import functools
 import os
+import re
 import subprocess
 import tempfile
 import shutil
-from typing import Tuple
+import wave
+from typing import BinaryIO, Optional, Tuple
 from fastapi import UploadFile
+from config import Config
+from utils.logger import setup_logger, Timer
+from utils.metrics import track_stage, UPLOAD_BYTES, AUDIO_SECONDS
+from utils.tracing import start_span
+
+logger = setup_logger("video_processor")
+
+
+@functools.lru_cache(maxsize=None)
+def find_ffmpeg(configured: Optional[str] = None) -> str:
+    """
+    Path of the FFmpeg executable (FFMPEG_PATH, else the PATH), looked up once per process
+    
+    Only checks that an executable exists (no `ffmpeg -version` run), so
+    startup spawns no processes; a broken binary fails the first extraction.
+    """
+    for path in ([configured] if configured else []) + ["ffmpeg"]:
+        resolved = shutil.which(path)
+        if resolved:
+            logger.info("Using FFmpeg", extra={"ffmpeg_path": resolved})
+            return resolved
+    
+    raise RuntimeError("FFmpeg not found. Install FFmpeg and add it to the PATH, or set FFMPEG_PATH")
+
+
+_DURATION = re.compile(rb"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
 
 
 class VideoProcessor:
@@ -15,50 +44,136 @@ class VideoProcessor:
         self.ffmpeg_path = self._find_ffmpeg()
     
     def _find_ffmpeg(self):
-        """Find FFmpeg executable"""
-        # Try common locations on Windows
-        possible_paths = [
-            "ffmpeg",  # If in PATH
-            r"C:\Users\Fernando\AppData\Local\Microsoft\WinGet\Packages\Gyan.FFmpeg_Microsoft.Winget.Source_8wekyb3d8bbwe\ffmpeg-8.0-full_build\bin\ffmpeg.exe",
-            r"C:\ffmpeg\bin\ffmpeg.exe",
-        ]
-        
-        for path in possible_paths:
-            try:
-                subprocess.run([path, "-version"], capture_output=True, check=True)
-                print(f"[VideoProcessor] Using FFmpeg at: {path}")
-                return path
-            except (subprocess.CalledProcessError, FileNotFoundError):
-                continue
-        
-        raise RuntimeError("FFmpeg not found. Please install FFmpeg: winget install Gyan.FFmpeg")
+        """Find FFmpeg executable (resolved once per process)"""
+        return find_ffmpeg(Config.FFMPEG_PATH)
     
     def process_video(self, video_file: UploadFile) -> Tuple[str, str]:
         """
         Process uploaded video and extract audio
         Returns: (video_path, audio_path)
         """
-        video_path = self._save_video(video_file)
-        audio_path = self._extract_audio(video_path)
-        return video_path, audio_path
+        return self.process_stream(video_file.file)
+    
+    def process_stream(self, stream: BinaryIO) -> Tuple[str, str]:
+        """
+        Save a video from any readable stream (upload, archive entry) and extract audio
+        Returns: (video_path, audio_path)
+        """
+        video_path = self.save_upload(stream)
+        try:
+            return video_path, self.convert_upload(video_path)
+        except Exception:
+            self.cleanup(video_path, None)
+            raise
+    
+    def save_upload(self, stream: BinaryIO) -> str:
+        """Save a video stream to a temporary file (the upload stage); the caller deletes it"""
+        timer = Timer()
+        with track_stage("upload"), start_span("upload") as span:
+            video_path = self._save_video(stream)
+            video_bytes = os.path.getsize(video_path)
+            span.set_attributes(bytes=video_bytes)
+        UPLOAD_BYTES.inc(video_bytes)
+        logger.info("Upload saved", extra={"stage": "upload", "bytes": video_bytes, "duration_ms": timer.ms})
+        return video_path
+    
+    def convert_upload(self, video_path: str) -> str:
+        """Extract the audio of a saved upload (the ffmpeg stage); returns audio_path"""
+        timer = Timer()
+        with track_stage("ffmpeg"), start_span("ffmpeg") as span:
+            audio_path = self._extract_audio(video_path)
+            audio_seconds = self.audio_duration(audio_path)
+            span.set_attributes(audio_seconds=round(audio_seconds, 3), audio_bytes=os.path.getsize(audio_path))
+        AUDIO_SECONDS.inc(audio_seconds)
+        logger.info("Audio extracted", extra={"stage": "ffmpeg", "audio_seconds": round(audio_seconds, 1), "duration_ms": timer.ms})
+        return audio_path
+    
+    def probe_duration(self, video_path: str) -> Optional[float]:
+        """
+        Duration in seconds from the container header, without decoding
+        
+        Uses `ffmpeg -i` (ffprobe is not always installed next to it);
+        None when the container does not state a duration.
+        """
+        result = subprocess.run([self.ffmpeg_path, "-hide_banner", "-i", video_path], capture_output=True)
+        match = _DURATION.search(result.stderr)
+        if not match:
+            return None
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
     
     @staticmethod
-    def _save_video(video_file: UploadFile) -> str:
-        """Save uploaded video to temporary file"""
+    def _save_video(stream: BinaryIO) -> str:
+        """Save video stream to temporary file"""
         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".mp4")
         temp_path = temp_file.name
         
         with temp_file:
-            shutil.copyfileobj(video_file.file, temp_file)
+            shutil.copyfileobj(stream, temp_file)
         
         return temp_path
     
-    def _extract_audio(self, video_path: str) -> str:
+    def extract_audio(self, video_path: str) -> Tuple[str, float]:
+        """
+        Extract the audio of a video already on disk, without copying it
+        Returns: (audio_path, audio_seconds); the caller deletes audio_path
+        """
+        fd, audio_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        try:
+            self._extract_audio(video_path, audio_path)
+        except Exception:
+            self.cleanup(None, audio_path)
+            raise
+        return audio_path, self.audio_duration(audio_path)
+    
+    def start_stream_extraction(self) -> Tuple[subprocess.Popen, str]:
+        """
+        Start FFmpeg reading the video from stdin, for uploads still arriving
+        Returns: (process, audio_path); write the video to process.stdin and close it
+        """
+        fd, audio_path = tempfile.mkstemp(suffix=".wav")
+        os.close(fd)
+        process = subprocess.Popen([
+            self.ffmpeg_path, "-y", "-i", "pipe:0",
+            "-vn", "-acodec", "pcm_s16le",
+            "-ar", self.sample_rate,
+            "-ac", self.channels,
+            audio_path
+        ], stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        return process, audio_path
+    
+    @staticmethod
+    def is_streamable(prefix: bytes) -> bool:
+        """
+        Whether FFmpeg can extract the audio reading the file front to back
+        
+        MP4/MOV files whose index (moov) comes after the media data (mdat),
+        the usual layout of phone recordings, need the complete file.
+        """
+        if prefix[4:8] != b"ftyp":
+            return True  # WebM, Matroska, MPEG-TS...
+        position = 0
+        while position + 8 <= len(prefix):
+            size = int.from_bytes(prefix[position:position + 4], "big")
+            kind = prefix[position + 4:position + 8]
+            if kind == b"moov":
+                return True
+            if kind == b"mdat":
+                return False
+            if size == 1:
+                size = int.from_bytes(prefix[position + 8:position + 16], "big")
+            if size < 8:
+                return False
+            position += size
+        return False
+    
+    def _extract_audio(self, video_path: str, audio_path: str = None) -> str:
         """Extract audio from video using FFmpeg"""
-        audio_path = video_path.replace('.mp4', '.wav')
+        audio_path = audio_path or video_path.replace('.mp4', '.wav')
         
         subprocess.run([
-            self.ffmpeg_path, "-i", video_path,
+            self.ffmpeg_path, "-y", "-i", video_path,
             "-vn", "-acodec", "pcm_s16le",
             "-ar", self.sample_rate,
             "-ac", self.channels,
@@ -67,6 +182,15 @@ class VideoProcessor:
         
         return audio_path
     
+    @staticmethod
+    def audio_duration(audio_path: str) -> float:
+        """Duration in seconds of an extracted WAV file (header only, no decoding)"""
+        try:
+            with wave.open(audio_path, "rb") as wav:
+                return wav.getnframes() / float(wav.getframerate())
+        except (wave.Error, OSError, ZeroDivisionError):
+            return 0.0
+    
     @staticmethod
     def cleanup(video_path: str, audio_path: str):
         """Clean up temporary files"""
@@ -75,4 +199,4 @@ class VideoProcessor:
                 try:
                     os.unlink(path)
                 except Exception as e:
-                    print(f"Warning: Failed to delete {path}: {e}")
+                    logger.warning("Failed to delete temporary file", extra={"path": path, "error": str(e)})
@@ -0,0 +1,10 @@
+"""
+Unit tests; nothing here needs MongoDB or an AI provider
+
+Run with `python -m pytest` from the repository root.
+"""
+import os
+
+# Must be set before config is imported
+os.environ["MONGODB_ENABLED"] = "false"
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,101 @@
+from database.candidate_index import CandidateIndex, normalize, profile_tokens, term_tokens, word_tokens
+
+
+def make_index(*profiles):
+    """Index (candidate_id, profile_data, tenant) tuples in order"""
+    index = CandidateIndex()
+    for candidate_id, profile_data, tenant in profiles:
+        index.add(candidate_id, profile_tokens(profile_data), {"name": candidate_id}, tenant=tenant)
+    return index
+
+
+ANA = {"profession": "Ingeniera de Datos", "technologies": "Python, Spark y AWS", "languages": "Español, Inglés"}
+LUIS = {"profession": "Desarrollador Backend", "technologies": ["Java", "Spring Boot", "AWS"], "languages": "Español"}
+EVA = {"profession": "Desarrolladora Frontend", "technologies": "React, TypeScript", "languages": "Inglés"}
+
+
+def test_normalize_strips_accents_and_case():
+    assert normalize("  Diseñadora   GRÁFICA ") == "disenadora grafica"
+
+
+def test_term_tokens_split_lists_and_conjunctions():
+    assert term_tokens("Python, Node.js y Spring Boot (framework)") == ["python", "node.js", "spring boot"]
+    assert term_tokens(["Docker", "docker", "Not specified"]) == ["docker"]
+
+
+def test_word_tokens_drop_stopwords_and_short_words():
+    assert word_tokens("Ingeniero de la Universidad y C") == ["ingeniero", "universidad"]
+
+
+def test_profile_tokens_make_technology_words_searchable_as_keywords():
+    tokens = profile_tokens(LUIS)
+    assert "spring boot" in tokens["technologies"]
+    assert {"spring", "boot"} <= set(tokens["keywords"])
+
+
+def test_search_ranks_by_matched_technologies():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None), ("eva", EVA, None))
+    result = index.search(technologies="aws, python")
+    assert result["total"] == 2
+    assert [r["id"] for r in result["results"]] == ["ana", "luis"]
+    assert result["results"][0]["matched"] == ["aws", "python"]
+    assert result["results"][0]["name"] == "ana"
+
+
+def test_rarer_technologies_weigh_more():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None), ("eva", EVA, None))
+    scores = {r["id"]: r["score"] for r in index.search(technologies="aws, java")["results"]}
+    assert scores["luis"] > scores["ana"]
+
+
+def test_match_all_requires_every_term():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None))
+    result = index.search(technologies="aws, python", match_all=True)
+    assert [r["id"] for r in result["results"]] == ["ana"]
+
+
+def test_filters_intersect():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None), ("eva", EVA, None))
+    assert [r["id"] for r in index.search(languages="ingles")["results"]] == ["eva", "ana"]
+    assert [r["id"] for r in index.search(profession="desarrollador")["results"]] == ["luis"]
+    assert index.search(profession="desarrollador", languages="ingles")["total"] == 0
+
+
+def test_unfiltered_search_lists_most_recent_first_and_pages():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None), ("eva", EVA, None))
+    page = index.search(limit=2, offset=1)
+    assert page["total"] == 3
+    assert [r["id"] for r in page["results"]] == ["luis", "ana"]
+
+
+def test_reindex_replaces_tokens():
+    index = make_index(("ana", ANA, None))
+    index.add("ana", profile_tokens(EVA), {"name": "ana"})
+    assert len(index) == 1
+    assert index.search(technologies="python")["total"] == 0
+    assert index.search(technologies="react")["total"] == 1
+
+
+def test_remove_drops_postings():
+    index = make_index(("ana", ANA, None), ("luis", LUIS, None))
+    index.remove("ana")
+    index.remove("missing")
+    assert "ana" not in index
+    assert [r["id"] for r in index.search(technologies="aws")["results"]] == ["luis"]
+    assert "python" not in index._postings["technologies"]
+
+
+def test_tenants_only_see_their_candidates():
+    index = make_index(("ana", ANA, "acme"), ("luis", LUIS, "globex"), ("eva", EVA, "acme"))
+    assert [r["id"] for r in index.search(technologies="aws", tenant="acme")["results"]] == ["ana"]
+    assert [r["id"] for r in index.search(tenant="acme")["results"]] == ["eva", "ana"]
+    assert index.search(tenant="initech")["total"] == 0
+    assert index.search(technologies="aws")["total"] == 2
+    assert (index.count("acme"), index.count("globex"), index.count()) == (2, 1, 3)
+
+
+def test_remove_and_reindex_update_tenant_counts():
+    index = make_index(("ana", ANA, "acme"), ("luis", LUIS, "acme"))
+    index.remove("ana")
+    index.add("luis", profile_tokens(LUIS), {"name": "luis"}, tenant="globex")
+    assert (index.count("acme"), index.count("globex")) == (0, 1)
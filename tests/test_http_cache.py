@@ -0,0 +1,89 @@
+import gzip
+import pytest
+from starlette.requests import Request
+from utils.http_cache import StaticBody, VersionedJSON, choose_encoding, etag_matches, make_etag
+
+ALL = ("gzip", "br", "zstd")
+
+
+def request(**headers) -> Request:
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "path": "/",
+        "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()],
+    })
+
+
+def test_make_etag_is_weak():
+    assert make_etag("abc123") == 'W/"abc123"'
+    assert make_etag("a", "b") == make_etag("a", "b")
+    assert make_etag("a", "b") != make_etag("ab")
+    assert make_etag("a", "b").startswith('W/"')
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, False),
+    ("", False),
+    ('W/"v1"', True),
+    ('"v1"', True),  # Weak comparison
+    ('"v0", W/"v1"', True),
+    (' "v0" ,  "v1" ', True),
+    ('"v2"', False),
+    ("*", True),
+])
+def test_etag_matches(header, expected):
+    assert etag_matches(header, 'W/"v1"') is expected
+
+
+@pytest.mark.parametrize("header, available, expected", [
+    (None, ALL, None),
+    ("", ALL, None),
+    ("gzip", ALL, "gzip"),
+    ("gzip, br", ALL, "br"),
+    ("gzip, br, zstd", ALL, "zstd"),  # Server preference between equal qualities
+    ("gzip, br", ("gzip",), "gzip"),
+    ("br;q=0.5, gzip;q=0.8", ALL, "gzip"),
+    ("GZIP", ALL, "gzip"),
+    ("identity", ALL, None),
+    ("*", ALL, "zstd"),
+    ("*, br;q=0", ("br", "gzip"), "gzip"),
+    ("gzip;q=0", ALL, None),
+    ("gzip;q=0, *;q=0", ALL, None),
+    ("gzip;q=0.0", ("gzip",), None),
+    ("gzip;q=abc", ("gzip",), None),
+    ("br", ("gzip",), None),
+])
+def test_choose_encoding(header, available, expected):
+    assert choose_encoding(header, available) == expected
+
+
+def test_static_body_serves_compressed_variants_and_304():
+    body = StaticBody("test", "<html>" + "x" * 5000 + "</html>", "text/html", "max-age=60")
+    response = body.respond(request(accept_encoding="gzip"))
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(response.body) == body.body
+    assert response.headers["etag"] == body.etag
+    assert response.headers["vary"] == "Accept-Encoding"
+
+    assert "content-encoding" not in body.respond(request()).headers
+    assert body.respond(request(if_none_match=body.etag)).status_code == 304
+
+
+def test_static_body_skips_variants_that_do_not_shrink():
+    assert StaticBody("test", b"x", "text/plain", "no-cache").variants == {}
+
+
+def test_versioned_json_renders_once_per_version():
+    cache = VersionedJSON("test", "max-age=0")
+    calls = []
+
+    def render():
+        calls.append(1)
+        return {"n": len(calls)}
+
+    assert cache.respond(request(), "key", 'W/"1"', render).body == b'{"n":1}'
+    assert cache.respond(request(), "key", 'W/"1"', render).body == b'{"n":1}'
+    assert cache.respond(request(if_none_match='W/"1"'), "key", 'W/"1"', render).status_code == 304
+    assert cache.respond(request(), "key", 'W/"2"', render).body == b'{"n":2}'
+    assert len(calls) == 2
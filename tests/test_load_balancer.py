@@ -0,0 +1,36 @@
+from services.load_balancer import AILoadBalancer
+from services.quota_tracker import QuotaTracker
+
+
+class FakeService:
+    is_local = False
+    quota_tracker = None
+
+    def __init__(self, name: str, error: str = None):
+        self.name = name
+        self.error = error
+        self.calls = 0
+
+    def model_for(self, task: str) -> str:
+        return "model"
+
+    def generate_technical_test(self, profile_data: dict) -> str:
+        self.calls += 1
+        if self.error:
+            raise Exception(self.error)
+        return self.name
+
+
+def test_quota_fallback_skips_services_without_headroom():
+    services = {
+        "groq": FakeService("groq", error="Error code: 429 - rate limit reached"),
+        "gemini": FakeService("gemini"),
+        "openrouter": FakeService("openrouter"),
+    }
+    tracker = QuotaTracker(limits={"gemini": {"tokens_per_minute": 100}})
+    balancer = AILoadBalancer(services, quota_tracker=tracker)
+    result = balancer._route_primary(
+        "technical_test", "technical test", "generate_technical_test", {}, expected={"tokens": 500}
+    )
+    assert result == "openrouter"
+    assert services["gemini"].calls == 0
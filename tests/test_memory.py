@@ -0,0 +1,130 @@
+import asyncio
+import pytest
+from utils.memory import MemoryBudgetExceeded, MemoryGovernor, estimate_job_bytes
+
+
+async def job(governor: MemoryGovernor, size: int, name: str, order: list, release: asyncio.Event, timeout=None):
+    async with governor.reserve(size, timeout=timeout):
+        order.append(name)
+        await release.wait()
+
+
+def test_estimate_grows_with_audio(monkeypatch):
+    from utils import memory
+    monkeypatch.setattr(memory.Config, "MEMORY_JOB_BASE_MB", 100)
+    monkeypatch.setattr(memory.Config, "MEMORY_PER_AUDIO_SECOND_KB", 64)
+    assert estimate_job_bytes(0) == 100 * 1024 * 1024
+    assert estimate_job_bytes(-5) == 100 * 1024 * 1024
+    assert estimate_job_bytes(10) == 100 * 1024 * 1024 + 10 * 64 * 1024
+
+
+def test_jobs_wait_in_arrival_order():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        order = []
+        first, rest = asyncio.Event(), asyncio.Event()
+        running = asyncio.create_task(job(governor, 60, "a", order, first))
+        await asyncio.sleep(0)
+        # "c" would fit next to "a", but must not overtake the large "b"
+        waiting = [asyncio.create_task(job(governor, size, name, order, rest)) for size, name in ((70, "b"), (30, "c"))]
+        await asyncio.sleep(0)
+        assert order == ["a"] and governor.snapshot()["waiting"] == 2
+        first.set()
+        await running
+        await asyncio.sleep(0)
+        assert order == ["a", "b", "c"] and governor.reserved == 100
+        rest.set()
+        await asyncio.gather(*waiting)
+        return governor
+
+    governor = asyncio.run(scenario())
+    assert (governor.reserved, governor.jobs) == (0, 0)
+
+
+def test_job_larger_than_the_budget_runs_alone():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        order = []
+        release = asyncio.Event()
+        small = asyncio.create_task(job(governor, 10, "small", order, release))
+        await asyncio.sleep(0)
+        large = asyncio.create_task(job(governor, 500, "large", order, release))
+        await asyncio.sleep(0)
+        assert order == ["small"]
+        release.set()
+        await asyncio.gather(small, large)
+        return order, governor.reserved
+
+    assert asyncio.run(scenario()) == (["small", "large"], 0)
+
+
+def test_zero_budget_admits_everything():
+    async def scenario():
+        governor = MemoryGovernor(0)
+        order = []
+        release = asyncio.Event()
+        tasks = [asyncio.create_task(job(governor, 10**12, str(i), order, release)) for i in range(3)]
+        await asyncio.sleep(0)
+        assert len(order) == 3 and governor.reserved == 3 * 10**12
+        release.set()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_lets_the_next_job_in():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        order = []
+        release = asyncio.Event()
+        running = asyncio.create_task(job(governor, 50, "a", order, release))
+        await asyncio.sleep(0)
+        blocked = asyncio.create_task(job(governor, 80, "b", order, release))
+        behind = asyncio.create_task(job(governor, 40, "c", order, release))
+        await asyncio.sleep(0)
+        assert order == ["a"]
+        blocked.cancel()
+        await asyncio.gather(blocked, return_exceptions=True)
+        await asyncio.sleep(0)
+        # "c" was only waiting behind "b"
+        assert order == ["a", "c"] and governor.snapshot()["waiting"] == 0
+        release.set()
+        await asyncio.gather(running, behind)
+        return governor.reserved
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_waiter_cancelled_after_admission_releases_its_reservation():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        order = []
+        release = asyncio.Event()
+        running = asyncio.create_task(job(governor, 100, "a", order, release))
+        await asyncio.sleep(0)
+        admitted = asyncio.create_task(job(governor, 100, "b", order, asyncio.Event()))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.sleep(0)  # "a" finishes and admits "b", which has not resumed yet
+        assert running.done() and governor.reserved == 100
+        admitted.cancel()
+        await asyncio.gather(admitted, return_exceptions=True)
+        return order, governor.reserved, governor.jobs
+
+    assert asyncio.run(scenario()) == (["a"], 0, 0)
+
+
+def test_timeout_raises_and_leaves_the_queue():
+    async def scenario():
+        governor = MemoryGovernor(100)
+        release = asyncio.Event()
+        running = asyncio.create_task(job(governor, 100, "a", [], release))
+        await asyncio.sleep(0)
+        with pytest.raises(MemoryBudgetExceeded):
+            await job(governor, 10, "b", [], release, timeout=0.01)
+        assert governor.snapshot()["waiting"] == 0
+        release.set()
+        await running
+        return governor.reserved
+
+    assert asyncio.run(scenario()) == 0
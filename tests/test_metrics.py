@@ -0,0 +1,84 @@
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from prometheus_client import REGISTRY
+from utils.metrics import (
+    EXECUTOR_QUEUE_DEPTH, classify_error, render_metrics, track_executor, track_stage
+)
+
+
+def sample(name: str, **labels) -> float:
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+def test_track_stage_observes_even_on_error():
+    before = sample("pipeline_stage_seconds_count", stage="test_stage")
+    with track_stage("test_stage"):
+        pass
+    with pytest.raises(RuntimeError):
+        with track_stage("test_stage"):
+            raise RuntimeError("boom")
+    assert sample("pipeline_stage_seconds_count", stage="test_stage") == before + 2
+
+
+@pytest.mark.parametrize("message, expected", [
+    ("Error code: 429 - rate limit reached", "rate_limit"),
+    ("Quota exceeded for model", "rate_limit"),
+    ("Request timed out", "timeout"),
+    ("401 Unauthorized", "auth"),
+    ("Invalid API key provided", "auth"),
+    ("Could not parse JSON response", "invalid_response"),
+    ("503 Service Unavailable", "unavailable"),
+    ("Connection reset by peer", "unavailable"),
+    ("Something else", "other"),
+])
+def test_classify_error(message, expected):
+    assert classify_error(Exception(message)) == expected
+
+
+def test_classify_error_not_supported():
+    assert classify_error(NotImplementedError("no audio")) == "not_supported"
+
+
+def test_track_executor_reports_queue_depth():
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        track_executor("test_pool", executor)
+        assert sample("executor_queue_depth", executor="test_pool") == 0
+    finally:
+        executor.shutdown()
+        EXECUTOR_QUEUE_DEPTH.remove("test_pool")
+
+
+def test_render_metrics_is_prometheus_text():
+    payload, content_type = render_metrics()
+    assert content_type.startswith("text/plain")
+    assert b"# TYPE pipeline_stage_seconds histogram" in payload
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """The API without its lifespan (no warm-up); importing it needs FFmpeg on the PATH and a provider key"""
+    if shutil.which("ffmpeg") is None:
+        pytest.skip("FFmpeg is not installed")
+    from starlette.testclient import TestClient
+    from config import Config
+    if not Config.GROQ_API_KEY:
+        monkeypatch.setattr(Config, "GROQ_API_KEY", "test")
+    import main
+    return TestClient(main.app)
+
+
+def test_metrics_endpoint(client):
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert "http_requests_in_flight" in response.text
+    assert "x-request-id" not in response.headers  # Scrapes skip the request middleware
+
+
+def test_request_middleware_tags_requests_and_balances_in_flight(client):
+    response = client.get("/health", headers={"X-Request-ID": "req-1"})
+    assert response.status_code == 200
+    assert response.headers["x-request-id"] == "req-1"
+    assert client.get("/health").headers["x-request-id"]
+    assert sample("http_requests_in_flight") == 0
@@ -0,0 +1,77 @@
+import pytest
+from services import prompt_budget
+from services.prompt_budget import GAP, MIN_OUTPUT_TOKENS, fit_transcription, output_budget
+from utils.tokens import count_tokens
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    """Set the profile_extraction budget for a test"""
+    monkeypatch.setattr(prompt_budget.Config, "PROMPT_BUDGET_ENABLED", True)
+
+    def set_budget(tokens: int):
+        monkeypatch.setitem(prompt_budget.Config.PROMPT_TRANSCRIPTION_BUDGETS, "profile_extraction", tokens)
+    return set_budget
+
+
+OPENING = "Hola, me llamo Ana García y soy ingeniera de software en Madrid."
+FACTS = [
+    "Tengo 8 años de experiencia en Python, Django y AWS.",
+    "Estudié Ingeniería Informática en la Universidad Politécnica.",
+    "Lideré un equipo de 5 personas en un proyecto de pagos.",
+    "Hablo inglés y francés con fluidez.",
+]
+FILLER = "Bueno, eh, pues me gusta mucho mucho lo que hago, o sea, de verdad."
+
+
+def test_short_text_is_unchanged(budget):
+    budget(1000)
+    assert fit_transcription("profile_extraction", OPENING) == OPENING
+
+
+def test_disabled_or_unbudgeted_tasks_are_unchanged(budget, monkeypatch):
+    budget(1)
+    assert fit_transcription("technical_test", OPENING * 50) == OPENING * 50
+    monkeypatch.setattr(prompt_budget.Config, "PROMPT_BUDGET_ENABLED", False)
+    assert fit_transcription("profile_extraction", OPENING * 50) == OPENING * 50
+
+
+def test_repeated_sentences_and_filler_are_removed_first(budget):
+    text = " ".join([OPENING, *FACTS, FILLER] * 3)
+    budget(count_tokens(text) - 1)
+    result = fit_transcription("profile_extraction", text)
+    assert result.count("8 años") == 1
+    assert " eh," not in result and "mucho mucho" not in result
+    assert GAP.strip() not in result
+
+
+def test_condensing_keeps_the_opening_and_informative_sentences_in_order(budget):
+    chatter = [f"Me gusta salir a caminar los domingos por la mañana número {i}." for i in range(40)]
+    text = " ".join([OPENING, *FACTS, *chatter])
+    budget(count_tokens(" ".join([OPENING, *FACTS])) + 30)
+    result = fit_transcription("profile_extraction", text)
+    assert count_tokens(result) <= count_tokens(" ".join([OPENING, *FACTS])) + 30
+    assert result.startswith(OPENING)
+    positions = [result.find(fact) for fact in FACTS if fact in result]
+    assert len(positions) >= 3 and positions == sorted(positions)
+    assert GAP.strip() in result
+
+
+def test_result_never_exceeds_the_budget(budget):
+    # One long unpunctuated sentence cannot be condensed, only cut
+    text = " ".join(f"palabra{i}" for i in range(3000))
+    budget(200)
+    result = fit_transcription("profile_extraction", text)
+    assert 0 < count_tokens(result) <= 200
+
+
+def test_output_budget_uses_the_models_context_window(budget, monkeypatch):
+    monkeypatch.setattr(prompt_budget.Config, "MODEL_CONTEXT_TOKENS", {"groq": 131072, "groq:small": 1000})
+    monkeypatch.setattr(prompt_budget.Config, "MODEL_CONTEXT_TOKENS_DEFAULT", 2000)
+    prompt = " ".join(f"palabra{i}" for i in range(400))
+    prompt_tokens = count_tokens(prompt)
+    assert 1000 - prompt_budget.CONTEXT_MARGIN < prompt_tokens < 2000 - prompt_budget.CONTEXT_MARGIN - MIN_OUTPUT_TOKENS
+    assert output_budget("technical_test", prompt, 4000, provider="groq", model="large") == 4000
+    assert output_budget("technical_test", prompt, 4000, provider="groq", model="small") == MIN_OUTPUT_TOKENS
+    # Not listed: the default window
+    assert output_budget("technical_test", prompt, 4000, provider="gemini") == 2000 - prompt_tokens - prompt_budget.CONTEXT_MARGIN
@@ -0,0 +1,54 @@
+import pytest
+from database import PromptRepository, PromptTemplateError
+from database.prompt_sets import (
+    ACTIVE_SET_NAME, check_prompt_name, compile_update, pointer_update, prompt_document, prompt_filter,
+    stale_sets_filter, staged_documents
+)
+
+DEFAULTS = PromptRepository.DEFAULT_PROMPTS
+
+
+def test_prompt_filter():
+    assert prompt_filter("s2") == {"set_version": "s2"}
+    assert prompt_filter("s2", "cv_generation") == {"set_version": "s2", "name": "cv_generation"}
+    # Before any set exists, everything but the pointer
+    assert prompt_filter(None) == {"name": {"$ne": ACTIVE_SET_NAME}}
+    assert prompt_filter(None, "cv_generation") == {"name": "cv_generation"}
+
+
+def test_staged_documents_carry_set_and_content_version():
+    documents = staged_documents(DEFAULTS, "s2")
+    assert [d["name"] for d in documents] == list(DEFAULTS)
+    assert all(d["set_version"] == "s2" and len(d["version"]) == 16 for d in documents)
+    assert "set_version" not in prompt_document(DEFAULTS["cv_generation"])
+    assert "version" not in DEFAULTS["cv_generation"]
+
+
+def test_pointer_keeps_the_previous_set():
+    assert pointer_update("s2", {"version": "s1"})["previous"] == "s1"
+    assert pointer_update("s1", None)["previous"] is None
+    assert stale_sets_filter("s2", {"version": "s1"})["set_version"] == {"$nin": ["s2", "s1"]}
+    assert stale_sets_filter("s1", None)["set_version"] == {"$nin": ["s1"]}
+
+
+@pytest.mark.parametrize("name", [ACTIVE_SET_NAME, "__other__"])
+def test_reserved_names_cannot_be_updated(name):
+    with pytest.raises(PromptTemplateError, match="reserved"):
+        check_prompt_name(name)
+
+
+@pytest.mark.parametrize("name", list(DEFAULTS) + ["custom_prompt"])
+def test_other_names_can_be_updated(name):
+    check_prompt_name(name)
+
+
+def test_compile_update_validates_against_stored_or_default_variables():
+    prompt, update = compile_update("profile_extraction", "Extract: {text}", None, DEFAULTS)
+    assert update["$set"]["version"] == prompt.version
+    assert update["$set"]["variables"] == ["text"]
+
+    with pytest.raises(PromptTemplateError, match="undeclared"):
+        compile_update("profile_extraction", "{transcription}", None, DEFAULTS)
+    # Stored variables take precedence over the defaults
+    _, update = compile_update("profile_extraction", "{transcription}", {"variables": ["transcription"]}, DEFAULTS)
+    assert update["$set"]["template"] == "{transcription}"
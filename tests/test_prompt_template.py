@@ -0,0 +1,58 @@
+import pytest
+from database import PromptRepository
+from database.prompt_template import CompiledPrompt, PromptTemplateError
+
+
+def test_render_substitutes_variables():
+    prompt = CompiledPrompt("greeting", "Hola {name}, {{literal}} {name}", ["name"])
+    assert prompt.render(name="Ana", unused=1) == "Hola Ana, {literal} Ana"
+    assert prompt.fields == {"name"}
+    assert prompt.variables == ("name",)
+
+
+def test_version_is_a_content_hash():
+    assert CompiledPrompt("a", "text {x}").version == CompiledPrompt("b", "text {x}").version
+    assert CompiledPrompt("a", "text {x}").version != CompiledPrompt("a", "text  {x}").version
+    assert CompiledPrompt("a", "text").version == CompiledPrompt.compute_version("text")
+
+
+def test_variables_default_to_the_fields_used():
+    assert CompiledPrompt("p", "{b} {a} {b}").variables == ("a", "b")
+
+
+def test_declared_variables_may_go_unused():
+    assert CompiledPrompt("p", "no fields", ["text"]).render() == "no fields"
+
+
+@pytest.mark.parametrize("template, message", [
+    ("", "empty template"),
+    ("   ", "empty template"),
+    ("{text} {other}", "undeclared variables: other"),
+    ("{text", "malformed"),
+    ("text}", "malformed"),
+    ("{0}", "unsupported field"),
+    ("{text.attr}", "unsupported field"),
+    ("{text[0]}", "unsupported field"),
+    ("{text:>10}", "format specs"),
+    ("{text!r}", "format specs"),
+])
+def test_invalid_templates_are_rejected(template, message):
+    with pytest.raises(PromptTemplateError, match=message):
+        CompiledPrompt("p", template, ["text"])
+
+
+def test_missing_variables_are_reported():
+    prompt = CompiledPrompt("p", "{a} {b}")
+    with pytest.raises(PromptTemplateError, match="missing variables: b"):
+        prompt.render(a=1)
+
+
+def test_prompt_template_error_is_a_value_error():
+    assert issubclass(PromptTemplateError, ValueError)
+
+
+@pytest.mark.parametrize("name", list(PromptRepository.DEFAULT_PROMPTS))
+def test_default_prompts_compile(name):
+    default = PromptRepository.DEFAULT_PROMPTS[name]
+    prompt = CompiledPrompt(name, default["template"], default["variables"])
+    assert prompt.fields == set(default["variables"])
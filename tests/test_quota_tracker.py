@@ -0,0 +1,93 @@
+import pytest
+from services import quota_tracker
+from services.quota_tracker import QuotaTracker
+
+
+class FakeClock:
+    def __init__(self, now: float):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # Start of a minute, so window boundaries are easy to reason about
+    clock = FakeClock(1_700_000_040.0)
+    monkeypatch.setattr(quota_tracker, "time", clock)
+    return clock
+
+
+def test_provider_without_limits_always_has_headroom(clock):
+    tracker = QuotaTracker(limits={})
+    tracker.record("groq", "model", tokens=10**9)
+    assert tracker.has_headroom("groq", "model", tokens=10**9)
+
+
+def test_minute_window_rolls_over(clock):
+    tracker = QuotaTracker(limits={"groq": {"requests_per_minute": 2}})
+    tracker.record("groq", None)
+    tracker.record("groq", None)
+    assert not tracker.has_headroom("groq")
+    assert tracker.seconds_until_headroom("groq") == pytest.approx(60)
+
+    clock.now += 59
+    assert not tracker.has_headroom("groq")
+    clock.now += 1
+    assert tracker.has_headroom("groq")
+    assert tracker.seconds_until_headroom("groq") == 0.0
+
+
+def test_hour_window_counts_the_last_sixty_minutes(clock):
+    tracker = QuotaTracker(limits={"groq": {"tokens_per_hour": 1000}})
+    tracker.record("groq", None, tokens=600)
+    clock.now += 30 * 60
+    tracker.record("groq", None, tokens=300)
+    assert tracker.has_headroom("groq", tokens=100)
+    assert not tracker.has_headroom("groq", tokens=101)
+
+    # The first call's minute leaves the window
+    clock.now += 30 * 60
+    assert tracker.has_headroom("groq", tokens=700)
+    assert tracker.snapshot()["providers"]["groq"]["default"]["hour"]["tokens"] == 300
+
+
+def test_day_window_and_forecast(clock):
+    tracker = QuotaTracker(limits={"gemini": {"audio_seconds_per_day": 1000}})
+    tracker.record("gemini", None, audio_seconds=400)
+    clock.now += 2 * 3600
+    assert tracker.has_headroom("gemini", audio_seconds=600)
+    assert not tracker.has_headroom("gemini", audio_seconds=601)
+
+    snapshot = tracker.snapshot()["providers"]["gemini"]["default"]
+    assert snapshot["day"]["audio_seconds"] == 400
+    assert snapshot["hour"]["audio_seconds"] == 0
+    forecast = snapshot["forecast"]["audio_seconds_per_day"]
+    assert forecast["remaining"] == 600
+    assert forecast["exhausted_in_seconds"] is None  # Nothing used in the last hour
+
+
+def test_model_limits_take_precedence(clock):
+    tracker = QuotaTracker(limits={"groq": {"requests_per_minute": 100}, "groq:small": {"requests_per_minute": 1}})
+    tracker.record("groq", "small")
+    assert not tracker.has_headroom("groq", "small")
+    assert tracker.has_headroom("groq", "large")
+
+
+def test_low_priority_leaves_the_reserve_free(clock, monkeypatch):
+    monkeypatch.setattr(quota_tracker.Config, "QUOTA_LOW_PRIORITY_RESERVE", 0.2)
+    tracker = QuotaTracker(limits={"groq": {"requests_per_minute": 10}})
+    for _ in range(8):
+        tracker.record("groq", None)
+    assert tracker.has_headroom("groq")
+    assert not tracker.has_headroom("groq", priority="low")
+
+
+def test_rate_limit_cooldown(clock):
+    tracker = QuotaTracker(limits={})
+    tracker.mark_rate_limited("groq", seconds=30)
+    assert not tracker.has_headroom("groq")
+    assert tracker.seconds_until_headroom("groq") == pytest.approx(30)
+    clock.now += 30
+    assert tracker.has_headroom("groq")
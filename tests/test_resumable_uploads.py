@@ -0,0 +1,51 @@
+import asyncio
+import base64
+import hashlib
+import pytest
+from services import resumable_uploads
+from services.resumable_uploads import CHECKSUM_MISMATCH, ResumableUploadStore, UploadError
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(resumable_uploads.Config, "UPLOAD_EARLY_EXTRACTION", False)
+    return ResumableUploadStore(video_processor=None, directory=str(tmp_path))
+
+
+async def body(*pieces: bytes):
+    for piece in pieces:
+        yield piece
+
+
+def checksum(data: bytes) -> str:
+    return "sha256 " + base64.b64encode(hashlib.sha256(data).digest()).decode()
+
+
+def test_chunks_are_appended_at_the_offset(store):
+    upload_id = store.create("video.webm", 6)["upload_id"]
+    result = asyncio.run(store.write_chunk(upload_id, 0, checksum(b"abc"), body(b"a", b"bc")))
+    assert result == {"upload_id": upload_id, "offset": 3, "status": "uploading"}
+    with pytest.raises(UploadError) as info:
+        asyncio.run(store.write_chunk(upload_id, 0, checksum(b"abc"), body(b"abc")))
+    assert (info.value.status_code, info.value.offset) == (409, 3)
+    assert asyncio.run(store.write_chunk(upload_id, 3, checksum(b"def"), body(b"def")))["status"] == "processing"
+    assert store.status(upload_id)["offset"] == 6
+
+
+def test_chunk_with_a_wrong_checksum_is_cut_off(store):
+    upload_id = store.create("video.webm", 6)["upload_id"]
+    with pytest.raises(UploadError) as info:
+        asyncio.run(store.write_chunk(upload_id, 0, checksum(b"xyz"), body(b"abc")))
+    assert info.value.status_code == CHECKSUM_MISMATCH
+    assert store.status(upload_id)["offset"] == 0
+
+
+@pytest.mark.skipif(resumable_uploads.fcntl is None, reason="Chunks are serialized per process without fcntl")
+def test_other_workers_cannot_write_while_a_chunk_is_written(store, tmp_path):
+    upload_id = store.create("video.webm", 6)["upload_id"]
+    other_worker = ResumableUploadStore(video_processor=None, directory=str(tmp_path))
+    with store._claim(upload_id, 0):
+        with pytest.raises(UploadError) as info:
+            asyncio.run(other_worker.write_chunk(upload_id, 0, checksum(b"abc"), body(b"abc")))
+        assert info.value.status_code == 409
+    assert asyncio.run(other_worker.write_chunk(upload_id, 0, checksum(b"abc"), body(b"abc")))["offset"] == 3
@@ -0,0 +1,15 @@
+from database.technical_test_repository import technical_test_key
+
+
+def test_key_ignores_formatting_differences():
+    profile = {"profession": "Backend Developer", "technologies": "Python, Django", "experience": "5 años"}
+    same = {"profession": "  backend developer", "technologies": "django,python", "experience": "5 anos",
+            "education": "Not specified"}
+    assert technical_test_key(profile, "v1") == technical_test_key(same, "v1")
+    assert technical_test_key(profile, "v1") != technical_test_key(profile, "v2")
+
+
+def test_key_is_scoped_to_the_tenant():
+    profile = {"profession": "Backend Developer", "technologies": "Python"}
+    assert technical_test_key(profile, "v1", "acme") != technical_test_key(profile, "v1", "globex")
+    assert technical_test_key(profile, "v1", "acme") != technical_test_key(profile, "v1")
@@ -0,0 +1,183 @@
+import asyncio
+import pytest
+from services import tenancy
+from services.tenancy import FairQueue, Tenant, TenantLimitExceeded, TenantRegistry, TokenBucket, tenant_context
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(tenancy, "time", clock)
+    return clock
+
+
+def test_bucket_refills_evenly(clock):
+    bucket = TokenBucket(capacity=60, period=60)
+    assert bucket.take(60) == 0.0
+    assert bucket.take(1) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert bucket.take(1) == pytest.approx(0.5)  # Nothing taken while refusing
+    clock.now += 0.5
+    assert bucket.take(1) == 0.0
+    clock.now += 1000
+    assert bucket.level() == 60
+
+
+def test_full_bucket_grants_more_than_capacity_as_debt(clock):
+    bucket = TokenBucket(capacity=10, period=10)
+    assert bucket.take(25) == 0.0
+    assert bucket.level() == pytest.approx(-15)
+    # The debt is paid back before anything else is granted
+    assert bucket.take(1) == pytest.approx(16)
+    clock.now += 16
+    assert bucket.take(1) == 0.0
+
+
+def test_partial_bucket_waits_for_capacity_before_a_large_take(clock):
+    bucket = TokenBucket(capacity=10, period=10)
+    bucket.take(4)
+    assert bucket.take(25) == pytest.approx(4)
+    assert bucket.level() == pytest.approx(6)
+
+
+def test_admit_request_raises_with_retry_after(clock):
+    tenant = Tenant("acme", requests_per_minute=2)
+    tenant.admit_request()
+    tenant.admit_request()
+    with pytest.raises(TenantLimitExceeded) as info:
+        tenant.admit_request()
+    assert info.value.retry_after == pytest.approx(30)
+    assert tenant.counts == {"allowed": 2, "limited": 1, "audio_limited": 0}
+
+
+def test_charge_audio_refuses_beyond_the_maximum_wait(clock, monkeypatch):
+    monkeypatch.setattr(tenancy.Config, "TENANT_AUDIO_MAX_WAIT", 5)
+    tenant = Tenant("acme", audio_minutes_per_hour=1)
+    asyncio.run(tenant.charge_audio(120))  # Long video from a full bucket: granted, in debt
+    with pytest.raises(TenantLimitExceeded):
+        asyncio.run(tenant.charge_audio(10))
+    assert tenant.audio_seconds == 120
+    assert tenant.counts["audio_limited"] == 1
+
+
+def test_registry_resolves_keys():
+    registry = TenantRegistry({"acme": {"api_key": "k1", "weight": 2}, "globex": {"api_keys": ["k2", "k3"]}})
+    assert registry.enabled
+    assert registry.resolve("k1").name == "acme"
+    assert registry.resolve("k3").name == "globex"
+    assert registry.resolve("wrong") is None
+    assert registry.resolve(None) is None
+    assert registry.get("missing") is registry.default
+
+
+def test_registry_without_tenants_uses_the_default_for_everyone():
+    registry = TenantRegistry({})
+    assert not registry.enabled
+    assert registry.resolve(None) is registry.default
+    assert registry.resolve("anything") is registry.default
+
+
+async def hold(queue: FairQueue, tenant: Tenant, order: list, release: asyncio.Event, cost: float = 1.0):
+    async with queue.slot(cost, tenant=tenant):
+        order.append(tenant.name)
+        await release.wait()
+
+
+def test_fair_queue_shares_slots_by_weight():
+    async def scenario():
+        queue = FairQueue("ai", slots=1, default=Tenant("default"))
+        bulk, interactive = Tenant("bulk"), Tenant("interactive", weight=2)
+        order = []
+        blocker, done = asyncio.Event(), asyncio.Event()
+        done.set()
+        first = asyncio.create_task(hold(queue, Tenant("first"), order, blocker))
+        await asyncio.sleep(0)
+        tasks = [asyncio.create_task(hold(queue, tenant, order, done)) for tenant in [bulk] * 4 + [interactive] * 4]
+        await asyncio.sleep(0)
+        assert bulk.queue["ai"]["queued"] == 4 and interactive.queue["ai"]["queued"] == 4
+        blocker.set()
+        await asyncio.gather(first, *tasks)
+        return order[1:]
+
+    order = asyncio.run(scenario())
+    # Twice the weight, twice the share while both are backlogged
+    assert order == ["interactive", "bulk", "interactive", "interactive", "bulk", "interactive", "bulk", "bulk"]
+
+
+def test_fair_queue_is_fifo_for_one_tenant():
+    async def job(queue: FairQueue, number: int, order: list, release: asyncio.Event):
+        async with queue.slot():
+            order.append(number)
+            await release.wait()
+
+    async def scenario():
+        queue = FairQueue("ffmpeg", slots=2, default=Tenant("default"))
+        acme = Tenant("acme")
+        order = []
+        release = asyncio.Event()
+        # Tasks copy the context, so the slots are charged to the current tenant
+        with tenant_context(acme):
+            tasks = [asyncio.create_task(job(queue, number, order, release)) for number in range(5)]
+        await asyncio.sleep(0)
+        assert queue.busy == 2 and order == [0, 1]
+        assert acme.queue["ffmpeg"]["queued"] == 3
+        release.set()
+        await asyncio.gather(*tasks)
+        return order, queue.busy, acme.queue["ffmpeg"]["waits"]
+
+    order, busy, waits = asyncio.run(scenario())
+    assert order == [0, 1, 2, 3, 4]
+    assert (busy, waits) == (0, 5)
+
+
+def test_cancelled_waiter_gives_up_its_turn():
+    async def scenario():
+        queue = FairQueue("ai", slots=1, default=Tenant("default"))
+        a, b = Tenant("a"), Tenant("b")
+        order = []
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(queue, Tenant("first"), order, release))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(hold(queue, a, order, release))
+        waiting = asyncio.create_task(hold(queue, b, order, release))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert a.queue["ai"]["queued"] == 0
+        release.set()
+        await asyncio.gather(first, waiting)
+        assert cancelled.cancelled()
+        return order, queue.busy, b.queue["ai"]["queued"]
+
+    order, busy, queued = asyncio.run(scenario())
+    assert order == ["first", "b"]
+    assert (busy, queued) == (0, 0)
+
+
+def test_waiter_cancelled_after_its_grant_releases_the_slot():
+    async def scenario():
+        queue = FairQueue("ai", slots=1, default=Tenant("default"))
+        order = []
+        release = asyncio.Event()
+        first = asyncio.create_task(hold(queue, Tenant("first"), order, release))
+        await asyncio.sleep(0)
+        granted = asyncio.create_task(hold(queue, Tenant("a"), order, asyncio.Event()))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.sleep(0)  # "first" leaves and hands the slot to "a", which has not resumed yet
+        assert first.done() and queue.busy == 1
+        granted.cancel()
+        await asyncio.gather(granted, return_exceptions=True)
+        return order, queue.busy
+
+    order, busy = asyncio.run(scenario())
+    assert order == ["first"]
+    assert busy == 0
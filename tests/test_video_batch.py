@@ -0,0 +1,89 @@
+import io
+import tarfile
+import zipfile
+import pytest
+from services import video_batch
+from services.video_batch import is_archive, iter_entries
+
+
+def zip_upload(files: dict) -> io.BytesIO:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    buffer.seek(0)
+    return buffer
+
+
+def tar_upload(files: dict, mode: str = "w:gz") -> io.BytesIO:
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode=mode) as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    buffer.seek(0)
+    return buffer
+
+
+ARCHIVE_FILES = {
+    "ana.mp4": b"ana",
+    "notes.txt": b"skip",
+    "sub/luis.WEBM": b"luis",
+    "__MACOSX/._ana.mp4": b"meta",
+    ".hidden.mp4": b"hidden",
+}
+
+
+def read_all(uploads) -> list:
+    """(name, content or None, error) per entry, read before the next one is requested"""
+    return [(name, stream.read() if stream else None, error) for name, stream, error in iter_entries(uploads)]
+
+
+def test_is_archive():
+    assert is_archive("Videos.ZIP") and is_archive("v.tar.gz") and is_archive("v.tgz")
+    assert not is_archive("video.mp4") and not is_archive(None)
+
+
+def test_plain_uploads_pass_through():
+    video = io.BytesIO(b"data")
+    assert read_all([("video.mp4", video)]) == [("video.mp4", b"data", None)]
+
+
+def test_zip_entries_are_filtered_to_videos():
+    assert read_all([("batch.zip", zip_upload(ARCHIVE_FILES))]) == [
+        ("batch.zip/ana.mp4", b"ana", None),
+        ("batch.zip/sub/luis.WEBM", b"luis", None),
+    ]
+
+
+@pytest.mark.parametrize("filename, mode", [("batch.tar.gz", "w:gz"), ("batch.tar", "w"), ("batch.tar.xz", "w:xz")])
+def test_tar_entries_are_streamed_in_order(filename, mode):
+    assert read_all([(filename, tar_upload(ARCHIVE_FILES, mode))]) == [
+        (f"{filename}/ana.mp4", b"ana", None),
+        (f"{filename}/sub/luis.WEBM", b"luis", None),
+    ]
+
+
+def test_oversized_entries_yield_an_error(monkeypatch):
+    monkeypatch.setattr(video_batch, "_too_large", lambda size: "Entry too large" if size > 3 else None)
+    entries = read_all([("batch.zip", zip_upload({"ana.mp4": b"ana", "luis.mp4": b"luis"}))])
+    assert entries == [("batch.zip/ana.mp4", b"ana", None), ("batch.zip/luis.mp4", None, "Entry too large")]
+
+
+def test_unreadable_archive_yields_an_error_and_the_batch_goes_on():
+    entries = read_all([
+        ("broken.zip", io.BytesIO(b"not a zip")),
+        ("broken.tgz", io.BytesIO(b"not a tar")),
+        ("video.mp4", io.BytesIO(b"data")),
+    ])
+    assert [(name, error is not None) for name, _, error in entries] == [
+        ("broken.zip", True), ("broken.tgz", True), ("video.mp4", False)
+    ]
+    assert entries[0][2].startswith("Unreadable archive")
+
+
+def test_entries_are_read_lazily():
+    entries = iter_entries([("batch.zip", zip_upload(ARCHIVE_FILES)), ("bad.zip", io.BytesIO(b"x"))])
+    name, stream, _ = next(entries)
+    assert (name, stream.read()) == ("batch.zip/ana.mp4", b"ana")
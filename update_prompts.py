@@ -1,6 +1,7 @@
 """
 Script to force update prompts in MongoDB with the corrected templates
 """
+from config import Config
 from database import PromptRepository
 
 def update_prompts():
@@ -9,27 +10,21 @@ def update_prompts():
     
     print("Forcing update of all prompts in MongoDB...")
     
-    # Get MongoDB collection
-    if not prompt_repo.db_client.is_connected():
+    # The connection is established in the background; give it a few attempts
+    if not prompt_repo.db_client.wait_until_connected(Config.MONGODB_SERVER_SELECTION_TIMEOUT_MS / 1000 * 3):
         print("ERROR: Cannot connect to MongoDB")
         return
     
-    collection = prompt_repo.db_client.database[prompt_repo.collection_name]
-    
-    # Delete all existing prompts
-    result = collection.delete_many({})
-    print(f"Deleted {result.deleted_count} existing prompts")
-    
-    # Insert updated prompts from DEFAULT_PROMPTS
-    collection.insert_many(list(prompt_repo.DEFAULT_PROMPTS.values()))
-    print(f"Inserted {len(prompt_repo.DEFAULT_PROMPTS)} updated prompts")
+    # Stage the defaults as a new prompt set and flip the active pointer
+    result = prompt_repo.reset_prompts()
+    if result is None:
+        print("ERROR: Reset failed")
+        return
+    print(f"Activated prompt set {result['set_version']} with {result['inserted']} prompts")
+    print(f"Deleted {result['deleted']} prompts from older sets")
     
     # Verify
-    count = collection.count_documents({})
-    print(f"Total prompts in database: {count}")
-    
-    # List prompts
-    prompts = [doc["name"] for doc in collection.find({}, {"name": 1})]
+    prompts = prompt_repo.list_prompts()
     print(f"Prompts: {prompts}")
     
     print("\n✅ Prompts updated successfully!")
@@ -1,3 +1,3 @@
-from .logger import setup_logger
+from .logger import setup_logger, log_context, get_request_id
 
-__all__ = ['setup_logger']
+__all__ = ['setup_logger', 'log_context', 'get_request_id']
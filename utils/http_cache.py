@@ -0,0 +1,144 @@
+"""
+HTTP caching: precompressed static bodies, ETags and conditional GET
+
+Static pages are compressed once, when they are built, in every encoding
+available (gzip always; brotli and zstd when their packages are installed),
+and each request gets the variant its Accept-Encoding prefers. Responses
+that already carry a Content-Encoding pass through GZipMiddleware untouched.
+Dynamic responses get an ETag from the version of what they render; a
+matching If-None-Match is answered with 304 without rendering anything.
+ETags are weak because the same content is served in several encodings.
+"""
+import gzip
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional, Union
+from starlette.requests import Request
+from starlette.responses import Response
+from utils.metrics import HTTP_CACHE_RESPONSES
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Preferred first when a client accepts several encodings equally
+ENCODING_PREFERENCE = ("zstd", "br", "gzip")
+
+
+def _compressors() -> Dict[str, Callable[[bytes], bytes]]:
+    """Maximum-ratio compressors; compression happens once per body, so speed does not matter"""
+    compressors = {"gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressors["br"] = lambda data: brotli.compress(data, quality=11)
+    if zstandard is not None:
+        compressors["zstd"] = zstandard.ZstdCompressor(level=19).compress
+    return compressors
+
+
+def make_etag(*parts: str) -> str:
+    """Weak ETag from version strings (a single hash-like version is used as is)"""
+    if len(parts) == 1 and parts[0].isalnum():
+        return f'W/"{parts[0]}"'
+    return f'W/"{hashlib.sha256(chr(0).join(parts).encode()).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Whether If-None-Match lists the ETag (weak comparison, as RFC 9110 requires for it)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+
+def choose_encoding(accept_encoding: Optional[str], available) -> Optional[str]:
+    """The available encoding the client ranks highest, None for the uncompressed body"""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    wildcard = qualities.get("*", 0.0)
+    ranked = [
+        (qualities.get(encoding, wildcard), -ENCODING_PREFERENCE.index(encoding), encoding)
+        for encoding in ENCODING_PREFERENCE if encoding in available
+    ]
+    quality, _, encoding = max(ranked, default=(0.0, 0, None))
+    return encoding if quality > 0 else None
+
+
+def not_modified(endpoint: str, headers: dict) -> Response:
+    HTTP_CACHE_RESPONSES.labels(endpoint, "not_modified").inc()
+    return Response(status_code=304, headers=headers)
+
+
+class StaticBody:
+    """A fixed response body with its precompressed variants and ETag"""
+
+    def __init__(self, endpoint: str, content: Union[str, bytes], media_type: str, cache_control: str):
+        self.endpoint = endpoint
+        self.body = content.encode("utf-8") if isinstance(content, str) else content
+        self.media_type = media_type
+        self.cache_control = cache_control
+        self.etag = make_etag(hashlib.sha256(self.body).hexdigest()[:16])
+        self.variants = {}
+        for encoding, compress in _compressors().items():
+            compressed = compress(self.body)
+            if len(compressed) < len(self.body):
+                self.variants[encoding] = compressed
+
+    def respond(self, request: Request) -> Response:
+        headers = {"ETag": self.etag, "Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), self.etag):
+            return not_modified(self.endpoint, headers)
+
+        encoding = choose_encoding(request.headers.get("accept-encoding"), self.variants)
+        body = self.body
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+            body = self.variants[encoding]
+        HTTP_CACHE_RESPONSES.labels(self.endpoint, encoding or "identity").inc()
+        return Response(body, media_type=self.media_type, headers=headers)
+
+
+class VersionedJSON:
+    """JSON bodies serialized once per version, with conditional GET on the version's ETag"""
+
+    def __init__(self, endpoint: str, cache_control: str):
+        self.endpoint = endpoint
+        self.cache_control = cache_control
+        self._bodies: Dict[str, tuple] = {}  # key -> (etag, serialized body)
+
+    def respond(self, request: Request, key: str, etag: str, render: Callable[[], Any]) -> Response:
+        """
+        The body `render` returns for this version of `key`
+
+        render is only called when the ETag differs from the one last served for the key.
+        """
+        headers = {"ETag": etag, "Cache-Control": self.cache_control}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(self.endpoint, headers)
+
+        entry = self._bodies.get(key)
+        if entry is None or entry[0] != etag:
+            # Serialized like JSONResponse
+            body = json.dumps(render(), ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+            entry = self._bodies[key] = (etag, body)
+        HTTP_CACHE_RESPONSES.labels(self.endpoint, "full").inc()
+        return Response(entry[1], media_type="application/json", headers=headers)
@@ -1,38 +1,214 @@
 """
 Centralized logging configuration
+
+Records are handed to a QueueHandler on the calling thread and written by a
+single QueueListener thread, so slow stdout/log drivers never block request
+threads. Output is one JSON object per line carrying the request context
+(request id, stage, provider) set with log_context().
 """
+import atexit
+import contextvars
+import json
 import logging
+import logging.handlers
+import queue
+import random
 import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from config import Config
+
+
+ROOT_LOGGER_NAME = "video_profile_api"
+
+# Request-scoped fields attached to every record
+_request_id = contextvars.ContextVar("request_id", default=None)
+_stage = contextvars.ContextVar("stage", default=None)
+_provider = contextvars.ContextVar("provider", default=None)
+_tenant = contextvars.ContextVar("tenant", default=None)
+_CONTEXT_VARS = {"request_id": _request_id, "stage": _stage, "provider": _provider, "tenant": _tenant}
+
+# Attributes of a plain LogRecord; anything else came in through `extra`
+_RESERVED_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_listener = None
+
+
+@contextmanager
+def log_context(**fields):
+    """
+    Attach request_id/stage/provider/tenant to every record logged inside the block
+
+    Context variables follow asyncio tasks; use contextvars.copy_context()
+    when handing work to an executor thread.
+    """
+    tokens = [(_CONTEXT_VARS[key], _CONTEXT_VARS[key].set(value)) for key, value in fields.items()]
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def get_request_id():
+    """Current request id or None outside a request"""
+    return _request_id.get()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single-line JSON with context and extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+
+        for key, value in vars(record).items():
+            if key not in _RESERVED_ATTRS and value is not None:
+                entry[key] = value
+
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable format for local development"""
+
+    def __init__(self):
+        super().__init__('[%(asctime)s] %(levelname)s - %(name)s - %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        extras = {k: v for k, v in vars(record).items() if k not in _RESERVED_ATTRS and v is not None}
+        if extras:
+            line += " " + " ".join(f"{k}={v}" for k, v in extras.items())
+        return line
+
+
+class PayloadSampler(logging.Filter):
+    """
+    Sample records that carry a verbose `payload` extra (raw model output etc.)
+
+    Unsampled payload records are dropped before they are queued; sampled
+    ones have the payload truncated to LOG_PAYLOAD_MAX_CHARS.
+    """
+
+    def __init__(self, rate: float, max_chars: int):
+        super().__init__()
+        self.rate = rate
+        self.max_chars = max_chars
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        payload = getattr(record, "payload", None)
+        if payload is None:
+            return True
+
+        if self.rate <= 0 or (self.rate < 1 and random.random() >= self.rate):
+            return False
+
+        payload = str(payload)
+        if len(payload) > self.max_chars:
+            record.payload = payload[:self.max_chars] + f"... [{len(payload)} chars]"
+        return True
+
+
+class ContextFilter(logging.Filter):
+    """Copy context variables onto the record on the calling thread"""
 
+    def filter(self, record: logging.LogRecord) -> bool:
+        for key, var in _CONTEXT_VARS.items():
+            if getattr(record, key, None) is None:
+                setattr(record, key, var.get())
+        return True
 
-def setup_logger(name: str = "video_profile_api") -> logging.Logger:
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+
+    dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            NonBlockingQueueHandler.dropped += 1
+
+    def prepare(self, record):
+        # Resolve message and traceback here (frames are only valid on this thread),
+        # leave JSON formatting to the listener thread
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        record.stack_info = None
+        return record
+
+
+def setup_logger(name: str = ROOT_LOGGER_NAME) -> logging.Logger:
     """
     Setup and configure logger
-    
+
+    The first call installs the queue handler on the root application logger
+    and starts the listener thread; other names are returned as children.
+
     Args:
-        name: Logger name
-        
+        name: Logger name (short names become children of the application logger)
+
     Returns:
         Configured logger instance
     """
-    logger = logging.getLogger(name)
-    
-    if logger.handlers:
-        return logger
-    
-    logger.setLevel(logging.INFO)
-    
-    # Console handler
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setLevel(logging.INFO)
-    
-    # Format
-    formatter = logging.Formatter(
-        '[%(asctime)s] %(levelname)s - %(name)s - %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
-    )
-    handler.setFormatter(formatter)
-    
-    logger.addHandler(handler)
-    
-    return logger
+    global _listener
+
+    root = logging.getLogger(ROOT_LOGGER_NAME)
+
+    if _listener is None and not root.handlers:
+        level = getattr(logging, Config.LOG_LEVEL.upper(), logging.INFO)
+        root.setLevel(level)
+        root.propagate = False
+
+        # Writer side: runs on the listener thread
+        stream_handler = logging.StreamHandler(sys.stdout)
+        stream_handler.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else TextFormatter())
+
+        # Caller side: cheap enqueue on request threads
+        log_queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+        queue_handler = NonBlockingQueueHandler(log_queue)
+        queue_handler.addFilter(PayloadSampler(Config.LOG_PAYLOAD_SAMPLE_RATE, Config.LOG_PAYLOAD_MAX_CHARS))
+        queue_handler.addFilter(ContextFilter())
+        root.addHandler(queue_handler)
+
+        _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+    if name == ROOT_LOGGER_NAME or name.startswith(ROOT_LOGGER_NAME + "."):
+        return logging.getLogger(name)
+    return root.getChild(name)
+
+
+def shutdown_logging():
+    """Flush queued records and stop the listener thread"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class Timer:
+    """Measure elapsed milliseconds for a `duration_ms` log field"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+
+    @property
+    def ms(self) -> float:
+        return round((time.perf_counter() - self.start) * 1000, 1)
@@ -0,0 +1,163 @@
+"""
+Memory admission for video jobs
+
+Each job's peak memory is estimated from its audio duration (PCM buffers of
+local transcription and inline provider uploads grow with it, FFmpeg and the
+pipeline add a fixed amount) and jobs run only while the reservations of all
+running jobs fit MEMORY_BUDGET_MB. Later jobs wait in arrival order, so one
+large video is not overtaken forever by small ones. The budget is per worker
+process; actual resident memory (this process and its FFmpeg/transcription
+children) is exported next to the reservations to check the estimates.
+"""
+import asyncio
+import os
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from config import Config
+from utils.logger import setup_logger
+from utils.metrics import (
+    MEMORY_ADMISSIONS, MEMORY_ADMISSION_WAITING, MEMORY_BUDGET_BYTES, MEMORY_RESERVED_BYTES, MEMORY_RSS_BYTES
+)
+
+logger = setup_logger("memory")
+
+# Video bitrate assumed when a container states no duration; low, so the estimate errs high
+ASSUMED_VIDEO_BYTES_PER_SECOND = 128 * 1024
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+class MemoryBudgetExceeded(Exception):
+    """A job could not be admitted within MEMORY_ADMISSION_TIMEOUT"""
+
+
+def _statm_rss(pid: str) -> int:
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def rss_bytes() -> int:
+    """Resident memory of this process (0 where /proc is unavailable)"""
+    return _statm_rss("self")
+
+
+def children_rss_bytes() -> int:
+    """Resident memory of this process's direct children (FFmpeg, transcription workers)"""
+    total = 0
+    try:
+        tasks = os.listdir("/proc/self/task")
+    except OSError:
+        return 0
+    for tid in tasks:
+        try:
+            with open(f"/proc/self/task/{tid}/children") as f:
+                pids = f.read().split()
+        except OSError:
+            continue
+        total += sum(_statm_rss(pid) for pid in pids)
+    return total
+
+
+MEMORY_RSS_BYTES.labels("process").set_function(rss_bytes)
+MEMORY_RSS_BYTES.labels("children").set_function(children_rss_bytes)
+
+
+def estimate_job_bytes(audio_seconds: float) -> int:
+    """Estimated peak memory of one video job with this much audio"""
+    per_second = Config.MEMORY_PER_AUDIO_SECOND_KB * 1024
+    return Config.MEMORY_JOB_BASE_MB * 1024 * 1024 + int(max(audio_seconds, 0.0) * per_second)
+
+
+class MemoryGovernor:
+    """FIFO admission of jobs against a memory budget (event loop only, not thread safe)"""
+
+    def __init__(self, budget_bytes: int):
+        """
+        Args:
+            budget_bytes: Sum of reservations allowed at once; 0 admits every job (reservations are still counted)
+        """
+        self.budget = budget_bytes
+        self.reserved = 0
+        self.jobs = 0
+        self._waiters = deque()  # [size, future] in arrival order
+        MEMORY_BUDGET_BYTES.set(budget_bytes)
+
+    def _fits(self, size: int) -> bool:
+        return not self.budget or self.reserved + size <= self.budget
+
+    def _grant(self, size: int):
+        self.reserved += size
+        self.jobs += 1
+        MEMORY_RESERVED_BYTES.set(self.reserved)
+
+    def _release(self, size: int):
+        self.reserved -= size
+        self.jobs -= 1
+        MEMORY_RESERVED_BYTES.set(self.reserved)
+        self._wake()
+
+    def _wake(self):
+        while self._waiters and self._fits(self._waiters[0][0]):
+            size, future = self._waiters.popleft()
+            if not future.done():
+                self._grant(size)
+                future.set_result(None)
+        MEMORY_ADMISSION_WAITING.set(len(self._waiters))
+
+    @asynccontextmanager
+    async def reserve(self, size: int, timeout: Optional[float] = None, **log_extra):
+        """
+        Hold `size` bytes of the budget while the block runs
+
+        A job larger than the whole budget is admitted once nothing else is
+        reserved, so it runs alone instead of never.
+
+        Raises:
+            MemoryBudgetExceeded: The job waited `timeout` seconds without being admitted
+        """
+        if self.budget:
+            size = min(size, self.budget)
+        if not self._waiters and self._fits(size):
+            self._grant(size)
+            MEMORY_ADMISSIONS.labels("immediate").inc()
+        else:
+            entry = [size, asyncio.get_running_loop().create_future()]
+            self._waiters.append(entry)
+            MEMORY_ADMISSION_WAITING.set(len(self._waiters))
+            logger.info("Waiting for memory budget", extra={
+                "reserve_bytes": size, "reserved_bytes": self.reserved, "waiting": len(self._waiters), **log_extra
+            })
+            try:
+                await asyncio.wait_for(entry[1], timeout)
+            except BaseException as e:
+                if entry[1].done() and not entry[1].cancelled():
+                    self._release(size)  # Admitted just as the wait ended
+                elif entry in self._waiters:
+                    self._waiters.remove(entry)
+                    self._wake()  # A smaller job behind this one may fit now
+                if isinstance(e, asyncio.TimeoutError):
+                    MEMORY_ADMISSIONS.labels("timeout").inc()
+                    raise MemoryBudgetExceeded(
+                        f"Server memory budget busy, job not admitted within {timeout:.0f}s; retry later"
+                    )
+                raise
+            MEMORY_ADMISSIONS.labels("waited").inc()
+        try:
+            yield
+        finally:
+            self._release(size)
+
+    def snapshot(self) -> dict:
+        return {
+            "budget_bytes": self.budget,
+            "reserved_bytes": self.reserved,
+            "jobs": self.jobs,
+            "waiting": len(self._waiters),
+            "rss_bytes": rss_bytes(),
+            "children_rss_bytes": children_rss_bytes(),
+        }
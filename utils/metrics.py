@@ -0,0 +1,255 @@
+"""
+Prometheus metrics for the video processing pipeline
+"""
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+
+# Pipeline stages range from milliseconds (prompt rendering) to minutes (long videos)
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+PIPELINE_STAGE_SECONDS = Histogram(
+    "pipeline_stage_seconds",
+    "Time spent in each pipeline stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+PROVIDER_REQUEST_SECONDS = Histogram(
+    "provider_request_seconds",
+    "Latency of AI provider calls by provider, task and outcome",
+    ["provider", "task", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+PROVIDER_ERRORS = Counter(
+    "provider_errors_total",
+    "AI provider errors by provider, task and error class",
+    ["provider", "task", "error_class"]
+)
+
+LOAD_BALANCER_FALLBACKS = Counter(
+    "load_balancer_fallbacks_total",
+    "Fallbacks taken by the load balancer",
+    ["task", "from_provider", "to_provider"]
+)
+
+MODEL_TIER_SECONDS = Histogram(
+    "model_tier_request_seconds",
+    "Latency of routed AI tasks by model tier (small or large)",
+    ["task", "tier"],
+    buckets=LATENCY_BUCKETS
+)
+
+MODEL_TIER_ESCALATIONS = Counter(
+    "model_tier_escalations_total",
+    "Small tier results escalated to the large tier, by reason (error or invalid)",
+    ["task", "reason"]
+)
+
+PROMPT_BUDGET_DECISIONS = Counter(
+    "prompt_budget_decisions_total",
+    "Transcriptions fitted to a prompt budget, by action (unchanged, deduplicated, condensed, truncated)",
+    ["task", "action"]
+)
+
+PROMPT_TRANSCRIPTION_TOKENS = Histogram(
+    "prompt_transcription_tokens",
+    "Transcription tokens before budgeting",
+    ["task"],
+    buckets=(250, 500, 1000, 2000, 3000, 5000, 8000, 12000, 20000, 32000)
+)
+
+PROVIDER_USAGE = Counter(
+    "provider_usage_total",
+    "Provider usage counted against quotas, by unit (requests, tokens, audio_seconds)",
+    ["provider", "model", "unit"]
+)
+
+QUOTA_REROUTES = Counter(
+    "quota_reroutes_total",
+    "Calls moved off a provider without quota headroom before calling it",
+    ["task", "from_provider", "to_provider"]
+)
+
+QUOTA_DEFERRALS = Counter(
+    "quota_deferrals_total",
+    "Low priority calls delayed until a provider had quota headroom",
+    ["task"]
+)
+
+SHARED_LIMIT_REJECTIONS = Counter(
+    "shared_rate_limit_rejections_total",
+    "Calls refused a provider's cross-replica rate limit tokens (sent elsewhere or delayed)",
+    ["provider"]
+)
+
+PROVIDER_BACKOFFS = Counter(
+    "provider_backoffs_total",
+    "Provider failures reported to the cross-replica backoff state, by error class",
+    ["provider", "error_class"]
+)
+
+SPECULATIVE_TESTS = Counter(
+    "speculative_tests_total",
+    "Speculative technical tests by outcome (generated, used, exists, budget, queue_full, failed)",
+    ["outcome"]
+)
+
+BATCH_ITEMS = Counter(
+    "technical_test_batch_items_total",
+    "Items of technical test batches by outcome (generated, precomputed, duplicate, invalid, failed)",
+    ["outcome"]
+)
+
+BATCH_VIDEOS = Counter(
+    "video_batch_items_total",
+    "Videos of batch uploads by status (ok, error)",
+    ["status"]
+)
+
+UPLOAD_CHUNKS = Counter(
+    "resumable_upload_chunks_total",
+    "Resumable upload chunks by outcome (ok, offset_mismatch, checksum_mismatch, too_large, interrupted)",
+    ["outcome"]
+)
+
+UPLOAD_EXTRACTIONS = Counter(
+    "resumable_upload_extractions_total",
+    "Audio extractions of resumable uploads by mode (early: piped while uploading, complete: after the last chunk)",
+    ["mode"]
+)
+
+MEMORY_BUDGET_BYTES = Gauge(
+    "memory_budget_bytes",
+    "Memory budget video jobs are admitted against"
+)
+
+MEMORY_RESERVED_BYTES = Gauge(
+    "memory_reserved_bytes",
+    "Estimated peak memory reserved by running video jobs"
+)
+
+MEMORY_ADMISSION_WAITING = Gauge(
+    "memory_admission_waiting",
+    "Video jobs waiting for memory budget"
+)
+
+MEMORY_ADMISSIONS = Counter(
+    "memory_admissions_total",
+    "Video job admissions by outcome (immediate, waited, timeout)",
+    ["outcome"]
+)
+
+MEMORY_RSS_BYTES = Gauge(
+    "memory_rss_bytes",
+    "Resident memory by scope (process, children: FFmpeg and transcription workers)",
+    ["scope"]
+)
+
+TENANT_REQUESTS = Counter(
+    "tenant_requests_total",
+    "Requests by tenant and outcome (allowed, limited)",
+    ["tenant", "outcome"]
+)
+
+TENANT_AUDIO_SECONDS = Counter(
+    "tenant_audio_seconds_total",
+    "Seconds of audio admitted per tenant",
+    ["tenant"]
+)
+
+TENANT_QUEUE_SECONDS = Histogram(
+    "tenant_queue_seconds",
+    "Time waiting for a slot of a fair-queued stage (ai, ffmpeg), by tenant",
+    ["tenant", "stage"],
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+)
+
+HTTP_CACHE_RESPONSES = Counter(
+    "http_cache_responses_total",
+    "Cacheable GET responses by endpoint and result (not_modified, full, or the encoding of a static body)",
+    ["endpoint", "result"]
+)
+
+CACHE_REQUESTS = Counter(
+    "cache_requests_total",
+    "Cache lookups by cache name and result (hit/miss)",
+    ["cache", "result"]
+)
+
+EXECUTOR_QUEUE_DEPTH = Gauge(
+    "executor_queue_depth",
+    "Tasks waiting for a worker thread",
+    ["executor"]
+)
+
+IN_FLIGHT_REQUESTS = Gauge(
+    "http_requests_in_flight",
+    "HTTP requests currently being processed"
+)
+
+MONGODB_AVAILABLE = Gauge(
+    "mongodb_available",
+    "1 while the MongoDB connection monitor can reach the server"
+)
+
+UPLOAD_BYTES = Counter(
+    "upload_bytes_total",
+    "Bytes of video received from uploads"
+)
+
+AUDIO_SECONDS = Counter(
+    "audio_processed_seconds_total",
+    "Seconds of audio extracted from videos"
+)
+
+
+@contextmanager
+def track_stage(stage: str):
+    """Observe the duration of a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+def classify_error(error: Exception) -> str:
+    """
+    Map a provider exception to a low-cardinality error class
+
+    Providers wrap SDK errors in generic exceptions, so classification
+    is based on the message like the load balancer's fallback checks.
+    """
+    if isinstance(error, NotImplementedError):
+        return "not_supported"
+
+    message = str(error).lower()
+    if "429" in message or "quota" in message or "rate limit" in message:
+        return "rate_limit"
+    if "timeout" in message or "timed out" in message:
+        return "timeout"
+    if "401" in message or "403" in message or "api key" in message or "unauthorized" in message:
+        return "auth"
+    if "json" in message:
+        return "invalid_response"
+    if "connection" in message or "503" in message or "502" in message:
+        return "unavailable"
+    return "other"
+
+
+def track_executor(name: str, executor):
+    """Report the pending work queue size of a ThreadPoolExecutor"""
+    EXECUTOR_QUEUE_DEPTH.labels(name).set_function(lambda: executor._work_queue.qsize())
+
+
+def render_metrics():
+    """
+    Render all metrics in Prometheus text format
+
+    Returns:
+        Tuple of (payload bytes, content type)
+    """
+    return generate_latest(), CONTENT_TYPE_LATEST
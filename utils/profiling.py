@@ -0,0 +1,264 @@
+"""
+On-demand profiling for live workers
+
+A pure-Python sampling profiler (periodic sys._current_frames() snapshots on a
+background thread) with collapsed-stack and speedscope exports, plus
+tracemalloc snapshots for chasing memory growth. Nothing here runs unless
+PROFILING_ENABLED is set and an admin starts a session.
+"""
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+from typing import Dict, Optional
+
+from utils.logger import setup_logger
+
+logger = setup_logger("profiling")
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval"""
+
+    def __init__(self, interval: float = 0.01, name: str = "profile"):
+        self.id = uuid.uuid4().hex[:12]
+        self.name = name
+        self.interval = interval
+        self.samples = Counter()  # (thread name, stack tuple root->leaf) -> count
+        self.sample_count = 0
+        self.started_at = None
+        self.stopped_at = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def duration(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        return (self.stopped_at or time.time()) - self.started_at
+
+    def start(self, seconds: Optional[float] = None):
+        """Start sampling; stops by itself after `seconds` if given"""
+        self.started_at = time.time()
+        self._thread = threading.Thread(
+            target=self._run, args=(seconds,), name=f"profiler-{self.id}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def _run(self, seconds: Optional[float]):
+        own_ident = threading.get_ident()
+        deadline = time.monotonic() + seconds if seconds else None
+
+        while not self._stop_event.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                self.samples[(names.get(ident, str(ident)), self._stack(frame))] += 1
+            self.sample_count += 1
+
+            if deadline and time.monotonic() >= deadline:
+                break
+
+        self.stopped_at = time.time()
+        logger.info("Profiling session finished", extra={"profile_id": self.id, "samples": self.sample_count})
+
+    @staticmethod
+    def _stack(frame) -> tuple:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_name, code.co_filename, frame.f_lineno))
+            frame = frame.f_back
+        stack.reverse()
+        return tuple(stack)
+
+    @staticmethod
+    def _frame_label(frame: tuple) -> str:
+        func, filename, line = frame
+        return f"{func} ({os.path.basename(filename)}:{line})"
+
+    def to_collapsed(self) -> str:
+        """Brendan Gregg collapsed stacks (input for flamegraph.pl / speedscope)"""
+        lines = []
+        for (thread_name, stack), count in self.samples.most_common():
+            frames = ";".join(self._frame_label(f) for f in stack)
+            lines.append(f"{thread_name};{frames} {count}")
+        return "\n".join(lines) + "\n"
+
+    def to_speedscope(self) -> dict:
+        """Speedscope file format, one sampled profile per thread"""
+        frame_index: Dict[tuple, int] = {}
+        frames = []
+        per_thread: Dict[str, list] = OrderedDict()
+
+        for (thread_name, stack), count in self.samples.items():
+            indices = []
+            for frame in stack:
+                if frame not in frame_index:
+                    frame_index[frame] = len(frames)
+                    frames.append({"name": frame[0], "file": frame[1], "line": frame[2]})
+                indices.append(frame_index[frame])
+            per_thread.setdefault(thread_name, []).append((indices, count * self.interval))
+
+        profiles = []
+        for thread_name, entries in per_thread.items():
+            total = sum(weight for _, weight in entries)
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": [indices for indices, _ in entries],
+                "weights": [weight for _, weight in entries],
+            })
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "video-profile-api",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+    def summary(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "running": self.running,
+            "interval_ms": self.interval * 1000,
+            "samples": self.sample_count,
+            "duration_s": round(self.duration, 3),
+        }
+
+
+class ProfileStore:
+    """Keeps the most recent profiles for download; one live session at a time"""
+
+    def __init__(self, max_profiles: int = 20):
+        self.max_profiles = max_profiles
+        self._profiles = OrderedDict()
+        self._lock = threading.Lock()
+        self.active: Optional[SamplingProfiler] = None
+
+    def add(self, profiler: SamplingProfiler):
+        with self._lock:
+            self._profiles[profiler.id] = profiler
+            while len(self._profiles) > self.max_profiles:
+                self._profiles.popitem(last=False)
+
+    def get(self, profile_id: str) -> Optional[SamplingProfiler]:
+        return self._profiles.get(profile_id)
+
+    def list(self) -> list:
+        return [p.summary() for p in reversed(self._profiles.values())]
+
+    def start_session(self, seconds: float, interval: float) -> SamplingProfiler:
+        """
+        Start a live profiling session
+
+        Raises:
+            RuntimeError: If a session is already running
+        """
+        with self._lock:
+            if self.active is not None and self.active.running:
+                raise RuntimeError(f"Profiling session {self.active.id} is already running")
+            profiler = SamplingProfiler(interval=interval, name=f"session-{int(time.time())}")
+            self.active = profiler
+        self.add(profiler)
+        profiler.start(seconds)
+        logger.info("Profiling session started", extra={"profile_id": profiler.id, "seconds": seconds})
+        return profiler
+
+    def stop_session(self) -> Optional[SamplingProfiler]:
+        profiler = self.active
+        if profiler is not None:
+            profiler.stop()
+            self.active = None
+        return profiler
+
+
+class MemoryTracker:
+    """tracemalloc snapshots with diffs against the previous snapshot"""
+
+    def __init__(self):
+        self._previous = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self, frames: int = 10):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            self._previous = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self._previous = None
+
+    def snapshot(self, limit: int = 25, group_by: str = "lineno", compare: bool = True) -> dict:
+        """
+        Take a snapshot and report the top allocation sites
+
+        Args:
+            limit: Number of entries to report
+            group_by: "lineno", "filename" or "traceback"
+            compare: Also report growth since the previous snapshot
+
+        Raises:
+            RuntimeError: If tracemalloc is not running
+        """
+        if not tracemalloc.is_tracing():
+            raise RuntimeError("tracemalloc is not running")
+
+        with self._lock:
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ))
+            current, peak = tracemalloc.get_traced_memory()
+
+            result = {
+                "traced_current_bytes": current,
+                "traced_peak_bytes": peak,
+                "top": [self._format_stat(stat) for stat in snapshot.statistics(group_by)[:limit]],
+            }
+            if compare and self._previous is not None:
+                result["growth"] = [
+                    self._format_stat(stat, diff=True)
+                    for stat in snapshot.compare_to(self._previous, group_by)[:limit]
+                ]
+            self._previous = snapshot
+
+        return result
+
+    @staticmethod
+    def _format_stat(stat, diff: bool = False) -> dict:
+        entry = {
+            "location": [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            "size_bytes": stat.size,
+            "count": stat.count,
+        }
+        if diff:
+            entry["size_diff_bytes"] = stat.size_diff
+            entry["count_diff"] = stat.count_diff
+        return entry
+
+
+profile_store = ProfileStore()
+memory_tracker = MemoryTracker()
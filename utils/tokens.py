@@ -0,0 +1,87 @@
+"""
+Token counting for routing and prompt budgets
+
+Uses tiktoken (cl100k_base) when it is installed and its encoding can be
+loaded, otherwise a character/word heuristic. Neither matches the Llama or
+Gemini tokenizers exactly; budgets leave a margin for the difference.
+"""
+import json
+import threading
+from config import Config
+from utils.logger import setup_logger
+
+logger = setup_logger("tokens")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken encoding, loaded once; None when unavailable or disabled"""
+    global _encoding, _encoding_loaded
+    if _encoding_loaded:
+        return _encoding
+    with _encoding_lock:
+        if not _encoding_loaded:
+            if Config.TOKENIZER == "tiktoken":
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    logger.info(f"tiktoken unavailable, using heuristic token counts: {e}")
+            _encoding_loaded = True
+    return _encoding
+
+
+def tokenizer_name() -> str:
+    return "tiktoken" if _get_encoding() is not None else "heuristic"
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Approximate token count of a text
+
+    Llama tokenizers average about four characters per token in English and
+    slightly fewer in Spanish, so the larger of the character and word
+    based estimates is used.
+    """
+    if not text:
+        return 0
+    return max(len(text) // 4, int(len(text.split()) * 1.3))
+
+
+def count_tokens(text: str) -> int:
+    """Token count with the local tokenizer, or the heuristic estimate"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of the text within max_tokens, cut at a word boundary"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        prefix = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    else:
+        prefix = text[:max_tokens * 4]
+        while prefix and estimate_tokens(prefix) > max_tokens:
+            prefix = prefix[:int(len(prefix) * 0.9)]
+    cut = prefix.rfind(" ")
+    return prefix[:cut] if cut > 0 else prefix
+
+
+def estimate_input_tokens(*args) -> int:
+    """Tokens of task arguments (strings, or dicts sent as JSON)"""
+    total = 0
+    for arg in args:
+        if isinstance(arg, str):
+            total += count_tokens(arg)
+        elif arg is not None:
+            total += count_tokens(json.dumps(arg, ensure_ascii=False))
+    return total
@@ -0,0 +1,349 @@
+"""
+Request-scoped tracing with nested spans
+
+Spans are kept in memory until the local root span of a trace finishes, then
+the whole trace is either dropped or exported (tail sampling): slow traces
+(above TRACE_SLOW_THRESHOLD_MS) and traces with errors are always kept, the
+rest are sampled at TRACE_SAMPLE_RATE. Export runs on a background thread
+to a JSONL file or an OTLP/HTTP collector (JSON encoding).
+
+Tracing is disabled when TRACE_EXPORTER is "none"; start_span() then
+yields a shared no-op span.
+"""
+import atexit
+import contextvars
+import json
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+from config import Config
+from utils.logger import setup_logger
+
+logger = setup_logger("tracing")
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation within a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "status", "error", "is_local_root", "remote_sampled")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: dict,
+                 is_local_root: bool = False, remote_sampled: bool = False):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.status = "ok"
+        self.error = None
+        self.is_local_root = is_local_root
+        self.remote_sampled = remote_sampled
+
+    def set_attributes(self, **attributes):
+        for key, value in attributes.items():
+            if value is not None:
+                self.attributes[key] = value
+
+    def mark_error(self, message: str):
+        self.status = "error"
+        self.error = message[:500]
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    @property
+    def traceparent(self) -> str:
+        """W3C traceparent header value for propagating this span"""
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "end_ns": self.end_ns,
+            "duration_ms": round(self.duration_ms, 3),
+            "status": self.status,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class _NoopSpan:
+    """Returned when tracing is disabled"""
+
+    trace_id = None
+    span_id = None
+    traceparent = None
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def mark_error(self, message: str):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def parse_traceparent(header: Optional[str]):
+    """
+    Parse a W3C traceparent header
+
+    Returns:
+        Tuple of (trace_id, parent_span_id, sampled) or None if invalid
+    """
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16)
+        int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32:
+        return None
+    return parts[1], parts[2], bool(flags & 0x01)
+
+
+# ---------------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------------
+
+class JsonlExporter:
+    """Append one JSON object per span to a file"""
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: List[Span]):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n")
+
+
+class OtlpHttpExporter:
+    """Send spans to an OTLP/HTTP collector using the JSON encoding"""
+
+    def __init__(self, endpoint: str, service_name: str):
+        self.endpoint = endpoint
+        self.service_name = service_name
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        if isinstance(value, bool):
+            encoded = {"boolValue": value}
+        elif isinstance(value, int):
+            encoded = {"intValue": str(value)}
+        elif isinstance(value, float):
+            encoded = {"doubleValue": value}
+        else:
+            encoded = {"stringValue": str(value)}
+        return {"key": key, "value": encoded}
+
+    def _encode(self, span: Span) -> dict:
+        encoded = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 2 if span.is_local_root else 1,  # SERVER for request roots, INTERNAL otherwise
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [self._attribute(k, v) for k, v in span.attributes.items()],
+            "status": {"code": 2, "message": span.error or ""} if span.status == "error" else {"code": 1},
+        }
+        if span.parent_id:
+            encoded["parentSpanId"] = span.parent_id
+        return encoded
+
+    def export(self, spans: List[Span]):
+        import requests
+
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                "scopeSpans": [{
+                    "scope": {"name": "video_profile_api"},
+                    "spans": [self._encode(span) for span in spans],
+                }],
+            }]
+        }
+        response = requests.post(self.endpoint, json=payload, timeout=5)
+        response.raise_for_status()
+
+
+# ---------------------------------------------------------------------------
+# Tracer
+# ---------------------------------------------------------------------------
+
+class Tracer:
+    """Collects spans per trace and exports sampled traces in the background"""
+
+    # Decisions are remembered briefly so spans ending after their root follow it
+    _DECISION_CACHE_SIZE = 1024
+    # Upper bound on traces waiting for their root span
+    _MAX_PENDING_TRACES = 10000
+
+    def __init__(self, exporter, sample_rate: float, slow_threshold_ms: float, max_queue: int = 1000):
+        self.exporter = exporter
+        self.sample_rate = sample_rate
+        self.slow_threshold_ms = slow_threshold_ms
+        self._pending: Dict[str, List[Span]] = {}
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.dropped = 0
+        self._worker = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+        self._worker.start()
+
+    def start(self, name: str, attributes: dict, traceparent: Optional[str] = None) -> Span:
+        parent = _current_span.get()
+        if parent is not None:
+            return Span(name, parent.trace_id, parent.span_id, attributes)
+
+        remote = parse_traceparent(traceparent)
+        if remote:
+            trace_id, parent_id, sampled = remote
+            return Span(name, trace_id, parent_id, attributes, is_local_root=True, remote_sampled=sampled)
+
+        return Span(name, os.urandom(16).hex(), None, attributes, is_local_root=True)
+
+    def finish(self, span: Span):
+        span.end_ns = time.time_ns()
+
+        with self._lock:
+            if not span.is_local_root:
+                decision = self._decisions.get(span.trace_id)
+                if decision is None:
+                    if span.trace_id not in self._pending and len(self._pending) >= self._MAX_PENDING_TRACES:
+                        self._pending.pop(next(iter(self._pending)))
+                    self._pending.setdefault(span.trace_id, []).append(span)
+                elif decision:
+                    self._enqueue([span])
+                return
+
+            spans = self._pending.pop(span.trace_id, [])
+            spans.append(span)
+            keep = self._should_keep(span, spans)
+            self._decisions[span.trace_id] = keep
+            while len(self._decisions) > self._DECISION_CACHE_SIZE:
+                self._decisions.popitem(last=False)
+
+        if keep:
+            self._enqueue(spans)
+
+    def _should_keep(self, root: Span, spans: List[Span]) -> bool:
+        if root.duration_ms >= self.slow_threshold_ms:
+            return True
+        if any(s.status == "error" for s in spans):
+            return True
+        if root.remote_sampled:
+            return True
+        return random.random() < self.sample_rate
+
+    def _enqueue(self, spans: List[Span]):
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self.dropped += len(spans)
+
+    def _export_loop(self):
+        while True:
+            spans = self._queue.get()
+            if spans is None:
+                break
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                self.dropped += len(spans)
+                logger.warning(f"Trace export failed: {e}")
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush queued traces and stop the exporter thread"""
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._worker.join(timeout)
+
+
+def _create_tracer() -> Optional[Tracer]:
+    exporter_name = Config.TRACE_EXPORTER.lower()
+    if exporter_name == "jsonl":
+        exporter = JsonlExporter(Config.TRACE_JSONL_PATH)
+    elif exporter_name == "otlp":
+        exporter = OtlpHttpExporter(Config.TRACE_OTLP_ENDPOINT, Config.TRACE_SERVICE_NAME)
+    else:
+        return None
+
+    tracer = Tracer(exporter, Config.TRACE_SAMPLE_RATE, Config.TRACE_SLOW_THRESHOLD_MS)
+    atexit.register(tracer.shutdown)
+    logger.info(f"Tracing enabled ({exporter_name})")
+    return tracer
+
+
+_tracer = _create_tracer()
+
+
+def tracing_enabled() -> bool:
+    return _tracer is not None
+
+
+@contextmanager
+def start_span(name: str, traceparent: Optional[str] = None, **attributes):
+    """
+    Open a span as a child of the current one (or a new trace)
+
+    Args:
+        name: Span name, e.g. "ffmpeg" or "provider.transcription"
+        traceparent: Incoming W3C header, only used for root spans
+        **attributes: Span attributes (None values are skipped)
+
+    Yields:
+        The span, so attributes can be added once known
+    """
+    if _tracer is None:
+        yield NOOP_SPAN
+        return
+
+    span = _tracer.start(name, {k: v for k, v in attributes.items() if v is not None}, traceparent)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.mark_error(f"{type(e).__name__}: {e}")
+        raise
+    finally:
+        _current_span.reset(token)
+        _tracer.finish(span)
+
+
+def current_span():
+    """The active span, or a no-op span outside a trace"""
+    return _current_span.get() or NOOP_SPAN
+
+
+def set_span_attributes(**attributes):
+    """Add attributes to the active span"""
+    current_span().set_attributes(**attributes)